@@ -4,12 +4,15 @@
 from operator                   import attrgetter
 from math                       import pi, sqrt, cosh, cos, acos
 import ROOT, os
+import numpy as np
 
 # RootTools
 from RootTools.core.standard     import *
 
 # helpers
 from Analysis.Tools.helpers          import deltaPhi, deltaR2, deltaR, getCollection, getObjDict
+from Analysis.Tools.arrayHelpers     import minDeltaR
+from Analysis.Tools.vectorizedSequence import vectorized
 from Analysis.Tools.WeightInfo       import WeightInfo
 
 from Analysis.Tools.leptonJetArbitration     import cleanJetsAndLeptons
@@ -84,27 +87,30 @@ def isBJet( j, tagger='DeepCSV', year=2016 ):
             raise (NotImplementedError, "Don't know what cut to use for year %s"%year)
 
 def make_jets( event, sample ):
-    event.jets     = [getObjDict(event, 'JetGood_', jetVarNames, i) for i in range(int(event.nJetGood))] 
-    event.bJets    = filter(lambda j:isBJet(j, year=event.year) and abs(j['eta'])<=2.4    , event.jets)
+    event.jets     = getCollection(event, 'JetGood', jetVarNames, 'nJetGood', columnar = True)
+    event.bJets    = event.jets.filter(lambda j:isBJet(j, year=event.year) and abs(j['eta'])<=2.4)
+@vectorized( make_jets )
+def make_jets_chunk( chunk, sample ):
+    chunk.jets     = chunk.JetGood
+    year           = np.repeat( chunk.year, chunk.jets.counts )
+    isB            = np.zeros( len(year), dtype = bool )
+    for y in np.unique( year ):
+        isB[year==y] = isBJet( chunk.jets, year=y )[year==y]
+    chunk.bJets    = chunk.jets.select( isB & (np.abs(chunk.jets['eta'])<=2.4) )
 sequence.append( make_jets )
 
 def get_mll(event, sample):
     event.mll = sqrt(2*(event.l1_pt)*(event.l2_pt)*(cosh(event.l1_eta-event.l2_eta)-cos(event.l1_phi-event.l2_phi)))
+@vectorized( get_mll )
+def get_mll_chunk( chunk, sample ):
+    chunk.mll = np.sqrt(2*(chunk.l1_pt)*(chunk.l2_pt)*(np.cosh(chunk.l1_eta-chunk.l2_eta)-np.cos(chunk.l1_phi-chunk.l2_phi)))
 sequence.append(get_mll)
 
 def getDeltaR(event, sample):
-    if len(event.jets) >= 1:
-        event.minDRjet_l1       = min(deltaR({'eta':event.jets[j]['eta'],  'phi':event.jets[j]['phi']}, {'eta':event.l1_eta, 'phi':event.l1_phi})  for j in range(len(event.jets)) )
-        event.minDRjet_l2       = min(deltaR({'eta':event.jets[j]['eta'],  'phi':event.jets[j]['phi']}, {'eta':event.l2_eta, 'phi':event.l2_phi})  for j in range(len(event.jets)))
-    else: 
-        event.minDRjet_l1      = -1 
-        event.minDRjet_l2      = -1
-    if len(event.bJets) >= 1:
-        event.minDRbjet_l1      = min(deltaR({'eta':event.bJets[b]['eta'], 'phi':event.bJets[b]['phi']}, {'eta':event.l1_eta, 'phi':event.l1_phi}) for b in range(len(event.bJets) ))
-        event.minDRbjet_l2      = min(deltaR({'eta':event.bJets[b]['eta'], 'phi':event.bJets[b]['phi']}, {'eta':event.l2_eta, 'phi':event.l2_phi}) for b in range(len(event.bJets )))
-    else: 
-        event.minDRbjet_l1      = -1 
-        event.minDRbjet_l2      = -1
+    # min deltaR of both leptons to the jets in one call, -1 without jets
+    lep_eta, lep_phi = [event.l1_eta, event.l2_eta], [event.l1_phi, event.l2_phi]
+    event.minDRjet_l1,  event.minDRjet_l2  = minDeltaR( lep_eta, lep_phi, event.jets['eta'],  event.jets['phi'] )
+    event.minDRbjet_l1, event.minDRbjet_l2 = minDeltaR( lep_eta, lep_phi, event.bJets['eta'], event.bJets['phi'] )
 sequence.append(getDeltaR)
 
 all_mva_variables = {
@@ -126,7 +132,7 @@ all_mva_variables = {
      "mva_l1_relIso"                :(lambda event, sample: event.lep_pfRelIso03_all[0]),
      "mva_l2_relIso"                :(lambda event, sample: event.lep_pfRelIso03_all[1]),
 
-     "mva_ht"                    :(lambda event, sample: sum( [j['pt'] for j in event.jets] ) ),
+     "mva_ht"                    :(lambda event, sample: event.jets['pt'].sum() ),
 
      "mva_jet0_pt"               :(lambda event, sample: event.JetGood_pt[0]          if event.nJetGood >=1 else 0),
      "mva_jet0_eta"              :(lambda event, sample: event.JetGood_eta[0]         if event.nJetGood >=1 else -10),
@@ -19,6 +19,7 @@ argParser.add_argument('--config_module',         action='store', type=str, defa
 argParser.add_argument('--config',             action='store', type=str, default = "ttZ_dy_example", help="config")
 argParser.add_argument('--output_directory',   action='store', type=str, default='.')
 argParser.add_argument('--small',              action='store_true')
+argParser.add_argument('--chunkSize',          action='store', type=int, default=0, help="Experimental: run the sequence and the mva variables on chunks of this many events (0, default: event by event). The events are read twice, by the chunks and by the event loop, so this only pays off for expensive sequences.")
 
 args = argParser.parse_args()
 
@@ -70,13 +71,29 @@ if hasattr(sample, "selectionString"):
 # where the output goes
 output_file  = os.path.join( args.output_directory, "MVA-training", subDir, sample.name, sample.name + ".root" )
 
+# ANALYSIS_PROFILE=1 reports the time spent in every sequence step
+import Analysis.Tools.profiling as profiling
+sequence = profiling.profileSequence( config.sequence )
+
 # reader
+read_variables = config.read_variables + ( sample.read_variables if hasattr( sample, "read_variables") else [])
 reader = sample.treeReader( \
     #variables = map( TreeVariable.fromString, config.read_variables),
-    variables = config.read_variables + ( sample.read_variables if hasattr( sample, "read_variables") else []),
-    sequence  = config.sequence,
+    variables = read_variables,
+    # in chunk mode the sequence runs on the chunks, the reader only provides the branches to keep
+    sequence  = sequence if args.chunkSize<=0 else [],
     )
 
+if args.chunkSize>0:
+    # experimental: the chunks read the events in addition to the reader, which still drives the event loop and the kept branches
+    logger.warning( "Chunk mode is experimental and reads the events twice. Compare the timing with --chunkSize 0." )
+    from Analysis.Tools.vectorizedSequence import iterateValues
+    functions = dict( config.all_mva_variables )
+    functions.update( { name:vector_var["func"] for name, vector_var in config.mva_vector_variables.iteritems() } )
+    # same selected events in the same order as the reader
+    chunk_values = iterateValues( sample.chain, read_variables, sequence, functions, chunkSize = args.chunkSize,
+        selection = sample.selectionString if getattr( sample, "selectionString", None ) else "(1)", sequenceArgs = (sample,), functionArgs = (sample,) )
+
 def fill_vector_collection( event, collection_name, collection_varnames, objects, nMax = 100):
     setattr( event, "n"+collection_name, len(objects) )
     for i_obj, obj in enumerate(objects[:nMax]):
@@ -92,14 +109,16 @@ def fill_vector_collection( event, collection_name, collection_varnames, objects
 def filler( event ):
 
     r = reader.event
+    if args.chunkSize>0:
+        values = next( chunk_values )
 
     # copy scalar variables
     for name, func in config.all_mva_variables.iteritems():
-        setattr( event, name, func(r, sample) )
+        setattr( event, name, func(r, sample) if args.chunkSize<=0 else values[name] )
 
     # copy vector variables
     for name, vector_var in config.mva_vector_variables.iteritems():
-        objs = vector_var["func"]( r, sample) 
+        objs = vector_var["func"]( r, sample) if args.chunkSize<=0 else values[name]
         #print name, objs, vector_var['varnames']
         fill_vector_collection( event, name, vector_var['varnames'], objs, nMax = vector_var['nMax'] if vector_var.has_key('nMax') else None )
 
@@ -151,7 +170,8 @@ logger.info( "Starting event loop" )
 counter=0
 while reader.run():
 
-    maker.run()
+    with profiling.section( "filler" ):
+        maker.run()
     counter += 1
     if counter%10000 == 0:
         logger.info("Written %i events.", counter)
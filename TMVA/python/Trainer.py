@@ -68,8 +68,9 @@ class Trainer:
         if not os.path.isdir( self.tmp_mvaWeightDir ):
             os.makedirs( self.tmp_mvaWeightDir )
 
-    def createTestAndTrainingSample( self, read_variables=[], sequence = [], weightString="1", overwrite = False, mva_variables = None):
+    def createTestAndTrainingSample( self, read_variables=[], sequence = [], weightString="1", overwrite = False, mva_variables = None, chunkSize = 0):
         ''' Creates a single background and a single signal sample for training purposes
+            chunkSize > 0: run the sequence and the mva variables on chunks of events (Analysis.Tools.vectorizedSequence)
         '''
         self.read_variables = read_variables
         self.sequence       = sequence 
@@ -135,20 +136,25 @@ class Trainer:
         # Now write a single ntuple with one tree that contains
         # the correct number of background events and also contains isSignal and isTraining
 
+        # Write external variables if needed
+        mva_variables_ = self.mva_variables if mva_variables is None else mva_variables
+
         # make random list of bkg and signal positions of the correct length for random loop:
         sig_bkg_list = []
         for i_sample, sample in enumerate(self.samples):
             sig_bkg_list.extend( [i_sample]*sample.count )
-            sample.reader = sample.treeReader( \
-                variables = map( TreeVariable.fromString, read_variables),
-                )
-            sample.reader.start()
+            if chunkSize > 0:
+                from Analysis.Tools.vectorizedSequence import iterateValues
+                sample.chunk_values = iterateValues( sample.chain, read_variables, self.sequence, mva_variables_, chunkSize = chunkSize,
+                    selection = sample.selectionString if getattr( sample, "selectionString", None ) else "(1)", functionArgs = (None,) )
+            else:
+                sample.reader = sample.treeReader( \
+                    variables = map( TreeVariable.fromString, read_variables),
+                    )
+                sample.reader.start()
 
         random.shuffle(sig_bkg_list)
 
-        # Write external variables if needed
-        mva_variables_ = self.mva_variables if mva_variables is None else mva_variables
-
         def filler( event ):
             # get a random reader
             event.isTraining = isTraining
@@ -156,7 +162,7 @@ class Trainer:
             # write mva variables
             for name, func in mva_variables_.iteritems():
 #                setattr( event, name, func(reader.event) )
-                setattr( event, name, func(reader.event, sample=None) )
+                setattr( event, name, func(reader.event, sample=None) if chunkSize <= 0 else values[name] )
         # Create a maker. Maker class will be compiled. 
         maker = TreeMaker(
             sequence  = [ filler ],
@@ -172,11 +178,14 @@ class Trainer:
         while len(sig_bkg_list):
             # determine random sample
             i_sample = sig_bkg_list.pop(0) 
-            # get its reader
-            reader = self.samples[i_sample].reader
-            reader.run()
-            for func in self.sequence:
-                func(reader.event)
+            if chunkSize > 0:
+                values = next( self.samples[i_sample].chunk_values )
+            else:
+                # get its reader
+                reader = self.samples[i_sample].reader
+                reader.run()
+                for func in self.sequence:
+                    func(reader.event)
             # determine whether training or test
             isTraining = self.samples[i_sample].training_test_list.pop(0) 
             isSignal   = (i_sample == 0)
@@ -0,0 +1,244 @@
+''' NumPy backed TH1 and TH2: bin edges, sum of weights and sum of squared weights of all cells (including under- and overflow)
+    in the order of the ROOT global bin number. Sums, scaling and rebinning of many histograms are done on stacked arrays.
+
+    Usage:
+    histos = [ ArrayHisto.fromTH1( h ) for h in rootHistos ]
+    total  = ArrayHisto.sum( histos ).toTH1()
+    scaled = scaleMany( histos, factors )
+    rebinned = rebinMany( histos, [ [0, 50, 100, 200] ] )   # new x edges, must be a subset of the old ones
+'''
+
+# Standard imports
+import numpy as np
+from array import array
+
+import Analysis.Tools.serialization as serialization
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+# TH1::kNstat
+_nStat = 13
+# number of statistics used by TH1 and TH2
+_nStatDim = { 1:4, 2:7 }
+
+_dtypes = { 'D':'d', 'F':'f4', 'I':'i4', 'S':'i2', 'C':'i1' }
+
+def _axis( axis ):
+    ''' ( nBins, min, max ) of equidistant axes, otherwise the array of bin edges, as in serialization.
+    '''
+    if axis.GetXbins().GetSize() > 0:
+        return _buffer( axis.GetXbins().GetArray(), axis.GetXbins().GetSize(), 'd' )
+    return ( axis.GetNbins(), axis.GetXmin(), axis.GetXmax() )
+
+def _edges( axis ):
+    if isinstance( axis, tuple ):
+        return np.linspace( axis[1], axis[2], axis[0]+1 )
+    return np.asarray( axis, dtype = 'd' )
+
+def _buffer( buf, n, dtype ):
+    ''' Copy n values from a ROOT buffer.
+    '''
+    if n == 0: return np.zeros( 0, dtype = dtype )
+    if hasattr( buf, 'SetSize' ):
+        buf.SetSize( n )
+    elif hasattr( buf, 'reshape' ):
+        buf.reshape( ( n, ) )
+    return np.frombuffer( buf, dtype = dtype, count = n ).astype( 'd' )
+
+class ArrayHisto(object):
+    def __init__( self, axes, sumw, sumw2 = None, entries = 0., stats = None, name = "", title = "", cls = None ):
+        '''
+        axes:  per axis ( nBins, min, max ) or the array of bin edges
+        sumw:  all cells including under- and overflow, length (nx+2)*(ny+2)
+        sumw2: None if the histogram has no Sumw2 (then the errors are sqrt(sumw))
+        stats: array of the TH1 statistics (GetStats), summed and scaled with the histograms
+        '''
+        self.axes    = list( axes )
+        self.sumw    = np.asarray( sumw, dtype = 'd' )
+        self.sumw2   = None if sumw2 is None else np.asarray( sumw2, dtype = 'd' )
+        self.entries = entries
+        self.stats   = stats
+        self.name    = name
+        self.title   = title
+        self.cls     = cls if cls is not None else ( 'TH1D' if len(self.axes) == 1 else 'TH2D' )
+        if len( self.sumw ) != self.nCells:
+            raise ValueError( "Expected %i cells for axes %r, got %i." % ( self.nCells, self.axes, len( self.sumw ) ) )
+
+    @classmethod
+    def fromTH1( cls, h ):
+        ''' TH1 or TH2 (not TH3, TProfile or TH2Poly). Contents are read from the ROOT arrays without a loop over the bins.
+        '''
+        if not h.InheritsFrom('TH1') or h.InheritsFrom('TH3') or h.InheritsFrom('TProfile') or h.InheritsFrom('TH2Poly') or h.InheritsFrom('TProfile2D'):
+            raise TypeError( "Can't convert %s of class %s." % ( h.GetName(), h.ClassName() ) )
+        dimension = 2 if h.InheritsFrom('TH2') else 1
+        axes  = [ h.GetXaxis() ] + ( [ h.GetYaxis() ] if dimension == 2 else [] )
+        n     = h.GetNcells()
+        dtype = _dtypes.get( h.ClassName()[-1] )
+        if dtype is not None and hasattr( h, 'GetArray' ):
+            sumw = _buffer( h.GetArray(), n, dtype )
+        else:
+            sumw = np.array( [ h.GetBinContent(i) for i in range(n) ], dtype = 'd' )
+        sumw2 = _buffer( h.GetSumw2().GetArray(), n, 'd' ) if h.GetSumw2N() > 0 else None
+        stats = array( 'd', [0.]*_nStat )
+        h.GetStats( stats )
+        return cls( [ _axis( axis ) for axis in axes ], sumw, sumw2, entries = h.GetEntries(), stats = np.array( stats[:_nStatDim[dimension]] ),
+                    name = h.GetName(), title = h.GetTitle(), cls = h.ClassName() )
+
+    def toTH1( self, name = None, template = None ):
+        ''' ROOT histogram. With template, a clone of it (keeping style, labels, directory) with the contents of this one,
+            otherwise a new histogram not attached to a directory.
+        '''
+        name = self.name if name is None else name
+        if template is None:
+            h = serialization.to_histo( self.cls, name, self.title, self.axes, self.sumw, self.sumw2, self.entries )
+        else:
+            h = template.Clone( name )
+            h.SetContent( self.sumw )
+            if self.sumw2 is not None:
+                if h.GetSumw2N() == 0: h.Sumw2()
+                h.GetSumw2().Set( len( self.sumw2 ), self.sumw2 )
+        if self.stats is not None:
+            stats = array( 'd', list( self.stats ) + [0.]*( _nStat - len( self.stats ) ) )
+            h.PutStats( stats )
+        # PutStats sets the entries to the sum of weights
+        h.SetEntries( self.entries )
+        return h
+
+    @property
+    def dimension( self ):
+        return len( self.axes )
+
+    @property
+    def edges( self ):
+        return [ _edges( axis ) for axis in self.axes ]
+
+    @property
+    def nCells( self ):
+        return int( np.prod( [ len( e ) + 1 for e in self.edges ] ) )
+
+    @property
+    def shape( self ):
+        ''' numpy shape of the cells, ( ny+2, nx+2 ) in 2D.
+        '''
+        return tuple( len( e ) + 1 for e in reversed( self.edges ) )
+
+    @property
+    def errors( self ):
+        return np.sqrt( self.sumw2 if self.sumw2 is not None else np.abs( self.sumw ) )
+
+    def compatible( self, other, rtol = 1e-10 ):
+        ''' Same dimension, number of bins and bin edges.
+        '''
+        if self.dimension != other.dimension: return False
+        for e1, e2 in zip( self.edges, other.edges ):
+            if len( e1 ) != len( e2 ) or not np.allclose( e1, e2, rtol = rtol, atol = 0 ):
+                return False
+        return True
+
+    def checkCompatible( self, other ):
+        if not self.compatible( other ):
+            raise ValueError( "Inconsistent binning! %s: %r, %s: %r" % ( self.name, self.axes, other.name, other.axes ) )
+
+    def copy( self, sumw = None, sumw2 = None, entries = None, stats = None, axes = None ):
+        return ArrayHisto( self.axes if axes is None else axes, self.sumw.copy() if sumw is None else sumw,
+            ( None if self.sumw2 is None else self.sumw2.copy() ) if sumw2 is None else sumw2,
+            entries = self.entries if entries is None else entries,
+            stats = ( None if self.stats is None else self.stats.copy() ) if stats is None else stats,
+            name = self.name, title = self.title, cls = self.cls )
+
+    @staticmethod
+    def sum( histos ):
+        ''' Sum of compatible histograms, with the name and title of the first one (as TH1::Add of all to a clone of the first).
+        '''
+        sumw, sumw2 = stack( histos )
+        stats = None if any( h.stats is None for h in histos ) else np.sum( [ h.stats for h in histos ], axis = 0 )
+        return histos[0].copy( sumw = sumw.sum( axis = 0 ), sumw2 = None if sumw2 is None else sumw2.sum( axis = 0 ),
+            entries = sum( h.entries for h in histos ), stats = stats )
+
+    def scale( self, factor ):
+        return scaleMany( [ self ], [ factor ] )[0]
+
+    def rebin( self, edges ):
+        return rebinMany( [ self ], edges )[0]
+
+    def __add__( self, other ):
+        return ArrayHisto.sum( [ self, other ] )
+
+    def __repr__( self ):
+        return "ArrayHisto(%s, %s, axes %r)" % ( self.name, self.cls, self.axes )
+
+def stack( histos ):
+    ''' Arrays of shape ( nHistos, nCells ) of sumw and sumw2 of compatible histograms. sumw2 is None if no histogram has
+        Sumw2, otherwise sumw is used for those without (as TH1::Add does).
+    '''
+    for h in histos[1:]:
+        histos[0].checkCompatible( h )
+    sumw = np.vstack( [ h.sumw for h in histos ] )
+    if all( h.sumw2 is None for h in histos ):
+        return sumw, None
+    return sumw, np.vstack( [ h.sumw2 if h.sumw2 is not None else h.sumw for h in histos ] )
+
+def scaleMany( histos, factors ):
+    ''' histos[i] scaled by factors[i], like TH1::Scale (sumw2 is created).
+    '''
+    factors = np.asarray( factors, dtype = 'd' )
+    sumw    = np.vstack( [ h.sumw for h in histos ] )*factors[:,None]
+    sumw2   = np.vstack( [ h.sumw2 if h.sumw2 is not None else h.sumw for h in histos ] )*( factors**2 )[:,None]
+    result  = []
+    for i, h in enumerate( histos ):
+        stats = None
+        if h.stats is not None:
+            stats = h.stats*factors[i]
+            stats[1] *= factors[i]
+        result.append( h.copy( sumw = sumw[i], sumw2 = sumw2[i], stats = stats ) )
+    return result
+
+def _rebinStarts( old, new ):
+    ''' Start cells for np.add.reduceat. Cells below the first ( above the last ) new edge go to the under- ( over- )flow.
+    '''
+    positions = np.searchsorted( old, new )
+    positions = np.minimum( positions, len( old ) - 1 )
+    if len( new ) < 2 or np.any( np.diff( positions ) <= 0 ) or not np.allclose( old[positions], new, rtol = 1e-10, atol = 1e-12 ):
+        raise ValueError( "New bin edges %r must be a subset of the old ones %r." % ( list( new ), list( old ) ) )
+    return np.concatenate( ( [0], positions + 1 ) )
+
+def rebinMany( histos, edges ):
+    ''' Rebin compatible histograms. edges has per axis either the new bin edges (a subset of the old ones), an integer
+        number of bins to merge (remaining bins go to the overflow, as in TH1::Rebin) or None to keep the axis.
+    '''
+    template = histos[0]
+    if len( edges ) != template.dimension:
+        raise ValueError( "Need new edges for %i axes, got %i." % ( template.dimension, len( edges ) ) )
+    sumw, sumw2 = stack( histos )
+    shape = ( len( histos ), ) + template.shape
+    sumw  = sumw.reshape( shape )
+    if sumw2 is not None:
+        sumw2 = sumw2.reshape( shape )
+
+    axes = []
+    for i_axis, ( old, new ) in enumerate( zip( template.edges, edges ) ):
+        if new is None:
+            axes.append( template.axes[i_axis] )
+            continue
+        axis = None
+        if isinstance( new, int ):
+            nBins = ( len( old ) - 1 )//new
+            new   = old[ :nBins*new + 1 : new ]
+            # equidistant axes stay equidistant
+            if isinstance( template.axes[i_axis], tuple ):
+                axis = ( nBins, new[0], new[-1] )
+        new    = np.asarray( new, dtype = 'd' )
+        starts = _rebinStarts( old, new )
+        # x is the last numpy axis
+        numpy_axis = len( shape ) - 1 - i_axis
+        sumw = np.add.reduceat( sumw, starts, axis = numpy_axis )
+        if sumw2 is not None:
+            sumw2 = np.add.reduceat( sumw2, starts, axis = numpy_axis )
+        axes.append( new if axis is None else axis )
+
+    result = []
+    for i, h in enumerate( histos ):
+        result.append( h.copy( sumw = sumw[i].ravel(), sumw2 = None if sumw2 is None else sumw2[i].ravel(), axes = axes ) )
+    return result
@@ -4,6 +4,7 @@
 # Standard imports
 import ROOT, pickle, itertools, os
 from operator import mul
+import numpy as np
 from correctionlib import _core
 
 # Logging
@@ -24,6 +25,51 @@ def toFlavourKey(pdgId):
     if abs(pdgId)==4: return 1
     return 2
 
+def getWeightDict_1b(effs, maxMultBTagWeight):
+    '''Make Weight dictionary for jets: { i:weight of i b tags } for i = 0, ..., maxMultBTagWeight.
+       weight(i) = prod(1-e) * (sum over all combinations of i jets of prod(e/(1-e))). The sums are built up one jet at a
+       time (O(nJets*maxMultBTagWeight)) and are identical to the sums over itertools.combinations for 0, 1 and nJets tags,
+       and equal up to rounding otherwise.
+    '''
+    zeroTagWeight = 1.
+
+    for e in effs:
+        zeroTagWeight*=(1-e)
+
+    nMax   = min(len(effs), maxMultBTagWeight)
+    twfSum = [1.] + [0.]*nMax
+    for x in effs:
+        fac = x/(1-x)
+        # highest multiplicity first, twfSum[i-1] doesn't contain this jet yet
+        for i in range(nMax, 0, -1):
+            twfSum[i] += twfSum[i-1]*fac
+
+    tagWeight={}
+    for i in range(maxMultBTagWeight+1):
+        tagWeight[i] = zeroTagWeight*twfSum[i] if i<=nMax else 0.
+
+    return tagWeight
+
+def getWeightArray_1b(effs, maxMultBTagWeight):
+    '''getWeightDict_1b for many events and variations at once. effs: array ( ..., nJets ), e.g. ( nEvents, nVariations, nJets ),
+       padded with 0 for events with fewer jets. Returns the array ( ..., maxMultBTagWeight+1 ), identical to getWeightDict_1b.
+    '''
+    effs = np.asarray(effs, dtype='d')
+    nJets = effs.shape[-1]
+
+    zeroTagWeight = np.ones(effs.shape[:-1])
+    for k in range(nJets):
+        zeroTagWeight *= (1-effs[...,k])
+
+    twfSum = np.zeros(effs.shape[:-1]+(maxMultBTagWeight+1,))
+    twfSum[...,0] = 1.
+    facs = effs/(1-effs)
+    for k in range(nJets):
+        for i in range(min(k+1, maxMultBTagWeight), 0, -1):
+            twfSum[...,i] += twfSum[...,i-1]*facs[...,k]
+
+    return zeroTagWeight[...,None]*twfSum
+
 #Method 1ab
 #UL Files
 
@@ -89,31 +135,8 @@ sfFile2018DeepJet  = 'b2018_DeepJet_102XSF_V1.csv'
 
 class BTagEfficiency:
 
-    @staticmethod
-    def getWeightDict_1b(effs, maxMultBTagWeight):
-        '''Make Weight dictionary for jets
-        '''
-        zeroTagWeight = 1.
-
-        for e in effs:
-            zeroTagWeight*=(1-e)
-
-        tagWeight={}
-        for i in range(min(len(effs), maxMultBTagWeight)+1):
-            tagWeight[i]=zeroTagWeight
-            twfSum = 0.
-            for tagged in itertools.combinations(effs, i):
-                twf=1.
-                for fac in [x/(1-x) for x in tagged]:
-                    twf*=fac
-                twfSum+=twf
-            tagWeight[i]*=twfSum
-
-        for i in range(maxMultBTagWeight+1):
-            if not tagWeight.has_key(i):
-                tagWeight[i] = 0.
-
-        return tagWeight
+    getWeightDict_1b  = staticmethod(getWeightDict_1b)
+    getWeightArray_1b = staticmethod(getWeightArray_1b)
 
     def getBTagSF_1a(self, var, bJets, nonBJets):
         if var not in self.btagWeightNames:
@@ -2,9 +2,11 @@
 '''
 
 # Standard imports
-import ROOT, pickle, itertools, os
+import ROOT, pickle, itertools, os, bisect
 from operator import mul
+import numpy as np
 from correctionlib import _core
+from Analysis.Tools.BTagEfficiency import getWeightDict_1b, getWeightArray_1b
 
 # Logging
 import logging
@@ -24,6 +26,16 @@ def toFlavourKey(pdgId):
     if abs(pdgId)==4: return 1
     return 2
 
+def toFlavourKey_array(pdgId):
+    absPdgId = np.abs(pdgId)
+    return np.where( absPdgId==5, 0, np.where( absPdgId==4, 1, 2 ) )
+
+# columns of the SF matrix (order of getSF) filled by the variations of the b/c and of the light flavour SF, all others are 'central'
+sfColumns = {
+    'comb': [ ('down', 1), ('up', 2), ('down_correlated', 5), ('up_correlated', 6), ('down_uncorrelated', 9),  ('up_uncorrelated', 10) ],
+    'incl': [ ('down', 3), ('up', 4), ('down_correlated', 7), ('up_correlated', 8), ('down_uncorrelated', 11), ('up_uncorrelated', 12) ],
+}
+
 #Method 1ab
 #UL Files
 
@@ -67,31 +79,8 @@ sfFileULDeepJet  = 'btagging.json'
 
 class BTagEfficiency:
 
-    @staticmethod
-    def getWeightDict_1b(effs, maxMultBTagWeight):
-        '''Make Weight dictionary for jets
-        '''
-        zeroTagWeight = 1.
-
-        for e in effs:
-            zeroTagWeight*=(1-e)
-
-        tagWeight={}
-        for i in range(min(len(effs), maxMultBTagWeight)+1):
-            tagWeight[i]=zeroTagWeight
-            twfSum = 0.
-            for tagged in itertools.combinations(effs, i):
-                twf=1.
-                for fac in [x/(1-x) for x in tagged]:
-                    twf*=fac
-                twfSum+=twf
-            tagWeight[i]*=twfSum
-
-        for i in range(maxMultBTagWeight+1):
-            if not tagWeight.has_key(i):
-                tagWeight[i] = 0.
-
-        return tagWeight
+    getWeightDict_1b  = staticmethod(getWeightDict_1b)
+    getWeightArray_1b = staticmethod(getWeightArray_1b)
 
     def getBTagSF_1a(self, var, bJets, nonBJets):
         if var not in self.btagWeightNames:
@@ -179,22 +168,45 @@ class BTagEfficiency:
         # Load MC efficiency
         logger.info( "Loading MC efficiency %s", self.mcEfficiencyFile )
         self.mcEff = pickle.load( file( self.mcEfficiencyFile ) )
+        self.makeMCEffTable()
+
+        # correction handles, looked up once
+        self.evaluators = { 'comb':self.correction[self.WP + '_comb'], 'incl':self.correction[self.WP + '_incl'] }
+
+    def makeMCEffTable(self):
+        ''' MC efficiencies as array [flavour key, pt bin, eta bin]. The last pt bin has no upper edge.
+        '''
+        for i in range(len(self.etaBins)-1):
+            if self.etaBins[i][1] != self.etaBins[i+1][0]:
+                raise ValueError( "eta bins %r are not contiguous" % self.etaBins )
+        self.etaBorders = [ etaBin[0] for etaBin in self.etaBins ] + [ self.etaBins[-1][1] ]
+        self.mcEffTable = np.ones( ( 3, len(ptBins), len(self.etaBins) ) )
+        for i_pt, ptBin in enumerate(ptBins):
+            for i_eta, etaBin in enumerate(self.etaBins):
+                for flavKey, flavour in enumerate( [ "b", "c", "other" ] ):
+                    self.mcEffTable[flavKey, i_pt, i_eta] = self.mcEff[tuple(ptBin)][tuple(etaBin)][flavour]
 
     def getMCEff(self, pdgId, pt, eta):
         ''' Get MC efficiency for jet
         '''
-        for ptBin in ptBins:
-            if pt>=ptBin[0] and (pt<ptBin[1] or ptBin[1]<0):
-                aeta=abs(eta)
-                for etaBin in self.etaBins:
-                    if abs(aeta)>=etaBin[0] and abs(aeta)<etaBin[1]:
-                        if abs(pdgId)==5:      return  self.mcEff[tuple(ptBin)][tuple(etaBin)]["b"]
-                        elif abs(pdgId)==4:    return  self.mcEff[tuple(ptBin)][tuple(etaBin)]["c"]
-                        else:                  return  self.mcEff[tuple(ptBin)][tuple(etaBin)]["other"]
+        aeta = abs(eta)
+        if pt>=ptBorders[0] and aeta>=self.etaBorders[0] and aeta<self.etaBorders[-1]:
+            return float( self.mcEffTable[toFlavourKey(pdgId), bisect.bisect_right(ptBorders, pt)-1, bisect.bisect_right(self.etaBorders, aeta)-1] )
 
         logger.debug( "No MC efficiency for pt %f eta %f pdgId %i", pt, eta, pdgId)
         return 1
 
+    def getMCEff_array(self, pdgId, pt, eta):
+        ''' getMCEff for arrays of jets
+        '''
+        pt     = np.asarray( pt, dtype = 'd' )
+        absEta = np.abs( np.asarray( eta, dtype = 'd' ) )
+        i_pt   = np.searchsorted( ptBorders, pt, side = 'right' ) - 1
+        i_eta  = np.searchsorted( self.etaBorders, absEta, side = 'right' ) - 1
+        valid  = ( pt >= ptBorders[0] ) & ( absEta >= self.etaBorders[0] ) & ( absEta < self.etaBorders[-1] )
+        effs   = self.mcEffTable[ toFlavourKey_array( pdgId ), np.clip( i_pt, 0, len(ptBins)-1 ), np.clip( i_eta, 0, len(self.etaBins)-1 ) ]
+        return np.where( valid, effs, 1. )
+
     def getSF(self, pdgId, pt, eta):
         working_point = 'M'
         # BTag SF Not implemented below 20 GeV
@@ -227,8 +239,7 @@ class BTagEfficiency:
 
         if abs(pdgId)==5 or abs(pdgId)==4:
             #SF for b/c
-            WP = self.WP + '_comb'
-            self.evaltr = self.correction[WP]
+            self.evaltr = self.evaluators['comb']
             sf      	= sf_fs*self.evaltr.evaluate('central', working_point, abs(pdgId) , abs(eta), pt)
             sf_b_d      = sf_fs*self.evaltr.evaluate('down',    working_point, abs(pdgId) , abs(eta), pt)
             sf_b_u      = sf_fs*self.evaltr.evaluate('up',      working_point, abs(pdgId) , abs(eta), pt)
@@ -244,8 +255,7 @@ class BTagEfficiency:
             sf_l_u_uncor = sf
         else:
             #SF for light flavours
-            WP = self.WP + '_incl'
-            self.evaltr = self.correction[WP]
+            self.evaltr = self.evaluators['incl']
             sf      	= sf_fs*self.evaltr.evaluate('central', working_point, abs(pdgId) , abs(eta), pt)
             sf_b_d  = sf
             sf_b_u  = sf
@@ -284,6 +294,51 @@ class BTagEfficiency:
                 'SF_b_Down_Uncorrelated':mcEff*sf[9], 'SF_b_Up_Uncorrelated':mcEff*sf[10], 'SF_l_Down_Uncorrelated':mcEff*sf[11], 'SF_l_Up_Uncorrelated':mcEff*sf[12],
             }
 
+    def evaluate(self, group, systematic, working_point, flavour, absEta, pt):
+        ''' SF from the 'comb' (b/c) or 'incl' (light) correction for arrays of flavour, |eta| and pt, in one call.
+        '''
+        evaluator = self.evaluators[group]
+        if hasattr( evaluator, 'evalv' ):
+            return np.asarray( evaluator.evalv( systematic, working_point, flavour, absEta, pt ), dtype = 'd' )
+        # correctionlib without vectorized evaluation
+        return np.array( [ evaluator.evaluate( systematic, working_point, f, e, p ) for f, e, p in zip( flavour.tolist(), absEta.tolist(), pt.tolist() ) ], dtype = 'd' )
+
+    def getSF_array(self, pdgId, pt, eta):
+        ''' getSF for arrays of jets, e.g. all jets of a chunk. Returns the matrix ( nJets, nVariations ) with the columns in the
+            order of getSF (the variations of self.btagWeightNames without 'MC'), with one correctionlib call per variation.
+        '''
+        working_point = 'M'
+        flavour = np.abs( np.atleast_1d( pdgId ) ).astype( 'int64' )
+        pt      = np.atleast_1d( pt ).astype( 'd' )
+        absEta  = np.abs( np.atleast_1d( eta ).astype( 'd' ) )
+
+        sf = np.ones( ( len(pt), len(self.btagWeightNames)-1 ) )
+        # BTag SF not implemented below 20 GeV and above absEta 2.4
+        inRange = ( pt >= 20 ) & ( absEta < 2.4 )
+        heavy   = ( flavour == 5 ) | ( flavour == 4 )
+        for group, mask in [ ( 'comb', inRange & heavy ), ( 'incl', inRange & ~heavy ) ]:
+            if not np.any( mask ): continue
+            args = ( flavour[mask], absEta[mask], pt[mask] )
+            # the FastSim SF are 1
+            sf[mask] = self.evaluate( group, 'central', working_point, *args )[:,None]
+            for systematic, column in sfColumns[group]:
+                sf[mask, column] = self.evaluate( group, systematic, working_point, *args )
+        return sf
+
+    def getBTagEff_array(self, pdgId, pt, eta):
+        ''' Matrix ( nJets, len(self.btagWeightNames) ) of the efficiencies in the order of self.btagWeightNames, as j['beff'] of addBTagEffToJet.
+        '''
+        mcEff = self.getMCEff_array( np.atleast_1d( pdgId ), np.atleast_1d( pt ), np.atleast_1d( eta ) )
+        return np.hstack( ( mcEff[:,None], mcEff[:,None]*self.getSF_array( pdgId, pt, eta ) ) )
+
+    def addBTagEffToJets(self, jets):
+        ''' addBTagEffToJet for a list of jets with one evaluation for all of them.
+        '''
+        if len(jets)==0: return
+        effs = self.getBTagEff_array( [ j['hadronFlavour'] for j in jets ], [ j['pt'] for j in jets ], [ j['eta'] for j in jets ] )
+        for j, row in zip( jets, effs.tolist() ):
+            j['beff'] = dict( zip( self.btagWeightNames, row ) )
+
 #Method 1d
 #https://twiki.cern.ch/twiki/bin/view/CMS/BTagShapeCalibration
 #https://twiki.cern.ch/twiki/bin/view/CMS/BTagSFMethods
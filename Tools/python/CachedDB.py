@@ -0,0 +1,129 @@
+''' In-memory read-through cache in front of DirDB, MergingDirDB or ResultsDB.
+    contains( key ) followed by get( key ) costs one lookup in the underlying DB.
+    Values are kept pickled, every get returns a new copy (as reading from the DB does) that callers may modify.
+
+    Usage:
+    cache = CachedDB( DirDB( directory ), maxBytes = 100*1024**2 )
+'''
+
+# Standard imports
+import os
+import cPickle
+from collections import OrderedDict
+
+import Analysis.Tools.dbStats as dbStats
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+# stored for keys that are not found in the underlying DB
+_miss = object()
+
+def hashable( key ):
+    ''' ResultsDB keys are dictionaries. Make them (and lists) usable as dictionary keys.
+    '''
+    if isinstance( key, dict ):
+        return tuple( sorted( (k, hashable(v)) for k, v in key.items() ) )
+    if isinstance( key, (list, tuple) ):
+        return tuple( hashable(k) for k in key )
+    return key
+
+class CachedDB(object):
+    def __init__( self, db, maxBytes = 100*1024**2, cacheMisses = None, checkMtime = False ):
+        '''
+        db:          DirDB, MergingDirDB or ResultsDB instance
+        maxBytes:    Least recently used entries are evicted when the total size of the pickled values exceeds maxBytes
+        cacheMisses: Remember keys that were not found. None: only with checkMtime, otherwise keys added by
+                     other processes would never be seen
+        checkMtime:  Invalidate entries when db.mtime( key ) has changed (stat instead of read)
+        '''
+        self.db          = db
+        self.maxBytes    = maxBytes
+        self.checkMtime  = checkMtime
+        self.cacheMisses = checkMtime if cacheMisses is None else cacheMisses
+
+        # hashable key -> (pickled value, size, mtime)
+        self._cache      = OrderedDict()
+        self.nBytes      = 0
+
+    def __getattr__( self, name ):
+        # everything else, e.g. ResultsDB.database_file, goes to the underlying DB
+        return getattr( self.__dict__['db'], name )
+
+    def _mtime( self, key ):
+        return self.db.mtime( key ) if self.checkMtime else None
+
+    def _store( self, _key, value, mtime ):
+        self._remove( _key )
+        if value is not _miss:
+            try:
+                value = cPickle.dumps( value, cPickle.HIGHEST_PROTOCOL )
+            except Exception as e:
+                logger.debug( "Can't pickle value for key %r, not cached: %r", _key, e )
+                return
+        size = 0 if value is _miss else len( value )
+        if size > self.maxBytes:
+            logger.debug( "Value for key %r with %i bytes is too large to be cached.", _key, size )
+            return
+        self._cache[_key] = ( value, size, mtime )
+        self.nBytes += size
+        while self.nBytes > self.maxBytes:
+            _, ( _, _size, _ ) = self._cache.popitem( last = False )
+            self.nBytes -= _size
+
+    def _remove( self, _key ):
+        if _key in self._cache:
+            self.nBytes -= self._cache.pop( _key )[1]
+
+    def _lookup( self, key, load = True ):
+        ''' The value (a new copy), _miss if it is not found. load=False: anything but _miss if it is found.
+        '''
+        _key  = hashable( key )
+        mtime = self._mtime( key )
+        if _key in self._cache:
+            value, size, _mtime = self._cache.pop( _key )
+            if _mtime == mtime:
+                # move to the end (most recently used)
+                self._cache[_key] = ( value, size, _mtime )
+                return cPickle.loads( value ) if load and value is not _miss else value
+            self.nBytes -= size
+            logger.debug( "Modification time changed for key %r. Reading again.", key )
+        value = self.db.get( key )
+        # DirDB & MergingDirDB return None, ResultsDB returns False if nothing was found
+        if value is None or value is False:
+            if self.cacheMisses: self._store( _key, _miss, mtime )
+            return _miss
+        self._store( _key, value, mtime )
+        return value
+
+    @dbStats.instrument( 'get', lookup = 'one' )
+    def get( self, key ):
+        value = self._lookup( key )
+        if value is _miss:
+            return False if hasattr( self.db, 'database_file' ) else None
+        return value
+
+    @dbStats.instrument( 'contains', lookup = 'one' )
+    def contains( self, key ):
+        return self._lookup( key, load = False ) is not _miss
+
+    def add( self, key, data, *args, **kwargs ):
+        result = self.db.add( key, data, *args, **kwargs )
+        # the DB decides whether it is overwritten, hence read again next time
+        self._remove( hashable( key ) )
+        return result
+
+    def addData( self, key, data, *args, **kwargs ):
+        result = self.db.addData( key, data, *args, **kwargs )
+        self._remove( hashable( key ) )
+        return result
+
+    def invalidate( self, key = None ):
+        ''' Forget the key, or everything.
+        '''
+        if key is None:
+            self._cache.clear()
+            self.nBytes = 0
+        else:
+            self._remove( hashable( key ) )
@@ -1,11 +1,20 @@
 ''' Implementation of a directory based results DB for CMS analyses
 
-
+Files are named after the stable hash of the key, which is the same for all python versions and platforms.
+Entries written with the builtin hash (legacy layout) are still found and can be moved with scripts/migrateDirDB.py.
+New entries are written to a temporary file and then renamed (hard linked, if not overwriting), so readers never see partial files.
 '''
 
 # Standard imports
 import os
-import pickle
+import sys
+import uuid
+import errno
+import shutil
+
+from Analysis.Tools.stableHash import stable_hash
+import Analysis.Tools.serialization as serialization
+import Analysis.Tools.dbStats as dbStats
 
 
 # Logger
@@ -13,11 +22,18 @@ import logging
 logger = logging.getLogger(__name__)
 
 class DirDB:
-    def __init__( self, directory ):
+    def __init__( self, directory, legacy = True, migrate = False, compression = None ):
         '''
         Will create the directory if it doesn't exist 
+        legacy:      Also look for entries stored under the builtin hash of the key
+        migrate:     Move legacy entries to the stable file name when they are read
+        compression: Codec of the serialization module for new entries, None for its default
         '''
-        self.directory = directory
+        self.directory   = directory
+        self.compression = compression
+        # the builtin hash of strings is randomized per process in python3, legacy entries can't be found
+        self.legacy    = legacy and sys.version_info[0] < 3
+        self.migrate   = migrate
         try: # errors can appear in parallel processing
             if not os.path.isdir( self.directory ):
                 os.makedirs( self.directory )
@@ -25,30 +41,90 @@ class DirDB:
             pass
 
     def __get_filename( self, key ):
+        filename = stable_hash(key)
+        return filename[:2] + '/' + filename[2:]
+
+    @staticmethod
+    def legacy_filename( key ):
+        ''' File name from the builtin hash as used before. Only reproducible with the interpreter that wrote it.
+        '''
         filename = str(hash(key))
         if len(filename)>4:
             return filename[:4] + '/' + filename[4:]
         else:
             return filename
 
+    def migrate_key( self, key ):
+        ''' Move the legacy entry of the key to its stable file name. Returns True if something was moved.
+        '''
+        legacy_filename = os.path.join( self.directory, self.legacy_filename(key) )
+        filename        = os.path.join( self.directory, self.__get_filename(key) )
+        if not os.path.isfile( legacy_filename ) or os.path.exists( filename ):
+            return False
+        try: # errors can appear in parallel processing
+            if not os.path.isdir(os.path.dirname( filename )):
+                os.makedirs( os.path.dirname( filename ) )
+        except:
+            pass
+        shutil.move( legacy_filename, filename )
+        logger.debug( "Migrated key %r from %s to %s", key, legacy_filename, filename )
+        return True
+
+    def __find( self, key ):
+        ''' File name of an existing entry, None if there is none.
+        '''
+        filename = os.path.join( self.directory, self.__get_filename(key) )
+        if os.path.exists( filename ):
+            return filename
+        if self.legacy:
+            legacy_filename = os.path.join( self.directory, self.legacy_filename(key) )
+            if os.path.isfile( legacy_filename ):
+                if self.migrate and self.migrate_key( key ):
+                    return filename
+                return legacy_filename
+        return None
+
+    @dbStats.instrument( 'get', lookup = 'one' )
     def get(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
+        return self._get( key )
 
+    def _get(self, key):
+        # not instrumented: the threads of get_many would count the lookups a second time
         result = None
+        filename = self.__find( key )
+        if filename is None:
+            return result
         try:
-            result = pickle.load( file(os.path.join( self.directory, self.__get_filename(key) )) ) 
+            with open( filename, 'rb' ) as _f:
+                blob = _f.read()
+            dbStats.count_bytes( 'DirDB', read = len(blob) )
+            result = serialization.loads( blob ) 
         except IOError:
             # nothing found
             pass
 
         return result
 
+    @dbStats.instrument( 'contains', lookup = 'one' )
     def contains(self, key):
         ''' We got that thing?
         '''
-        return os.path.exists( os.path.join( self.directory, self.__get_filename(key) ) )
+        return self.__find( key ) is not None
+
+    def mtime(self, key):
+        ''' Modification time of the entry, None if it doesn't exist.
+        '''
+        filename = self.__find( key )
+        if filename is None:
+            return None
+        try:
+            return os.path.getmtime( filename )
+        except OSError:
+            return None
 
+    @dbStats.instrument( 'add' )
     def add(self, key, data, overwrite=False):
 
         filename = os.path.join( self.directory, self.__get_filename(key)) 
@@ -59,12 +135,50 @@ class DirDB:
             pass
 
         if not overwrite:
-            if os.path.exists( filename ):
+            if self.__find( key ) is not None:
                 logger.warning( "Already found key '%r'. Do not store data.", key )
                 return data
-        pickle.dump( data, file( filename, 'w' ) )
+
+        # write to a unique file in the same directory, then publish atomically
+        tmp_filename = filename + '.tmp_' + str(uuid.uuid4())
+        blob = serialization.dumps( data, compression = self.compression )
+        dbStats.count_bytes( 'DirDB', written = len(blob) )
+        with open( tmp_filename, 'wb' ) as _f:
+            _f.write( blob )
+            _f.flush()
+            os.fsync( _f.fileno() )
+        try:
+            if overwrite:
+                os.rename( tmp_filename, filename )
+            else:
+                # unlike rename, link fails if another job stored the key in the meantime
+                try:
+                    os.link( tmp_filename, filename )
+                except OSError as e:
+                    if e.errno == errno.EEXIST:
+                        logger.warning( "Already found key '%r'. Do not store data.", key )
+                    elif not os.path.exists( filename ):
+                        # file system without hard links
+                        os.rename( tmp_filename, filename )
+        finally:
+            if os.path.exists( tmp_filename ):
+                os.remove( tmp_filename )
         return data
 
+    @dbStats.instrument( 'get_many', lookup = 'many' )
+    def get_many(self, keys, nThreads = 8):
+        ''' Get the entries for a list of keys, reading with nThreads threads. Returns the list of results.
+        '''
+        if nThreads<=1 or len(keys)<=1:
+            return [ self.get( key ) for key in keys ]
+        from multiprocessing.pool import ThreadPool
+        pool = ThreadPool( min( nThreads, len(keys) ) )
+        try:
+            return pool.map( self._get, keys )
+        finally:
+            pool.close()
+            pool.join()
+
 if __name__ == "__main__":
     import Analysis.Tools.logger as logger
     logger    = logger.get_logger( "DEBUG", logFile = None)
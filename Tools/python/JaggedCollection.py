@@ -0,0 +1,236 @@
+''' Columnar object collections as alternative to the lists of dicts of helpers.getCollection.
+
+    Collection:       One event. One array per variable, e.g. jets['pt'], and lightweight views per object, e.g. jets[0]['pt'].
+    JaggedCollection: Many events. Contiguous arrays of all objects and offsets. jaggedJets[i_event] is the Collection of an event (no copy).
+
+    Usage in a sequence:
+    event.jets = Collection.fromEvent( event, 'JetGood', ['pt', 'eta', 'phi'], 'nJetGood' )
+    ht = sum( j['pt'] for j in event.jets )   # or event.jets['pt'].sum()
+
+    Reading a whole tree (one pass per 4 variables in TTree::Draw):
+    jets = JaggedCollection.fromTree( chain, 'Jet', ['pt', 'eta', 'phi'], 'nJet' )
+'''
+
+# Standard imports
+import numpy as np
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+class ObjectView(object):
+    ''' Object i of a Collection. Behaves like the dicts of helpers.getObjDict.
+    '''
+    __slots__ = [ 'collection', 'i' ]
+
+    def __init__( self, collection, i ):
+        self.collection = collection
+        self.i          = i
+
+    def __getitem__( self, var ):
+        if var == 'index':
+            return self.collection.index[self.i]
+        return self.collection.arrays[var][self.i]
+
+    def __setitem__( self, var, value ):
+        self.collection.set( var, self.i, value )
+
+    def __contains__( self, var ):
+        return var == 'index' or var in self.collection.arrays
+
+    def get( self, var, default = None ):
+        return self[var] if var in self else default
+
+    def keys( self ):
+        return list( self.collection.arrays.keys() ) + ['index']
+
+    def items( self ):
+        return [ ( var, self[var] ) for var in self.keys() ]
+
+    def asDict( self ):
+        return dict( self.items() )
+
+    def __eq__( self, other ):
+        if isinstance( other, ObjectView ):
+            return self.collection is other.collection and self.i == other.i
+        return False
+
+    def __ne__( self, other ):
+        return not self.__eq__( other )
+
+    def __hash__( self ):
+        return hash( ( id(self.collection), self.i ) )
+
+    def __repr__( self ):
+        return repr( self.asDict() )
+
+class Collection(object):
+    ''' Objects of one event. collection['pt'] is the array, collection[i] the view of object i.
+    '''
+    def __init__( self, arrays, index = None ):
+        self.arrays = arrays
+        n = len( next( iter( arrays.values() ) ) ) if len(arrays)>0 else ( len(index) if index is not None else 0 )
+        # position of the objects in the original (unselected) collection, like 'index' of getObjDict
+        self.index  = np.arange( n ) if index is None else index
+
+    @classmethod
+    def fromEvent( cls, c, prefix, variables, counter_variable ):
+        ''' Replacement for helpers.getCollection( c, prefix, variables, counter_variable ).
+            Missing branches give -999, as getVarValue does.
+        '''
+        try:
+            n = int( getattr( c, counter_variable ) )
+        except AttributeError:
+            n = 0
+        arrays = {}
+        for var in variables:
+            try:
+                att = getattr( c, prefix+'_'+var )
+            except AttributeError:
+                arrays[var] = np.full( n, -999 )
+                continue
+            try:
+                arrays[var] = np.array( att[:n] )
+            except TypeError:
+                # buffers that can't be sliced
+                arrays[var] = np.array( [ att[i] for i in range(n) ] )
+        return cls( arrays, index = np.arange( n ) )
+
+    def __len__( self ):
+        return len( self.index )
+
+    def __iter__( self ):
+        for i in range( len(self) ):
+            yield ObjectView( self, i )
+
+    def __getitem__( self, key ):
+        if isinstance( key, str ):
+            if key == 'index': return self.index
+            return self.arrays[key]
+        if isinstance( key, slice ):
+            return self.select( key )
+        if key < 0: key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError( "Object %i out of range for a collection of %i objects." % ( key, len(self) ) )
+        return ObjectView( self, key )
+
+    def __contains__( self, var ):
+        return var == 'index' or var in self.arrays
+
+    def keys( self ):
+        return list( self.arrays.keys() ) + ['index']
+
+    def items( self ):
+        return list( self.arrays.items() ) + [ ( 'index', self.index ) ]
+
+    def set( self, var, i, value ):
+        ''' Set a variable of object i. New variables are zero for all other objects.
+        '''
+        if var not in self.arrays:
+            self.arrays[var] = np.zeros( len(self), dtype = np.asarray( value ).dtype )
+        self.arrays[var][i] = value
+
+    def select( self, mask ):
+        ''' New Collection with the objects selected by a boolean mask, an index array or a slice.
+        '''
+        return Collection( { var:array[mask] for var, array in self.arrays.items() }, index = self.index[mask] )
+
+    def filter( self, func ):
+        ''' Objects for which func( view ) is True, like filter( func, collection ) but as a Collection.
+        '''
+        return self.select( np.array( [ bool( func( obj ) ) for obj in self ], dtype = bool ) )
+
+    def asDicts( self ):
+        ''' The list of dicts of helpers.getCollection.
+        '''
+        return [ obj.asDict() for obj in self ]
+
+    def __repr__( self ):
+        return "Collection(%i objects: %s)" % ( len(self), ", ".join( sorted( self.arrays.keys() ) ) )
+
+def _to_numpy( buf, n ):
+    ''' Copy n doubles from the buffer returned by TTree::GetV1 etc.
+    '''
+    if n == 0: return np.zeros( 0 )
+    if hasattr( buf, 'SetSize' ):
+        buf.SetSize( n )
+    elif hasattr( buf, 'reshape' ):
+        buf.reshape( ( n, ) )
+    return np.frombuffer( buf, dtype = 'd', count = n ).copy()
+
+def drawArrays( tree, expressions, selection, nRows, firstEntry, nEntries ):
+    ''' Evaluate the expressions with TTree::Draw, at most 4 per call. Returns one array per expression.
+    '''
+    estimate = tree.GetEstimate()
+    tree.SetEstimate( nRows + 1 )
+    result = []
+    try:
+        for i in range( 0, len(expressions), 4 ):
+            group = expressions[i:i+4]
+            n = tree.Draw( ":".join( group ), selection, "goff", nEntries, firstEntry )
+            if n < 0:
+                raise ValueError( "Could not draw %s from tree %s." % ( ":".join( group ), tree.GetName() ) )
+            getters = [ tree.GetV1, tree.GetV2, tree.GetV3, tree.GetV4 ]
+            result.extend( _to_numpy( getters[j](), n ) for j in range( len(group) ) )
+    finally:
+        tree.SetEstimate( estimate )
+    return result
+
+class JaggedCollection(object):
+    ''' Objects of many events: arrays[var] has all objects of all events, those of event i are at offsets[i]:offsets[i+1].
+    '''
+    def __init__( self, arrays, offsets, index = None ):
+        self.arrays  = arrays
+        self.offsets = np.asarray( offsets, dtype = 'i8' )
+        # position of every object in its event before any selection
+        self.index   = self.local_index() if index is None else index
+        for var, array in self.arrays.items():
+            if len( array ) != self.offsets[-1]:
+                raise ValueError( "Variable %s has %i entries, but the offsets require %i." % ( var, len(array), self.offsets[-1] ) )
+
+    @classmethod
+    def fromCounts( cls, counts, arrays, index = None ):
+        return cls( arrays, np.concatenate( ( [0], np.cumsum( counts, dtype = 'i8' ) ) ), index = index )
+
+    @classmethod
+    def fromTree( cls, tree, prefix, variables, counter_variable, selection = "(1)", firstEntry = 0, nEntries = None ):
+        ''' Read the branches prefix_var of all (selected) events. Values are doubles.
+        '''
+        if nEntries is None:
+            nEntries = tree.GetEntries() - firstEntry
+        counts,  = drawArrays( tree, [ counter_variable ], selection, nEntries, firstEntry, nEntries )
+        counts   = counts.astype( 'i8' )
+        contents = drawArrays( tree, [ prefix+'_'+var for var in variables ], selection, int( counts.sum() ), firstEntry, nEntries )
+        return cls.fromCounts( counts, dict( zip( variables, contents ) ) )
+
+    @property
+    def counts( self ):
+        return np.diff( self.offsets )
+
+    def __len__( self ):
+        return len( self.offsets ) - 1
+
+    def __getitem__( self, key ):
+        ''' jagged['pt'] is the flat array of all objects, jagged[i_event] the Collection of an event.
+        '''
+        if isinstance( key, str ):
+            if key == 'index': return self.index
+            return self.arrays[key]
+        start, stop = self.offsets[key], self.offsets[key+1]
+        return Collection( { var:array[start:stop] for var, array in self.arrays.items() }, index = self.index[start:stop] )
+
+    def select( self, mask ):
+        ''' New JaggedCollection with the objects selected by a boolean mask over all objects, e.g. jagged['pt']>30.
+        '''
+        mask   = np.asarray( mask, dtype = bool )
+        counts = np.bincount( np.repeat( np.arange( len(self) ), self.counts )[mask], minlength = len(self) )
+        return JaggedCollection.fromCounts( counts, { var:array[mask] for var, array in self.arrays.items() }, index = self.index[mask] )
+
+    def __iter__( self ):
+        for i_event in range( len(self) ):
+            yield self[i_event]
+
+    def local_index( self ):
+        ''' Index of every object within its event.
+        '''
+        return np.arange( self.offsets[-1] ) - np.repeat( self.offsets[:-1], self.counts )
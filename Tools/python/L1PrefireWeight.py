@@ -9,60 +9,69 @@ https://twiki.cern.ch/twiki/bin/viewauth/CMS/L1ECALPrefiringWeightRecipe
 
 import os
 import math
-from Analysis.Tools.helpers import getObjFromFile, deltaR
+import numpy as np
+from Analysis.Tools.helpers import deltaR
+import Analysis.Tools.binnedCorrections as binnedCorrections
 
 class L1PrefireWeight:
     def __init__(self, year, syst=0.2):
         if year == 2016:
-            self.phEff  = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_photonpt_2016BtoH.root'), 'L1prefiring_photonpt_2016BtoH')
-            self.jetEff = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_jetpt_2016BtoH.root'), 'L1prefiring_jetpt_2016BtoH')
+            self.phEff  = binnedCorrections.getTable('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_photonpt_2016BtoH.root', 'L1prefiring_photonpt_2016BtoH')
+            self.jetEff = binnedCorrections.getTable('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_jetpt_2016BtoH.root', 'L1prefiring_jetpt_2016BtoH')
         elif year == 2017:
-            self.phEff  = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_photonpt_2017BtoF.root'), 'L1prefiring_photonpt_2017BtoF')
-            self.jetEff = getObjFromFile(os.path.expandvars('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_jetpt_2017BtoF.root'), 'L1prefiring_jetpt_2017BtoF')
+            self.phEff  = binnedCorrections.getTable('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_photonpt_2017BtoF.root', 'L1prefiring_photonpt_2017BtoF')
+            self.jetEff = binnedCorrections.getTable('$CMSSW_BASE/src/Analysis/Tools/data/L1Prefiring/L1prefiring_jetpt_2017BtoF.root', 'L1prefiring_jetpt_2017BtoF')
         else:
             self.phEff  = None
             self.jetEff = None
 
+        # x=eta, y=pt
         if self.phEff:
-            self.maxPtG = self.phEff.GetYaxis().GetXmax()
-            self.maxPtJ = self.jetEff.GetYaxis().GetXmax()
+            self.maxPtG = self.phEff.yEdges[-1]
+            self.maxPtJ = self.jetEff.yEdges[-1]
         self.rel_syst = syst
 
+    def getRates(self, table, objects, maxPt):
+        ''' Clamped pt and ( rate, stat. uncertainty ) of all objects, in one lookup.
+        '''
+        if len(objects) == 0: return [], [], []
+        pt = np.array( [ o['pt'] for o in objects ], dtype = 'd' )
+        pt = np.where( pt < maxPt, pt, maxPt - 1. )
+        rate, rate_stat = table.lookup( np.array( [ o['eta'] for o in objects ], dtype = 'd' ), pt )
+        return pt.tolist(), rate.tolist(), rate_stat.tolist()
+
     def getWeight(self, photons, jets):
         weight          = 1.
         weightUp        = 1.
         weightDown      = 1.
         overlapIndices  = []
 
-        for jet in jets:
+        # no prefiring maps for this year
+        if self.phEff is None: return weight, weightUp, weightDown
+
+        pt_js, prefRateJets, prefRateJets_stat = self.getRates( self.jetEff, jets,    self.maxPtJ )
+        pt_gs, prefRatePhs,  prefRatePhs_stat  = self.getRates( self.phEff,  photons, self.maxPtG )
+
+        for i_jet, jet in enumerate(jets):
             if not 2.0 <= abs(jet['eta']) <= 3.0:
                 continue
-            
-            pt_j = jet['pt']    if jet['pt']    < self.maxPtJ else self.maxPtJ - 1.
+
+            pt_j = pt_js[i_jet]
             if pt_j < 20: continue
-            cleanJet = True
 
-            # get overlap with photons
+            prefRate      = prefRateJets[i_jet]
+            prefRate_stat = prefRateJets_stat[i_jet]
+
+            # get overlap with photons, the last overlapping photon decides
             for i,photon in enumerate(photons):
                 if deltaR(photon, jet)<0.4:
-                    cleanJet = False
                     overlapIndices.append(i)
-                    pt_g = photon['pt'] if photon['pt'] < self.maxPtG else self.maxPtG - 1.
-                    prefRatePh          = self.phEff.GetBinContent(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                    prefRatePh_stat     = self.phEff.GetBinError(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                    prefRateJet         = self.jetEff.GetBinContent(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
-                    prefRateJet_stat    = self.jetEff.GetBinError(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
-
-                    if prefRatePh > prefRateJet:
-                        prefRate = prefRatePh
-                        prefRate_stat = prefRatePh_stat
+                    if prefRatePhs[i] > prefRateJets[i_jet]:
+                        prefRate      = prefRatePhs[i]
+                        prefRate_stat = prefRatePhs_stat[i]
                     else:
-                        prefRate = prefRateJet
-                        prefRate_stat = prefRateJet_stat
-
-            if cleanJet:
-                prefRate        = self.jetEff.GetBinContent(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
-                prefRate_stat   = self.jetEff.GetBinError(self.jetEff.GetXaxis().FindBin(jet['eta']), self.jetEff.GetYaxis().FindBin(pt_j))
+                        prefRate      = prefRateJets[i_jet]
+                        prefRate_stat = prefRateJets_stat[i_jet]
 
             weight      *= (1 - prefRate)
             weightUp    *= (1 - min(1, prefRate + math.sqrt(prefRate_stat**2 + (self.rel_syst * prefRate)**2) ) )
@@ -71,14 +80,12 @@ class L1PrefireWeight:
 
         for i, photon in enumerate(photons):
             if i not in overlapIndices:
-                pt_g = photon['pt'] if photon['pt'] < self.maxPtG else self.maxPtG - 1.
-                if pt_g < 20: continue
-                prefRatePh          = self.phEff.GetBinContent(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                prefRatePh_stat     = self.phEff.GetBinError(self.phEff.GetXaxis().FindBin(photon['eta']), self.phEff.GetYaxis().FindBin(pt_g))
-                
+                if pt_gs[i] < 20: continue
+                prefRatePh          = prefRatePhs[i]
+                prefRatePh_stat     = prefRatePhs_stat[i]
+
                 weight      *= (1 - prefRatePh )
                 weightUp    *= (1 - min(1, prefRatePh + math.sqrt(prefRatePh_stat**2 + (self.rel_syst * prefRatePh)**2) ) )
                 weightDown  *= (1 - max(0, prefRatePh - math.sqrt(prefRatePh_stat**2 + (self.rel_syst * prefRatePh)**2) ) )
 
         return weight, weightUp, weightDown
-
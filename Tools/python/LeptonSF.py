@@ -1,9 +1,10 @@
 import ROOT
 import os
 from math import sqrt
+import numpy as np
 
-from Analysis.Tools.helpers import getObjFromFile
-from Analysis.Tools.u_float import u_float
+import Analysis.Tools.binnedCorrections as binnedCorrections
+from Analysis.Tools.lookupTable import LookupTable2D
 
 # 2016 Lumi Ratios
 lumiRatio2016_BCDEF = 19.695422959 / 35.921875595
@@ -104,15 +105,14 @@ class LeptonSF:
             if not ID in keys_ele2016.keys():
                 raise Exception("Don't know ID %s"%ID)
 
-            self.mu_BCDEF = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_BCDEF[ID]              ]
-            self.mu_GH    = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_GH[ID]                 ]
-            self.mu_BCDEF_stat = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_BCDEF[ID+"_stat"] ]
-            self.mu_GH_stat    = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_GH[ID+"_stat"]    ]
-            self.mu_BCDEF_syst = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_BCDEF[ID+"_syst"] ]
-            self.mu_GH_syst    = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2016_GH[ID+"_syst"]    ]
-            self.ele      = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_ele2016[ID]                   ]
-
-            for effMap in self.mu_BCDEF + self.mu_GH + self.ele + self.mu_BCDEF_stat + self.mu_BCDEF_syst + self.mu_GH_stat + self.mu_GH_syst: assert effMap
+            # lumi weighted ID x ISO, x=eta, y=pt
+            self.mu_tables = {}
+            for unc, suffix in [ ( "nominal", "" ), ( "stat", "_stat" ), ( "syst", "_syst" ) ]:
+                self.mu_tables[unc] = LookupTable2D.combine( [
+                    ( lumiRatio2016_BCDEF, self.getProduct( keys_mu2016_BCDEF[ID+suffix] ) ),
+                    ( lumiRatio2016_GH,    self.getProduct( keys_mu2016_GH[ID+suffix] ) ),
+                    ] )
+            self.ele_table = self.getProduct( keys_ele2016[ID] )
 
         elif year == 2017:
 
@@ -122,12 +122,9 @@ class LeptonSF:
             if not ID in keys_ele2017.keys():
                 raise Exception("Don't know ID %s"%ID)
 
-            self.mu       = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2017[ID]         ]
-            self.mu_stat  = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2017[ID+"_stat"] ]
-            self.mu_syst  = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2017[ID+"_syst"] ]
-            self.ele      = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_ele2017[ID]        ]
-
-            for effMap in self.mu + self.ele + self.mu_stat + self.mu_syst: assert effMap
+            # x=pt, y=|eta|
+            self.mu_tables = { unc:self.getProduct( keys_mu2017[ID+suffix] ) for unc, suffix in [ ( "nominal", "" ), ( "stat", "_stat" ), ( "syst", "_syst" ) ] }
+            self.ele_table = self.getProduct( keys_ele2017[ID] )
 
         elif year == 2018:
 
@@ -137,24 +134,49 @@ class LeptonSF:
             if not ID in keys_ele2018.keys():
                 raise Exception("Don't know ID %s"%ID)
 
-            self.mu       = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2018[ID]         ]
-            self.mu_stat  = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2018[ID+"_stat"] ]
-            self.mu_syst  = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_mu2018[ID+"_syst"] ]
-            self.ele      = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in keys_ele2018[ID]        ]
+            # x=pt, y=|eta|
+            self.mu_tables = { unc:self.getProduct( keys_mu2018[ID+suffix] ) for unc, suffix in [ ( "nominal", "" ), ( "stat", "_stat" ), ( "syst", "_syst" ) ] }
+            self.ele_table = self.getProduct( keys_ele2018[ID] )
+
+    def getProduct( self, keys ):
+        return binnedCorrections.getProduct( [ ( os.path.join( self.dataDir, file ), key ) for ( file, key ) in keys ] )
 
-            for effMap in self.ele + self.mu + self.mu_stat + self.mu_syst: assert effMap
+    def getSF_array( self, pdgId, pt, eta, sigma=0, unc="nominal" ):
+        ''' getSF for arrays of leptons, e.g. all leptons of a chunk.
+        '''
+        shape = np.shape( pt )
+        pdgId = np.abs( np.atleast_1d( pdgId ) )
+        pt    = np.atleast_1d( pt ).astype( 'd' )
+        eta   = np.atleast_1d( eta ).astype( 'd' )
 
-    def getPartialSF( self, effMap, pt, eta, reversed=False ):
-        x = eta if not reversed else pt
-        y = pt  if not reversed else eta
-        sf  = effMap.GetBinContent( effMap.FindBin(x, y) )
-        err = effMap.GetBinError(   effMap.FindBin(x, y) )
-        return u_float(sf, err)
+        if not np.all( ( pdgId == 11 ) | ( pdgId == 13 ) ):
+            raise Exception("Lepton SF for PdgId %r not known"%np.unique( pdgId[ ( pdgId != 11 ) & ( pdgId != 13 ) ] ))
 
-    def mult( self, list ):
-        res = list[0]
-        for i in list[1:]: res = res*i
-        return res
+        if not unc in ["nominal", "stat", "syst"]:
+            raise Exception("Don't know uncertainty %s"%unc)
+
+        if np.any( pdgId == 11 ) and unc != "nominal":
+            raise Exception("Stat and syst uncertainty only implemented for muons")
+
+        sf = np.ones( pt.shape )
+        isMu  = pdgId == 13
+        if np.any( isMu ):
+            mu_pt = np.where( pt[isMu] >= 120, 119, np.where( pt[isMu] <= 20, 21, pt[isMu] ) )
+            if self.year == 2016:
+                mu_eta = np.where( eta[isMu] >= 2.4, 2.39, np.where( eta[isMu] <= -2.4, -2.39, eta[isMu] ) )
+                sf[isMu] = self.mu_tables[unc]( mu_eta, mu_pt, sigma = sigma )
+            else:
+                absEta = np.abs( eta[isMu] )
+                absEta = np.where( absEta >= 2.4, 2.39, absEta )
+                sf[isMu] = self.mu_tables[unc]( mu_pt, absEta, sigma = sigma )
+
+        isEle = pdgId == 11
+        if np.any( isEle ):
+            ele_pt  = np.where( pt[isEle] >= 500, 499, np.where( pt[isEle] <= 10, 11, pt[isEle] ) )
+            ele_eta = np.where( eta[isEle] >= 2.5, 2.49, np.where( eta[isEle] <= -2.5, -2.49, eta[isEle] ) )
+            sf[isEle] = self.ele_table( ele_eta, ele_pt, sigma = sigma )
+
+        return sf.reshape( shape )
 
     def getSF(self, pdgId, pt, eta, sigma=0, unc="nominal"):
 
@@ -167,74 +189,23 @@ class LeptonSF:
         if abs(pdgId) == 11 and unc != "nominal":
             raise Exception("Stat and syst uncertainty only implemented for muons")
 
-        if self.year == 2016 and abs(pdgId) == 13:
+        # same clamping as getSF_array
+        if abs(pdgId) == 13:
             if   pt  >=  120: pt  =   119
-            if   pt  <=   20: pt  =    21
-            if   eta >=  2.4: eta =  2.39 
-            elif eta <= -2.4: eta = -2.39 
-
-            if unc == "nominal":
-                mu_BCDEF = self.mu_BCDEF
-                mu_GH    = self.mu_GH
-            elif unc == "stat":
-                mu_BCDEF = self.mu_BCDEF_stat
-                mu_GH    = self.mu_GH_stat
-            elif unc == "syst":
-                mu_BCDEF = self.mu_BCDEF_syst
-                mu_GH    = self.mu_GH_syst
-
-            sf_BCDEF = self.mult( [self.getPartialSF(effMap, pt, eta) for effMap in mu_BCDEF] )
-            sf_GH    = self.mult( [self.getPartialSF(effMap, pt, eta) for effMap in mu_GH] )
-            sf       = sf_BCDEF*lumiRatio2016_BCDEF + sf_GH*lumiRatio2016_GH
-#            print "B", sf_BCDEF, "G", sf_GH, "SF", sf
-
-#            print "BID", [self.getPartialSF(effMap, pt, eta) for effMap in self.mu_BCDEF][0]
-#            print "BIso", [self.getPartialSF(effMap, pt, eta) for effMap in self.mu_BCDEF][1]
-
-#            print "GID", [self.getPartialSF(effMap, pt, eta) for effMap in self.mu_GH][0]
-#            print "GIso", [self.getPartialSF(effMap, pt, eta) for effMap in self.mu_GH][1]
-
-        elif self.year == 2018 and abs(pdgId) == 13:
+            elif pt  <=   20: pt  =    21
+            if self.year == 2016:
+                if   eta >=  2.4: eta =  2.39
+                elif eta <= -2.4: eta = -2.39
+                return self.mu_tables[unc].at( eta, pt, sigma )
             absEta = abs(eta)
-            if pt     >= 120: pt     = 119
-            if pt     <= 20:  pt     = 21
-            if absEta >= 2.4: absEta = 2.39 
-
-            if unc == "nominal":
-                mu = self.mu
-            elif unc == "stat":
-                mu = self.mu_stat
-            elif unc == "syst":
-                mu = self.mu_syst
-
-            sf = self.mult( [ self.getPartialSF( effMap, pt, absEta, reversed=True ) for effMap in mu ] )
-
-        else:
-            if abs(pdgId) == 13:
-                absEta = abs(eta)
-                if pt     >= 120: pt     =  119
-                if pt     <=  20: pt     =   21
-                if absEta >= 2.4: absEta = 2.39 
-
-                if unc == "nominal":
-                    mu = self.mu
-                elif unc == "stat":
-                    mu = self.mu_stat
-                elif unc == "syst":
-                    mu = self.mu_syst
-
-                sf = self.mult( [ self.getPartialSF( effMap, pt, absEta, reversed=True ) for effMap in mu ] )
-
-            elif abs(pdgId) == 11:
-                if   pt  >=  500: pt  =   499
-                if   pt  <=   10: pt  =    11
-                if   eta >=  2.5: eta =  2.49 
-                elif eta <= -2.5: eta = -2.49 
-
-                sf = self.mult( [ self.getPartialSF( effMap, pt, eta ) for effMap in self.ele ] )
-
-        return sf.val + sigma*sf.sigma
-
+            if absEta >= 2.4: absEta = 2.39
+            return self.mu_tables[unc].at( pt, absEta, sigma )
+
+        if   pt  >=  500: pt  =   499
+        elif pt  <=   10: pt  =    11
+        if   eta >=  2.5: eta =  2.49
+        elif eta <= -2.5: eta = -2.49
+        return self.ele_table.at( eta, pt, sigma )
 
 if __name__ == "__main__":
 
@@ -1,8 +1,10 @@
 import ROOT
 import os
+import numpy as np
 
 
-from Analysis.Tools.helpers import getObjFromFile
+import Analysis.Tools.binnedCorrections as binnedCorrections
+from Analysis.Tools.lookupTable import LookupTable2D
 
 
 
@@ -32,57 +34,83 @@ class LeptonSF:
         self.dataDir = "$CMSSW_BASE/src/Analysis/Tools/data/leptonSFData/LeptonMva_v1"
         self.era = era
 
-        self.SFmaps = {
-            "elec" : {
-                "SF" :  getObjFromFile(self.dataDir+"/"+self.era+"/"+maps_el[elID],"EGamma_SF2D"),
-                "syst": getObjFromFile(self.dataDir+"/"+self.era+"/"+maps_el[elID],"sys"),
-                "stat": getObjFromFile(self.dataDir+"/"+self.era+"/"+maps_el[elID],"stat"),
-            },
-            "muon" : {
-                "SF" :  [getObjFromFile(os.path.expandvars(os.path.join(self.dataDir+"/"+self.era, file)), key) for (file, key) in maps_mu[muID]],
-                "syst": [getObjFromFile(os.path.expandvars(os.path.join(self.dataDir+"/"+self.era, file)), key+"_syst") for (file, key) in maps_mu[muID]],
-                "stat": [getObjFromFile(os.path.expandvars(os.path.join(self.dataDir+"/"+self.era, file)), key+"_stat") for (file, key) in maps_mu[muID]],
-            }
+        eraDir = os.path.join( self.dataDir, self.era )
+        # x=eta (muons: |eta|), y=pt. The electron uncertainties are the contents of the syst and stat maps, the muon uncertainties the bin errors.
+        self.tables = {
+            "elec" : self.withUncertainties( ( os.path.join( eraDir, maps_el[elID] ), "EGamma_SF2D" ),
+                        { "syst":( os.path.join( eraDir, maps_el[elID] ), "sys" ), "stat":( os.path.join( eraDir, maps_el[elID] ), "stat" ) }, fromContent = True ),
+            "muon" : self.withUncertainties( ( os.path.join( eraDir, maps_mu[muID][0][0] ), maps_mu[muID][0][1] ),
+                        { uncert:( os.path.join( eraDir, maps_mu[muID][0][0] ), maps_mu[muID][0][1]+"_"+uncert ) for uncert in [ "syst", "stat" ] } ),
         }
 
+    @staticmethod
+    def withUncertainties( sfMap, uncMaps, fromContent = False ):
+        ''' { uncert:table } with the values of sfMap and the errors (or, with fromContent, the contents) of the uncertainty maps.
+        '''
+        sfTable = binnedCorrections.getTable( *sfMap )
+        tables  = {}
+        for uncert, uncMap in uncMaps.items():
+            uncTable = binnedCorrections.getTable( *uncMap )
+            if uncTable.values.shape != sfTable.values.shape:
+                raise Exception("Inconsistent binning of %s and %s"%(sfMap[1], uncMap[1]))
+            tables[uncert] = LookupTable2D( sfTable.xEdges, sfTable.yEdges, sfTable.values, uncTable.values if fromContent else uncTable.errors )
+        return tables
+
+    def getSF_array(self, pdgId, pt, eta, unc='syst', sigma=0):
+        ''' getSF for arrays of leptons, e.g. all leptons of a chunk.
+        '''
+        uncert = "syst"
+        if unc == "stat":
+            uncert = "stat"
+        shape = np.shape( pt )
+        pdgId = np.abs( np.atleast_1d( pdgId ) )
+        pt    = np.atleast_1d( pt ).astype( 'd' )
+        eta   = np.atleast_1d( eta ).astype( 'd' )
+
+        if not np.all( ( pdgId == 11 ) | ( pdgId == 13 ) ):
+            raise Exception("Lepton SF for PdgId %r not known"%np.unique( pdgId[ ( pdgId != 11 ) & ( pdgId != 13 ) ] ))
+
+        sf = np.ones( pt.shape )
+        isEle = pdgId == 11
+        if np.any( isEle ):
+            ele_eta = np.where( eta[isEle] > 2.5, 2.49, np.where( eta[isEle] < -2.5, -2.49, eta[isEle] ) )
+            ele_pt  = np.where( pt[isEle] > 200, 199, pt[isEle] )
+            sf[isEle] = self.tables["elec"][uncert]( ele_eta, ele_pt, sigma = sigma )
+
+        isMu = pdgId == 13
+        if np.any( isMu ):
+            mu_eta = np.abs( eta[isMu] )
+            mu_eta = np.where( mu_eta > 2.4, 2.39, mu_eta )
+            mu_pt  = np.where( pt[isMu] > 120, 119, pt[isMu] )
+            sf[isMu] = self.tables["muon"][uncert]( mu_eta, mu_pt, sigma = sigma )
+
+        return sf.reshape( shape )
 
     def getSF(self, pdgId, pt, eta, unc='syst', sigma=0):
         uncert = "syst"
         if unc == "stat":
             uncert = "stat"
-        lepton = None
+        # same clamping as getSF_array
         if abs(pdgId)==11:
-            lepton = "elec"
             if eta > 2.5:
                 eta = 2.49
-            if eta < -2.5:
+            elif eta < -2.5:
                 eta = -2.49
             if pt > 200:
                 pt = 199
-
-            etabin = self.SFmaps[lepton]["SF"].GetXaxis().FindBin(eta)
-            ptbin  = self.SFmaps[lepton]["SF"].GetYaxis().FindBin(pt)
-            SF = self.SFmaps[lepton]["SF"].GetBinContent(etabin, ptbin)
-            err = self.SFmaps[lepton][uncert].GetBinContent(etabin, ptbin)
-
+            return self.tables["elec"][uncert].at( eta, pt, sigma )
 
         elif abs(pdgId)==13:
-            lepton = "muon"
             eta = abs(eta)
             if eta > 2.4:
                 eta = 2.39
             if pt > 120:
                 pt = 119
-            etabin = self.SFmaps[lepton]["SF"][0].GetXaxis().FindBin(eta)
-            ptbin  = self.SFmaps[lepton]["SF"][0].GetYaxis().FindBin(pt)
-            SF = self.SFmaps[lepton]["SF"][0].GetBinContent(etabin, ptbin)
-            err = self.SFmaps[lepton][uncert][0].GetBinError(etabin, ptbin)
+            return self.tables["muon"][uncert].at( eta, pt, sigma )
 
         else:
           raise Exception("Lepton SF for PdgId %i not known"%pdgId)
 
-        return SF+sigma*err
-
 if __name__ == '__main__':
 
     sf = LeptonSF("UL2016_preVFP", muID="Vloose", elID="tight")
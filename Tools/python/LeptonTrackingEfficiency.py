@@ -1,7 +1,8 @@
 import ROOT
 import os, math
+import numpy as np
 from Analysis.Tools.u_float import *
-from Analysis.Tools.helpers import getObjFromFile
+import Analysis.Tools.binnedCorrections as binnedCorrections
 
 # Logging
 import logging
@@ -35,22 +36,48 @@ class LeptonTrackingEfficiency:
             e_file_lowEt    = 'e2018_egammaEffi_EGM2D.root'
             e_key           = "EGamma_SF2D"
             
-        self.e_sf       = getObjFromFile( os.path.expandvars( os.path.join( self.dataDir, e_file       ) ), e_key )
-        self.e_sf_lowEt = getObjFromFile( os.path.expandvars( os.path.join( self.dataDir, e_file_lowEt ) ), e_key )
+        self.e_sf       = binnedCorrections.getTable( os.path.join( self.dataDir, e_file       ), e_key )
+        self.e_sf_lowEt = binnedCorrections.getTable( os.path.join( self.dataDir, e_file_lowEt ), e_key )
 
-        assert self.e_sf,       "Could not load ele SF histo %s from file %s."%( e_key, e_file )
-        assert self.e_sf_lowEt, "Could not load ele SF histo %s from file %s."%( e_key, e_file_lowEt )
+        # x=eta, y=pt
+        self.e_ptMax       = float( self.e_sf.yEdges[-1] )
+        self.e_ptMin       = float( self.e_sf.yEdges[0] )
+        self.e_ptMin_lowEt = float( self.e_sf_lowEt.yEdges[0] )
 
-        self.e_ptMax       = self.e_sf.GetYaxis().GetXmax()
-        self.e_ptMin       = self.e_sf.GetYaxis().GetXmin()
-        self.e_ptMin_lowEt = self.e_sf_lowEt.GetYaxis().GetXmin()
-
-        self.e_etaMax      = self.e_sf.GetXaxis().GetXmax()
-        self.e_etaMin      = self.e_sf.GetXaxis().GetXmin()
+        self.e_etaMax      = float( self.e_sf.xEdges[-1] )
+        self.e_etaMin      = float( self.e_sf.xEdges[0] )
 
         ## Muons
         # SFs are 1. https://hypernews.cern.ch/HyperNews/CMS/get/muon/1425/1.html
-        
+
+    def getSF_array(self, pdgId, pt, eta, sigma=0):
+        ''' getSF for arrays of leptons, e.g. all leptons of a chunk.
+        '''
+        shape = np.shape( pt )
+        pdgId = np.abs( np.atleast_1d( pdgId ) )
+        pt    = np.atleast_1d( pt ).astype( 'd' )
+        eta   = np.atleast_1d( eta ).astype( 'd' )
+
+        if not np.all( ( pdgId == 11 ) | ( pdgId == 13 ) ):
+            raise ValueError( "Lepton pdgId %r neither electron or muon"%np.unique( pdgId[ ( pdgId != 11 ) & ( pdgId != 13 ) ] ) )
+
+        sf = np.ones( pt.shape )
+        isEle = pdgId == 11
+        if np.any( isEle ):
+            e_eta = eta[isEle]
+            outOfBounds = ( e_eta >= self.e_etaMax ) | ( e_eta <= self.e_etaMin )
+            if np.any( outOfBounds ):
+                logger.warning( "Supercluster eta out of bounds: %s (need %3.2f <= eta <=% 3.2f)", ", ".join( "%3.2f"%e for e in e_eta[outOfBounds] ), self.e_etaMin, self.e_etaMax )
+            e_eta = np.where( e_eta >= self.e_etaMax, self.e_etaMax - 0.01, np.where( e_eta <= self.e_etaMin, self.e_etaMin + 0.01, e_eta ) )
+
+            # this is a bit awkward because of the seperate SFs for low pt electrons
+            e_pt  = pt[isEle]
+            e_pt  = np.where( e_pt >= self.e_ptMax, self.e_ptMax - 1, np.where( e_pt <= self.e_ptMin_lowEt, self.e_ptMin_lowEt + 1, e_pt ) )
+
+            sf[isEle] = np.where( e_pt <= self.e_ptMin, self.e_sf_lowEt( e_eta, e_pt, sigma = sigma ), self.e_sf( e_eta, e_pt, sigma = sigma ) )
+
+        return sf.reshape( shape )
+
     def getSF(self, pdgId, pt, eta, sigma=0):
 
         if abs(pdgId) == 11:
@@ -62,16 +89,11 @@ class LeptonTrackingEfficiency:
                 eta = self.e_etaMin + 0.01
 
             # this is a bit awkward because of the seperate SFs for low pt electrons
-            if   pt >= self.e_ptMax:       pt = self.e_ptMax - 1 
+            if   pt >= self.e_ptMax:       pt = self.e_ptMax - 1
             elif pt <= self.e_ptMin_lowEt: pt = self.e_ptMin_lowEt + 1
 
-            if pt <= self.e_ptMin: sf_hist = self.e_sf_lowEt
-            else:                  sf_hist = self.e_sf
-
-            val    = sf_hist.GetBinContent( sf_hist.FindBin(eta, pt) )
-            valErr = sf_hist.GetBinError(   sf_hist.FindBin(eta, pt) )
-            
-            return val + sigma*valErr
+            if pt <= self.e_ptMin: return self.e_sf_lowEt.at( eta, pt, sigma )
+            else:                  return self.e_sf.at( eta, pt, sigma )
 
         elif abs(pdgId) == 13:
             return 1
@@ -1,13 +1,19 @@
 ''' Implementation of a directory based results DB for CMS analyses
     Supports merging and does not destroy afs volumes.
 
+    merge( incremental = True ) streams the tmp files one by one into a ShardedDirDB in <directory>/segments
+    and remembers the compacted tmp files in <directory>/compacted, so the merged data never has to fit in memory.
+    merge() (not incremental) also folds newer records of the segments into the merged file, so both can be mixed.
 '''
 
 # Standard imports
 import os
-import pickle
 import uuid
 
+from Analysis.Tools.ShardedDirDB import ShardedDirDB
+import Analysis.Tools.serialization as serialization
+import Analysis.Tools.dbStats as dbStats
+
 # Logger
 import logging
 logger = logging.getLogger(__name__)
@@ -16,8 +22,10 @@ logger = logging.getLogger(__name__)
 def read_from_file( f, key = None, forgiving = True):
     if os.path.exists( f ):
         try:
-            with open(f) as _f:
-                res = pickle.load(_f)
+            with open(f, 'rb') as _f:
+                blob = _f.read()
+            dbStats.count_bytes( 'MergingDirDB', read = len(blob) )
+            res = serialization.loads(blob)
             if key is not None:
                 if res.has_key( key ):
                     return res[ key ]
@@ -39,12 +47,14 @@ def read_from_file( f, key = None, forgiving = True):
     return None
 
 class MergingDirDB:
-    def __init__( self, directory, init_on_start = True):
+    def __init__( self, directory, init_on_start = True, compression = None):
         '''
         Will create the directory if it doesn't exist 
+        compression: Codec of the serialization module, None for its default
         '''
         # work directory
         self.directory = directory
+        self.compression = compression
         # dictinary where the instance stores its unique 
 
         # create directory
@@ -59,6 +69,8 @@ class MergingDirDB:
 
         # new data
         self.data_dict = {}
+        # records of incrementally merged tmp files
+        self._segments = None
         # read all files when starting?
         if init_on_start:
             self.data_on_disk_dict = self.data_from_all_files()
@@ -88,13 +100,20 @@ class MergingDirDB:
         files = [ (f, os.path.getmtime(f)) for f in files ]
         files.sort( key = lambda r:r[1] )
         data = {} 
-        for f, _ in files:
+        times = {}
+        for f, mtime in files:
             _data = read_from_file( f )
             if _data:
                 data.update(_data)
+                times.update( { key:mtime for key in _data.keys() } )
+        if self.segments() is not None:
+            for key, _data, time_stamp in self.segments().records():
+                if not times.has_key( key ) or times[key] <= time_stamp:
+                    data[key] = _data 
                 
         return data
 
+    @dbStats.instrument( 'add' )
     def add(self, key, data, overwrite=False):
 
         if not overwrite:
@@ -105,14 +124,17 @@ class MergingDirDB:
         # Add data to private dictinary and store the file
         self.data_dict[key] = data 
         try:
-            with open(os.path.join( self.directory, self.unique_tmp_file), 'w') as _f:
-                pickle.dump( self.data_dict, _f )
+            blob = serialization.dumps( self.data_dict, compression = self.compression )
+            dbStats.count_bytes( 'MergingDirDB', written = len(blob) )
+            with open(os.path.join( self.directory, self.unique_tmp_file), 'wb') as _f:
+                _f.write( blob )
         except Exception as e:
             logger.error( "Something wrong with file %s",  os.path.join( self.directory, self.unique_tmp_file) )
             raise e
         logger.debug( "Added key %r to file %s", key, os.path.join( self.directory, self.unique_tmp_file) )
         return data
 
+    @dbStats.instrument( 'get', lookup = 'one' )
     def get(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
@@ -122,11 +144,23 @@ class MergingDirDB:
         # if we don't alread have the key, load it from all files and remember it in case you're asked again:
         return self.read_from_all_files(key)
 
+    @dbStats.instrument( 'contains', lookup = 'one' )
     def contains(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
         return self.get(key) is not None
 
+    def mtime( self, key = None ):
+        ''' Latest modification of any file that could contain the key.
+        '''
+        mtimes = [ os.path.getmtime( self.directory ) ]
+        for f in self.tmp_files() + [ self.merged_file(), self.compacted_file() ]:
+            try:
+                mtimes.append( os.path.getmtime( f ) )
+            except OSError:
+                pass
+        return max( mtimes )
+
     # Here we collect all files from other processes. 
     def tmp_files( self ):
         return [ os.path.join( self.directory, f ) for f in os.listdir(self.directory) if f.startswith( 'tmp_') ]
@@ -137,31 +171,127 @@ class MergingDirDB:
         merged_file = os.path.join( self.directory, 'merged' )
         return merged_file
 
+    # Bookkeeping of the incremental merge: one line 'tmp_file mtime size' per compacted tmp file
+    def compacted_file( self ):
+        return os.path.join( self.directory, 'compacted' )
+
+    def compacted( self ):
+        '''Dictionary tmp_file -> (mtime, size) of the tmp files already streamed into the segments.'''
+        result = {}
+        if not os.path.exists( self.compacted_file() ): return result
+        with open( self.compacted_file() ) as _f:
+            for line in _f:
+                try:
+                    f, mtime, size = line.split()
+                    result[f] = ( float(mtime), int(size) )
+                except ValueError:
+                    pass
+        return result
+
+    def segments( self ):
+        '''ShardedDirDB with the records of the incremental merge, None if there is none (yet).'''
+        if self._segments is None and os.path.isdir( os.path.join( self.directory, 'segments' ) ):
+            self._segments = ShardedDirDB( os.path.join( self.directory, 'segments' ) )
+        return self._segments
+
+    def _is_compacted( self, f, compacted ):
+        return compacted.has_key( os.path.basename(f) ) and compacted[os.path.basename(f)] == ( os.path.getmtime(f), os.path.getsize(f) )
+
     def read_from_all_files( self, key ):
         '''Read from all files that could possibly contain
            the result and return the newest according to unix modification time'''
         results = [] 
+        compacted = self.compacted()
         for f in self.tmp_files() + [self.merged_file()]:
+            # the content of compacted tmp files is found in the segments
+            try:
+                if self._is_compacted( f, compacted ): continue
+            except OSError:
+                # removed by the incremental merge in the meantime
+                continue
             result =  read_from_file( f, key )
             if result is not None:
                 results.append( [ result, os.path.getmtime( f ) ] )
+        # read the segments last: tmp files are only removed after their records were published
+        if self.segments() is not None:
+            result = self.segments().get_record( key )
+            if result is not None:
+                results.append( list(result) )
         if len(results)==0: return None
         results.sort( key = lambda r:r[1] )
         if len(results)>1:
             logger.warning( "Found %i results with different timestamp for key %r . Return newest.", len(results), key )
         return results[-1][0]
         
-    def merge( self, clear = False):
+    def merge_incremental( self, clear = False ):
+        '''Stream the tmp files that were not yet compacted into the segments, one tmp file at a time.
+           Jobs can keep reading: a tmp file is only removed after its records are in the segments.'''
+        compacted = self.compacted()
+        todo = []
+        for f in self.tmp_files():
+            try:
+                if not self._is_compacted( f, compacted ):
+                    todo.append( (f, os.path.getmtime(f), os.path.getsize(f)) )
+            except OSError:
+                pass
+        todo.sort( key = lambda r:r[1] )
+
+        segments = ShardedDirDB( os.path.join( self.directory, 'segments' ), compression = self.compression )
+        n_keys = 0
+        for f, mtime, size in todo:
+            data = read_from_file( f )
+            if data is None:
+                # possibly still being written, try again next time
+                logger.warning( "Could not read %s. Will retry in the next merge.", f )
+                continue
+            # records get the time stamp of the tmp file, so the newest result still wins 
+            segments.add_many( data.items(), overwrite = True, time_stamp = mtime )
+            n_keys += len(data)
+            with open( self.compacted_file(), 'a' ) as _f:
+                _f.write( "%s %r %i\n" % ( os.path.basename(f), mtime, size ) )
+            logger.debug( "Compacted %i keys from %s", len(data), f )
+        if len(todo)==0:
+            logger.info( "No new tmp files, nothing to do.")
+        else:
+            logger.info( 'Compacted %i keys from %i tmp files.', n_keys, len(todo) )
+
+        if clear:
+            # remove the compacted tmp files that were not changed since and forget about them
+            compacted = self.compacted()
+            for f in self.tmp_files():
+                if self._is_compacted( f, compacted ):
+                    os.remove( f )
+            tmp_file  = self.compacted_file() + '_' + str(uuid.uuid4())
+            with open( tmp_file, 'w' ) as _f:
+                for f, ( mtime, size ) in compacted.items():
+                    if os.path.exists( os.path.join( self.directory, f ) ):
+                        _f.write( "%s %r %i\n" % ( f, mtime, size ) )
+            os.rename( tmp_file, self.compacted_file() )
+
+        # compact old segments of previous merges, including the ones just written
+        segments.close()
+        segments.merge()
+        if len(todo)==0: return
+        return True
+
+    @dbStats.instrument( 'merge' )
+    def merge( self, clear = False, incremental = False):
+        if incremental:
+            return self.merge_incremental( clear = clear )
         if len(self.tmp_files())==0:
             logger.info( "No tmp files, nothing to do.")
             return
+        # per key the modification time of the file it comes from, or the time stamp of its record in the segments
+        times = {}
         if os.path.exists( self.merged_file() ):
             f = self.merged_file()
             result = None
             if os.path.exists(f):
+                merged_mtime = os.path.getmtime(f)
                 try:
-                    with open(f) as _f:
-                        result = pickle.load(_f)
+                    with open(f, 'rb') as _f:
+                        result = serialization.load(_f)
+                    times = { key:merged_mtime for key in result.keys() }
                 except IOError:
                     pass
                 except Exception as e:
@@ -176,16 +306,26 @@ class MergingDirDB:
         for f in self.tmp_files():
             results.append( (f, os.path.getmtime( f )) )
         results.sort( key = lambda r:r[1] )
-        for _result, _ in results:
+        for _result, mtime in results:
             try:
-                with open(_result) as _f:
-                    result.update( pickle.load(_f) )
+                with open(_result, 'rb') as _f:
+                    _data = serialization.load(_f)
             except Exception as e:
                 logger.error( "Something wrong with file %s", _result)
                 raise e
+            result.update( _data )
+            times.update( { key:mtime for key in _data.keys() } )
+        # the merged file gets a new mtime: newer records of incremental merges have to go into it
+        if self.segments() is not None:
+            n_segments = 0
+            for key, _data, time_stamp in self.segments().records():
+                if not times.has_key( key ) or times[key] <= time_stamp:
+                    result[key] = _data
+                    n_segments += 1
+            logger.info( 'Took %i keys from the segments of incremental merges.', n_segments )
         try:
-            with open(self.merged_file(), 'w') as _f:
-                pickle.dump(result, _f)
+            with open(self.merged_file(), 'wb') as _f:
+                serialization.dump(result, _f, compression = self.compression)
         except Exception as e:
             logger.error( "Something wrong with file %s", self.merged_file() )
             raise e
@@ -193,8 +333,8 @@ class MergingDirDB:
         
         if clear and os.path.exists( self.merged_file() ):
             try:
-                with open(self.merged_file()) as _f:
-                    pickle.load(_f)
+                with open(self.merged_file(), 'rb') as _f:
+                    serialization.load(_f)
             except:
                 logger.error( "Could not load merged pickle file %s. Will not delete tmp files.",  self.merged_file() )
                 return
@@ -1,7 +1,9 @@
 import ROOT
 import os
+import numpy as np
 
-from Analysis.Tools.helpers import getObjFromFile
+import Analysis.Tools.binnedCorrections as binnedCorrections
+from Analysis.Tools.lookupTable import LookupTable1D, LookupTable2D
 from Analysis.Tools.u_float import u_float
 
 # Logging
@@ -37,44 +39,56 @@ class PhotonElectronVetoEfficiency:
             g_keys_unc = g18_keys_unc
 
         self.dataDir = "$CMSSW_BASE/src/Analysis/Tools/data/photonSFData"
-        self.g_sf = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in g_keys ]
-        if self.year == 2018:
-            self.g_sf_unc = [ getObjFromFile(os.path.expandvars(os.path.join(self.dataDir, file)), key) for (file, key) in g_keys_unc ]
-            for effMap in self.g_sf_unc: assert effMap
+        g_sf = [ binnedCorrections.getTable( os.path.join( self.dataDir, file ), key ) for ( file, key ) in g_keys ]
 
-        for effMap in self.g_sf: assert effMap
-
-    def getPartialSF( self, effMap, pt, eta, effMap_unc=None ):
         if self.year == 2016:
-            bin = effMap.FindBin(eta,pt)
+            # x=|eta|, y=pt
+            self.g_table = LookupTable2D.multiply( g_sf )
         elif self.year == 2017:
-            bin = 1 if abs(eta) < 1.479 else 4
+            # bin 1 (barrel) and 4 (endcap) of the 1D maps, x=|eta|
+            barrel = self.mult( [ u_float( *effMap.cell( 1 ) ) for effMap in g_sf ] )
+            endcap = self.mult( [ u_float( *effMap.cell( 4 ) ) for effMap in g_sf ] )
+            self.g_table = LookupTable1D( [ 1.479 ], [ barrel.val, endcap.val ], [ barrel.sigma, endcap.sigma ] )
         elif self.year == 2018:
-            bin = effMap.FindBin(pt,eta)
-
-        sf  = effMap.GetBinContent( bin )
-
-        if self.year == 2018:
-            err = effMap_unc.GetBinContent( bin )
-        else:
-            err = effMap.GetBinError( bin )
-
-        return u_float(sf, err)
+            # x=pt, y=|eta|, the uncertainties are the contents of the _Unc maps
+            g_sf_unc = [ binnedCorrections.getTable( os.path.join( self.dataDir, file ), key ) for ( file, key ) in g_keys_unc ]
+            self.g_table = LookupTable2D.multiply( [ LookupTable2D( effMap.xEdges, effMap.yEdges, effMap.values, effMap_unc.values ) for effMap, effMap_unc in zip( g_sf, g_sf_unc ) ] )
 
     def mult( self, list ):
         res = list[0]
         for i in list[1:]: res = res*i
         return res
 
+    def getSF_array( self, pt, eta, sigma=0 ):
+        ''' getSF for arrays of photons, e.g. all photons of a chunk.
+        '''
+        shape  = np.shape( pt )
+        pt     = np.atleast_1d( pt ).astype( 'd' )
+        absEta = np.abs( np.atleast_1d( eta ).astype( 'd' ) )
+
+        pt     = np.where( pt     >= 200, 199,  pt     )
+        absEta = np.where( absEta >= 2.5, 2.49, absEta )
+
+        if self.year == 2016:
+            sf = self.g_table( absEta, pt, sigma = sigma )
+        elif self.year == 2017:
+            sf = self.g_table( absEta, sigma = sigma )
+        elif self.year == 2018:
+            sf = self.g_table( pt, absEta, sigma = sigma )
+
+        return sf.reshape( shape )
+
     def getSF( self, pt, eta, sigma=0 ):
-        if pt       >= 200: pt  = 199
-        if abs(eta) >= 2.5: eta = 2.49 
-        if self.year == 2018:
-            sf = self.mult( [ self.getPartialSF( effMap, pt, abs(eta), self.g_sf_unc[i] ) for i, effMap in enumerate(self.g_sf) ] )
-        else:
-            sf = self.mult( [ self.getPartialSF( effMap, pt, abs(eta) ) for effMap in self.g_sf ] )
-
-        return sf.val + sigma*sf.sigma
+        absEta = abs(eta)
+        if pt     >= 200: pt     = 199
+        if absEta >= 2.5: absEta = 2.49
+
+        if self.year == 2016:
+            return self.g_table.at( absEta, pt, sigma )
+        elif self.year == 2017:
+            return self.g_table.at( absEta, sigma )
+        elif self.year == 2018:
+            return self.g_table.at( pt, absEta, sigma )
 
 
 if __name__ == "__main__":
@@ -1,7 +1,8 @@
 import ROOT
 import os, math
+import numpy as np
 from Analysis.Tools.u_float import *
-from Analysis.Tools.helpers import getObjFromFile
+import Analysis.Tools.binnedCorrections as binnedCorrections
 
 # Logging
 import logging
@@ -32,15 +33,30 @@ class PhotonReconstructionEfficiency:
             g_file = 'g2016_EGM2D_BtoH_GT20GeV_RecoSF_Legacy2016.root'
             g_key  = "EGamma_SF2D"
             
-        self.g_sf  = getObjFromFile( os.path.expandvars( os.path.join( self.dataDir, g_file ) ), g_key )
+        self.g_sf  = binnedCorrections.getTable( os.path.join( self.dataDir, g_file ), g_key )
 
-        assert self.g_sf, "Could not load ele SF histo %s from file %s."%( g_key, g_file )
+        # x=eta, y=pt
+        self.g_ptMax  = float( self.g_sf.yEdges[-1] )
+        self.g_ptMin  = float( self.g_sf.yEdges[0] )
 
-        self.g_ptMax  = self.g_sf.GetYaxis().GetXmax()
-        self.g_ptMin  = self.g_sf.GetYaxis().GetXmin()
+        self.g_etaMax = float( self.g_sf.xEdges[-1] )
+        self.g_etaMin = float( self.g_sf.xEdges[0] )
 
-        self.g_etaMax = self.g_sf.GetXaxis().GetXmax()
-        self.g_etaMin = self.g_sf.GetXaxis().GetXmin()
+    def getSF_array(self, pt, eta, sigma=0):
+        ''' getSF for arrays of photons, e.g. all photons of a chunk.
+        '''
+        shape = np.shape( pt )
+        pt    = np.atleast_1d( pt ).astype( 'd' )
+        eta   = np.atleast_1d( eta ).astype( 'd' )
+
+        outOfBounds = ( eta >= self.g_etaMax ) | ( eta <= self.g_etaMin )
+        if np.any( outOfBounds ):
+            logger.warning( "Supercluster eta out of bounds: %s (need %3.2f <= eta <=% 3.2f)", ", ".join( "%3.2f"%e for e in eta[outOfBounds] ), self.g_etaMin, self.g_etaMax )
+        eta = np.where( eta >= self.g_etaMax, self.g_etaMax - 0.01, np.where( eta <= self.g_etaMin, self.g_etaMin + 0.01, eta ) )
+
+        pt  = np.where( pt >= self.g_ptMax, self.g_ptMax - 1, np.where( pt < self.g_ptMin, self.g_ptMin + 1, pt ) )
+
+        return self.g_sf( eta, pt, sigma = sigma ).reshape( shape )
 
     def getSF(self, pt, eta, sigma=0):
 
@@ -51,12 +67,7 @@ class PhotonReconstructionEfficiency:
             logger.warning( "Supercluster eta out of bounds: %3.2f (need %3.2f <= eta <=% 3.2f)", eta, self.g_etaMin, self.g_etaMax )
             eta = self.g_etaMin + 0.01
 
-        # this is a bit awkward because of the seperate SFs for low pt electrons
-        if   pt >= self.g_ptMax: pt = self.g_ptMax - 1 
+        if   pt >= self.g_ptMax: pt = self.g_ptMax - 1
         elif pt <  self.g_ptMin: pt = self.g_ptMin + 1
 
-        val    = self.g_sf.GetBinContent( self.g_sf.FindBin(eta, pt) )
-        valErr = self.g_sf.GetBinError(   self.g_sf.FindBin(eta, pt) )
-            
-        return val + sigma*valErr
-
+        return self.g_sf.at( eta, pt, sigma )
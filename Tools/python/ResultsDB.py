@@ -9,15 +9,19 @@ Use sth like
 self.conn.isolation_level = 'EXCLUSIVE'
 self.conn.execute('BEGIN EXCLUSIVE')
 
+With persistent=True one connection is kept open for the lifetime of the object instead of connecting for every query.
+add_many/get_many handle a whole batch of keys within one transaction.
+
 '''
 
 # Standard imports
 import os
 import time
 import sqlite3
-import cPickle
 
 from u_float import u_float
+import Analysis.Tools.serialization as serialization
+import Analysis.Tools.dbStats as dbStats
 
 # Logger
 import logging
@@ -43,13 +47,17 @@ class DBopen(object):
         self.conn.close()
 
 class ResultsDB:
-    def __init__( self, database, tableName, columns ):
+    def __init__( self, database, tableName, columns, persistent = False, compression = None ):
         '''
         Will create a table with name tableName, with the provided columns (as a list) and two additional columns: value and time_stamp
+        compression: Codec of the serialization module for blobs stored with addData, None for its default
         '''
         self.database_file = database
         self.tableName     = tableName
+        self.persistent    = persistent
+        self.compression   = compression
         self.columns       = self.clean( columns )
+        self.keyColumns    = list( self.columns )
         self.columns       = self.columns + [ "value" ]
         self.columnString  = ", ".join([ s + " text" for s in self.columns ])
 
@@ -69,6 +77,11 @@ class ResultsDB:
                     logger.debug( "Table already exists." )
                 except sqlite3.DatabaseError:
                     logger.debug( "Concurrency problem. Table should already exist." )
+                # index on the key columns, also for tables that were created without it
+                try:
+                    self.conn.execute( '''CREATE INDEX IF NOT EXISTS %s_key ON %s (%s)'''%(self.tableName, self.tableName, ", ".join( self.keyColumns )) )
+                except sqlite3.DatabaseError:
+                    logger.debug( "Could not create index." )
         except:
             pass
         self.close()
@@ -84,23 +97,62 @@ class ResultsDB:
 
     def connect(self):
         ''' only establish the connection when needed, not when resultsDB object is created
+            In persistent mode, the connection is established once and then reused.
         '''
+        if self.persistent and getattr( self, "conn", None ) is not None:
+            return
         self.conn = sqlite3.connect(self.database_file)
     
     def cursor(self):
         self.cursor = self.database.cursor()
 
-    def close(self):
+    def close(self, force = False):
         ''' Not really needed anymore if all connections are handled with context manager
+            In persistent mode, the connection is only closed with force = True.
         '''
-        self.conn.close()
-        del self.conn
+        if self.persistent and not force:
+            return
+        if getattr( self, "conn", None ) is not None:
+            self.conn.close()
+            del self.conn
+
+    def _failed(self, e, what):
+        ''' Clean up after a failed attempt: roll back the transaction (a failed COMMIT leaves it open, and in persistent
+            mode the connection is reused). Wait if the database is locked, reconnect after other errors.
+        '''
+        logger.debug( "Attempt failed (%s): %r", what, e )
+        try:
+            self.conn.rollback()
+        except Exception:
+            pass
+        locked = isinstance( e, sqlite3.OperationalError ) and ( 'locked' in str(e) or 'busy' in str(e) )
+        self.close( force = not locked )
+        time.sleep(0.01)
+
+    def __del__(self):
+        if getattr( self, "persistent", False ):
+            try:
+                self.close( force = True )
+            except:
+                pass
+
+    def mtime(self, key = None):
+        ''' Modification time of the database file
+        '''
+        return os.path.getmtime( self.database_file )
+
+    @staticmethod
+    def selection( key ):
+        ''' Parameterized selection string and the parameters for a key
+        '''
+        return " AND ".join([ "%s = ?"%k for k in key.keys() ]), [ "%s"%key[k] for k in key.keys() ]
         
+    @dbStats.instrument( 'getObjects' )
     def getObjects(self, key):
         ''' Get all entries in the database matching the provided key.
         '''
         columns = self.clean(key.keys()+["value", "time_stamp"])
-        selection = " AND ".join([ "%s = '%s'"%(k, key[k]) for k in key.keys() ])
+        selection, parameters = self.selection( key )
 
         selectionString = "SELECT * FROM {} ".format(self.tableName) + " WHERE {} ".format(selection) + " ORDER BY time_stamp"
 
@@ -109,20 +161,13 @@ class ResultsDB:
             self.connect()
             try:
                 with self.conn:
-                    try:
-                        obj = self.conn.execute(selectionString)
-                        objs = [o for o in obj]
-                        if len(objs) > 0:
-                            logger.debug("Reading successfull.")
-                        return objs
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (reading).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (reading).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
+                    obj = self.conn.execute(selectionString, parameters)
+                    objs = [o for o in obj]
+                    if len(objs) > 0:
+                        logger.debug("Reading successfull.")
+                return objs
+            except Exception as e:
+                self._failed( e, "reading" )
         return False
 
     def getDicts(self, key):
@@ -157,6 +202,7 @@ class ResultsDB:
                 if a == 'q': break
             
 
+    @dbStats.instrument( 'contains', lookup = 'one' )
     def contains(self, key):
         objs = self.getObjects(key)
         return len(objs) if type(objs) == type([]) else 0 # in case there's a locking problem act as if stuff existed
@@ -168,31 +214,35 @@ class ResultsDB:
         except IndexError:
             return 0
 
+    @dbStats.instrument( 'get', lookup = 'one' )
     def get(self, key, plain=False):
         '''  Careful! This method only returns the newest entry in the database that's matching the key. This is not necessarily a unique match!
         '''
         logger.debug("Getting only the newest entry in the database matching the key. You should know what you're doing here.")
         objs = self.getDicts(key)
-        if not plain:
-            if objs:
-                if len(objs[-1]["value"]) > 50:
-                    try:
-                        return cPickle.loads(objs[-1]["value"])
-                    except:
-                        return False
-                else:
-                    try:
-                        return u_float.fromString(objs[-1]["value"])
-                    except IndexError:
-                        return False
-            else:
+        return self.decode( objs[-1]["value"] if objs else None, plain = plain )
+
+    @staticmethod
+    def decode( value, plain = False ):
+        ''' Convert the stored string into the object (blob from addData) or u_float (from add)
+        '''
+        if value is None:
+            return False
+        dbStats.count_bytes( 'ResultsDB', read = len(value) )
+        if plain:
+            return value
+        if len(value) > 50 or value.startswith( serialization.magic ):
+            try:
+                return serialization.loads(value)
+            except:
                 return False
         else:
             try:
-                return objs[-1]["value"]
-            except:
+                return u_float.fromString(value)
+            except IndexError:
                 return False
 
+    @dbStats.instrument( 'addData' )
     def addData(self, key, data, overwrite):
         ''' add binary data to a databse as blob
         '''
@@ -204,32 +254,27 @@ class ResultsDB:
             raise(ValueError("The columns don't match the table. Use the following: %s"%", ".join(self.columns)))
         
         columns += ["time_stamp"]
-        pdata = cPickle.dumps(data, cPickle.HIGHEST_PROTOCOL)
-        values  = key.values()
+        pdata = serialization.dumps(data, compression = self.compression)
+        dbStats.count_bytes( 'ResultsDB', written = len(pdata) )
+        values  = [ "%s"%v for v in key.values() ] + [ sqlite3.Binary(pdata), time.time() ]
         
         # check if number of columns matches. By default, there is no error if not, but better be save than sorry.
         if len(key.keys())+1 < len(self.columns):
             raise(ValueError("The length of the given key doesn't match the number of columns in the table. The following columns (excluding value and time_stamp) are part of the table: %s"%", ".join(self.columns)))
         
-        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({}".format(", ".join([ "'%s'"%i for i in values ])) + ", :data, '%s')"%time.time()
+        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join( ["?"]*len(values) ))
         
         for i in range(100):
             self.connect()
             try:
                 with self.conn:
-                    try:
-                        self.conn.execute(selectionString, (sqlite3.Binary(pdata),))
-                        logger.info("Added data to database.")
-                        return data
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (writing data).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (writing data).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
+                    self.conn.execute(selectionString, values)
+                    logger.info("Added data to database.")
+                return data
+            except Exception as e:
+                self._failed( e, "writing data" )
 
+    @dbStats.instrument( 'add' )
     def add(self, key, value, overwrite, overwriteOldest=False):
         ''' new DB structure. key needs to be a python dictionary. Overwrite removes all previous entries found under the key.
         '''
@@ -244,57 +289,97 @@ class ResultsDB:
             raise(ValueError("The columns don't match the table. Use the following: %s"%", ".join(self.columns)))
         
         columns += ["time_stamp"]
-        values  = key.values()+[str(value), time.time()]
+        values  = [ "%s"%v for v in key.values() ] + [str(value), time.time()]
         
         # check if number of columns matches. By default, there is no error if not, but better be save than sorry.
         if len(key.keys())+1 < len(self.columns):
             raise(ValueError("The length of the given key doesn't match the number of columns in the table. The following columns (excluding value and time_stamp) are part of the table: %s"%", ".join(self.columns)))
 
-        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join([ "'%s'"%i for i in values ]))
+        selectionString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join( ["?"]*len(values) ))
 
         for i in range(100):
             self.connect()
             try:
                 with self.conn:
-                    try:
-                        self.conn.execute(selectionString)
-                        logger.info("Added value %s to database",value)
-                        return value
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (writing).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (writing).")
-                time.sleep(0.01)
-            except:
-                pass
-#            return value
-            self.close()
+                    self.conn.execute(selectionString, values)
+                    logger.info("Added value %s to database",value)
+                return value
+            except Exception as e:
+                self._failed( e, "writing" )
                 
 
+    @dbStats.instrument( 'removeObjects' )
     def removeObjects(self, key):
         ''' Remove entries matching the key. Careful when not all columns are specified!
         '''
-        selection = " AND ".join([ "%s = '%s'"%(k, key[k]) for k in key.keys() ])
+        selection, parameters = self.selection( key )
 
         selectionString = "DELETE FROM {} ".format(self.tableName) + " WHERE {} ".format(selection)
         for i in range(100):
             self.connect()
             try:
                 with self.conn:
-                    try:
-                        self.conn.execute(selectionString)
-                        return
-                    except sqlite3.OperationalError:
-                        logger.debug("OE: Locked (removing).")
-                    except sqlite3.DatabaseError:
-                        logger.debug("DE: Locked (removing).")
-                time.sleep(0.01)
-            except:
-                pass
-            self.close()
+                    self.conn.execute(selectionString, parameters)
+                return
+            except Exception as e:
+                self._failed( e, "removing" )
         return False
 
 
+    @dbStats.instrument( 'add_many' )
+    def add_many(self, items, overwrite = False, binary = False):
+        ''' Add a list of (key, value) pairs in one transaction. Values are stored as in add, or as in addData with binary = True.
+            Overwrite removes all previous entries found under the keys.
+        '''
+        for key, value in items:
+            if not sorted(self.clean(key.keys()+["value"])) == sorted(self.columns):
+                raise(ValueError("The columns don't match the table. Use the following: %s"%", ".join(self.columns)))
+
+        columns = self.keyColumns + ["value", "time_stamp"]
+        insertString = "INSERT INTO {} ".format(self.tableName) + " ({}) ".format(", ".join( columns )) + " VALUES ({})".format(", ".join( ["?"]*len(columns) ))
+        deleteString = "DELETE FROM {} ".format(self.tableName) + " WHERE {} ".format( " AND ".join([ "%s = ?"%c for c in self.keyColumns ]) )
+
+        now = time.time()
+        rows = []
+        for key, value in items:
+            value = sqlite3.Binary(serialization.dumps(value, compression = self.compression)) if binary else str(value)
+            dbStats.count_bytes( 'ResultsDB', written = len(value) )
+            rows.append( [ "%s"%key[c] for c in self.keyColumns ] + [ value, now ] )
+
+        for i in range(100):
+            self.connect()
+            try:
+                with self.conn:
+                    if overwrite:
+                        self.conn.executemany(deleteString, [ row[:len(self.keyColumns)] for row in rows ])
+                    self.conn.executemany(insertString, rows)
+                    logger.info("Added %i values to database", len(rows))
+                return [ value for key, value in items ]
+            except Exception as e:
+                self._failed( e, "writing many" )
+        raise sqlite3.OperationalError( "Could not write %i values to %s after 100 attempts." % ( len(rows), self.database_file ) )
+
+    @dbStats.instrument( 'get_many', lookup = 'many' )
+    def get_many(self, keys, plain = False):
+        ''' Same as get for a list of keys, within one transaction. Returns the list of results.
+        '''
+        selectionStrings = {}
+        for i in range(100):
+            self.connect()
+            try:
+                with self.conn:
+                    results = []
+                    for key in keys:
+                        selection, parameters = self.selection( key )
+                        if not selectionStrings.has_key( selection ):
+                            selectionStrings[selection] = "SELECT value FROM {} ".format(self.tableName) + " WHERE {} ".format(selection) + " ORDER BY time_stamp DESC LIMIT 1"
+                        row = self.conn.execute(selectionStrings[selection], parameters).fetchone()
+                        results.append( self.decode( str(row[0]) if row is not None else None, plain = plain ) )
+                return results
+            except Exception as e:
+                self._failed( e, "reading many" )
+        return False
+
     def resetDatabase(self):
         if os.path.isfile(self.database_file):
             os.remove(self.database_file)
@@ -0,0 +1,345 @@
+''' Implementation of a sharded, indexed directory based results DB for CMS analyses
+    Drop-in replacement for MergingDirDB (add/get/contains/merge).
+
+    Layout: <directory>/<shard>/<uuid>.seg holds the pickled (key, data) records written by one process,
+    <directory>/<shard>/<uuid>.idx holds one line per record: 'digest offset length time_stamp'.
+    The shard is given by the first two hex digits of the key digest.
+    Every process only ever appends to its own pair of files, hence concurrent writers on network
+    file systems don't need any locking. The record is written before its index line, and index lines without a
+    trailing newline are ignored, so a reader never sees a half-written record.
+    A lookup reads the (small) index files of one shard once, and thereafter only the new index lines, on a miss or
+    at most every refresh_interval seconds (so that records added by other processes are seen), and unpickles exactly one record.
+    A writer marks its segments as finished with <uuid>.done when it is closed (at the latest at exit), merge() only
+    compacts finished segments.
+'''
+
+# Standard imports
+import os
+import time
+import uuid
+import atexit
+import weakref
+import cPickle
+
+from Analysis.Tools.stableHash import stable_hash
+import Analysis.Tools.serialization as serialization
+import Analysis.Tools.dbStats as dbStats
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+# instances with unfinished segments, closed at exit
+_writers = weakref.WeakSet()
+
+def _close_all():
+    for db in list( _writers ):
+        db.close()
+
+atexit.register( _close_all )
+
+class ShardedDirDB:
+    marker    = 'sharded'
+    # Seconds after which a lookup reads the new index lines of the shard also if the key is known
+    refresh_interval = 10
+
+    def __init__( self, directory, init_on_start = False, compression = None):
+        '''
+        Will create the directory if it doesn't exist.
+        init_on_start is accepted for compatibility with MergingDirDB, the index is always read lazily.
+        compression: Codec of the serialization module, None for its default
+        '''
+        self.directory   = directory
+        self.compression = compression
+
+        # create directory
+        if not os.path.isdir( self.directory ):
+            # there can be a race condition, if many jobs starts at the same time and also create this
+            try:
+                os.makedirs( self.directory )
+            except OSError as e:
+                if not os.path.isdir( self.directory):
+                    raise e
+
+        # marker file used by mergeCache.py to recognize the format
+        if not os.path.exists( os.path.join( self.directory, self.marker ) ):
+            open( os.path.join( self.directory, self.marker ), 'a' ).close()
+
+        # unique file name for the records of this process
+        self.unique_name = str(uuid.uuid4())
+
+        # index cache: shard -> { digest: (time_stamp, segment_file, offset, length) }
+        self._index       = {}
+        # bytes of each index file that were already read: shard -> { index_file: (inode, offset) }
+        self._index_pos   = {}
+        # shard -> time of the last update of the index
+        self._updated     = {}
+        # shard directories with unfinished segments of this instance
+        self._written     = set()
+
+    def _shard( self, digest ):
+        return digest[:2]
+
+    def _shard_dir( self, shard ):
+        return os.path.join( self.directory, shard )
+
+    def _update_index( self, shard ):
+        ''' Read the new lines of all index files in the shard.
+        '''
+        shard_dir = self._shard_dir( shard )
+        index     = self._index.setdefault( shard, {} )
+        positions = self._index_pos.setdefault( shard, {} )
+        self._updated[shard] = time.time()
+        if not os.path.isdir( shard_dir ): return index
+        for f in os.listdir( shard_dir ):
+            # tmp_ files are compactions in progress
+            if not f.endswith('.idx') or f.startswith('tmp_'): continue
+            index_file = os.path.join( shard_dir, f )
+            segment    = index_file[:-len('.idx')] + '.seg'
+            try:
+                # nothing new
+                stat = os.stat( index_file )
+                if positions.get( index_file ) == ( stat.st_ino, stat.st_size ): continue
+                with open( index_file, 'rb' ) as _f:
+                    stat = os.fstat( _f.fileno() )
+                    inode, position = positions.get( index_file, ( stat.st_ino, 0 ) )
+                    if inode != stat.st_ino or stat.st_size < position:
+                        # merge() removed the file and its writer started a new one. The offsets of the old segment
+                        # in the index are wrong now, start over.
+                        logger.debug( "Index file %s was replaced. Re-reading index of shard %s.", index_file, shard )
+                        self._reset_index( shard )
+                        return self._update_index( shard )
+                    _f.seek( position )
+                    lines = _f.read().decode('ascii')
+            except (IOError, OSError):
+                # file was merged away in the meantime
+                continue
+            # ignore the last line if it is still being written
+            complete = lines[:lines.rfind('\n')+1]
+            positions[index_file] = ( inode, position + len(complete) )
+            for line in complete.splitlines():
+                try:
+                    digest, offset, length, time_stamp = line.split()
+                    record = ( float(time_stamp), segment, int(offset), int(length) )
+                except ValueError:
+                    logger.warning( "Ignoring corrupt index line %r in %s", line, index_file )
+                    continue
+                # newest wins
+                if digest not in index or index[digest][0] <= record[0]:
+                    index[digest] = record
+        return index
+
+    def _reset_index( self, shard ):
+        self._index.pop( shard, None )
+        self._index_pos.pop( shard, None )
+        self._updated.pop( shard, None )
+
+    def _lookup( self, digest ):
+        shard = self._shard( digest )
+        entry = self._index.get( shard, {} ).get( digest )
+        # other processes may have added or overwritten the key
+        if entry is None or time.time() - self._updated.get( shard, 0 ) > self.refresh_interval:
+            entry = self._update_index( shard ).get( digest )
+        return entry
+
+    def _read_record( self, segment, offset, length ):
+        with open( segment, 'rb' ) as _f:
+            _f.seek( offset )
+            blob = _f.read( length )
+        dbStats.count_bytes( 'ShardedDirDB', read = len(blob) )
+        return serialization.loads( blob )
+
+    def get_record( self, key ):
+        ''' Get (data, time_stamp) of the newest entry in the database matching the provided key.
+        '''
+        digest = stable_hash( key )
+        for attempt in range(2):
+            entry = self._lookup( digest )
+            if entry is None: return None
+            time_stamp, segment, offset, length = entry
+            try:
+                _key, data = self._read_record( segment, offset, length )
+            except (IOError, EOFError, ValueError, cPickle.UnpicklingError):
+                # The segment was compacted by merge(). Re-read the index of the shard.
+                logger.debug( "Could not read record for key %r from %s. Re-reading index.", key, segment )
+                self._reset_index( self._shard( digest ) )
+                continue
+            if _key != key:
+                logger.warning( "Digest collision for keys %r and %r.", key, _key )
+                return None
+            return data, time_stamp
+        return None
+
+    @dbStats.instrument( 'get', lookup = 'one' )
+    def get( self, key ):
+        ''' Get the newest entry in the database matching the provided key.
+        '''
+        record = self.get_record( key )
+        if record is None: return None
+        return record[0]
+
+    @dbStats.instrument( 'contains', lookup = 'one' )
+    def contains( self, key ):
+        ''' We got that thing?
+        '''
+        return self._lookup( stable_hash( key ) ) is not None
+
+    @dbStats.instrument( 'add' )
+    def add( self, key, data, overwrite = False, time_stamp = None):
+
+        if not overwrite:
+            if self.contains( key ):
+                logger.warning( "Already found key %r . Do not store data.", key )
+                return data
+
+        self.add_many( [ (key, data) ], overwrite = True, time_stamp = time_stamp )
+        logger.debug( "Added key %r to %s", key, self.directory )
+        return data
+
+    @dbStats.instrument( 'add_many' )
+    def add_many( self, items, overwrite = False, time_stamp = None):
+        ''' Add the (key, data) pairs with one write per shard.
+        '''
+        if time_stamp is None: time_stamp = time.time()
+        records = {}
+        for key, data in items:
+            if not overwrite and self.contains( key ):
+                logger.warning( "Already found key %r . Do not store data.", key )
+                continue
+            digest = stable_hash( key )
+            records.setdefault( self._shard( digest ), [] ).append( (digest, serialization.dumps( (key, data), compression = self.compression ), time_stamp) )
+
+        for shard, _records in records.items():
+            shard_dir = self._shard_dir( shard )
+            if not os.path.isdir( shard_dir ):
+                try:
+                    os.makedirs( shard_dir )
+                except OSError as e:
+                    if not os.path.isdir( shard_dir ):
+                        raise e
+            self._written.add( shard_dir )
+            _writers.add( self )
+            index = self._index.setdefault( shard, {} )
+            for digest, record in self._append( shard_dir, self.unique_name, _records ):
+                # newest wins
+                if digest not in index or index[digest][0] <= record[0]:
+                    index[digest] = record
+
+    def _append( self, shard_dir, name, records ):
+        ''' Append the (digest, blob, time_stamp) records to the segment and then the index file.
+            Opening in append mode again also recovers if merge() removed the files in the meantime.
+            Returns the index entries [ (digest, (time_stamp, segment, offset, length)), ... ].
+        '''
+        segment = os.path.join( shard_dir, name + '.seg' )
+        lines, entries = [], []
+        with open( segment, 'ab' ) as _f:
+            _f.seek( 0, os.SEEK_END )
+            for digest, blob, time_stamp in records:
+                lines.append( "%s %i %i %r\n" % ( digest, _f.tell(), len(blob), time_stamp ) )
+                entries.append( ( digest, ( float(time_stamp), segment, _f.tell(), len(blob) ) ) )
+                _f.write( blob )
+                dbStats.count_bytes( 'ShardedDirDB', written = len(blob) )
+            _f.flush()
+            os.fsync( _f.fileno() )
+        with open( os.path.join( shard_dir, name + '.idx' ), 'ab' ) as _f:
+            _f.write( ''.join( lines ).encode('ascii') )
+        return entries
+
+    def close( self ):
+        ''' Mark the segments written so far as finished, merge() only compacts finished segments.
+            Records added afterwards go to new segments.
+        '''
+        for shard_dir in self._written:
+            try:
+                open( os.path.join( shard_dir, self.unique_name + '.done' ), 'a' ).close()
+            except IOError as e:
+                logger.warning( "Could not mark segment %s in %s as done: %r", self.unique_name, shard_dir, e )
+        if self._written:
+            self._written = set()
+            self.unique_name = str(uuid.uuid4())
+        _writers.discard( self )
+
+    def records( self ):
+        ''' Generator over (key, data, time_stamp) of all newest records. Reads one record at a time.
+        '''
+        if not os.path.isdir( self.directory ): return
+        for shard in sorted( os.listdir( self.directory ) ):
+            if not os.path.isdir( self._shard_dir( shard ) ): continue
+            self._reset_index( shard )
+            for digest, ( time_stamp, segment, offset, length ) in sorted( self._update_index( shard ).items(), key = lambda r: r[1][1:3] ):
+                try:
+                    key, data = self._read_record( segment, offset, length )
+                except (IOError, EOFError):
+                    logger.warning( "Could not read record %s from %s", digest, segment )
+                    continue
+                yield key, data, time_stamp
+
+    def items( self ):
+        ''' Generator over all (key, data) of the newest records.
+        '''
+        for key, data, _ in self.records():
+            yield key, data
+
+    @dbStats.instrument( 'merge' )
+    def merge( self, clear = False ):
+        ''' Compact all finished segments (those with a .done marker and earlier compactions) in each shard into one.
+            Segments of writers that are still open are left alone, so no records written concurrently are lost.
+            The compacted segment is published before the old files are removed, concurrent readers re-read the index.
+            clear is accepted for compatibility with MergingDirDB: the compacted files are always removed.
+        '''
+        n_keys, n_files = 0, 0
+        for shard in sorted( os.listdir( self.directory ) ):
+            shard_dir = self._shard_dir( shard )
+            if not os.path.isdir( shard_dir ): continue
+
+            files = os.listdir( shard_dir )
+            done  = set( f[:-len('.done')] for f in files if f.endswith('.done') )
+            names = [ f[:-len('.idx')] for f in files if f.endswith('.idx') and not f.startswith('tmp_') ]
+            names = [ n for n in names if n.startswith('merged_') or n in done ]
+            if len(names)<2: continue
+
+            # read only the index files we are going to compact
+            segments = set( os.path.join( shard_dir, n + '.seg' ) for n in names )
+            self._reset_index( shard )
+            index = { digest:record for digest, record in self._update_index( shard ).items() if record[1] in segments }
+
+            merged_name = 'merged_' + str(uuid.uuid4())
+            tmp_name    = 'tmp_' + merged_name
+            records = []
+            for digest, ( time_stamp, segment, offset, length ) in sorted( index.items(), key = lambda r: r[1][1:3] ):
+                with open( segment, 'rb' ) as _f:
+                    _f.seek( offset )
+                    records.append( (digest, _f.read( length ), time_stamp) )
+                if len(records) >= 1000:
+                    self._append( shard_dir, tmp_name, records )
+                    records = []
+            self._append( shard_dir, tmp_name, records )
+
+            # publish: the index file is renamed last because that's what readers look for
+            os.rename( os.path.join( shard_dir, tmp_name + '.seg' ), os.path.join( shard_dir, merged_name + '.seg' ) )
+            os.rename( os.path.join( shard_dir, tmp_name + '.idx' ), os.path.join( shard_dir, merged_name + '.idx' ) )
+            for n in names:
+                for ext in ['.idx', '.seg', '.done']:
+                    if os.path.exists( os.path.join( shard_dir, n + ext ) ):
+                        os.remove( os.path.join( shard_dir, n + ext ) )
+            self._reset_index( shard )
+
+            n_keys  += len(index)
+            n_files += len(names)
+            logger.debug( "Compacted %i keys from %i segments in shard %s.", len(index), len(names), shard )
+
+        if n_files==0:
+            logger.info( "No segments to compact, nothing to do.")
+            return
+        logger.info( 'Compacted %i keys from %i segments.', n_keys, n_files )
+        return True
+
+if __name__ == "__main__":
+    import Analysis.Tools.logger as logger
+    logger    = logger.get_logger( "DEBUG", logFile = None)
+
+    dirDB = ShardedDirDB("./test3")
+
+    #dirDB.add('x',1)
+    #dirDB.add('y',2, overwrite=True)
+    #dirDB.merge()
@@ -0,0 +1,204 @@
+''' NumPy versions of the kinematic helpers in Analysis.Tools.helpers.
+    They take whole collections as arrays, e.g. (eta, phi) of all jets and all leptons, and compute all pairs in one call.
+    Results agree with the scalar functions up to rounding.
+'''
+
+# Standard imports
+import itertools
+from math import pi
+import numpy as np
+
+def isColumnar( collection ):
+    ''' Collections given as {'pt':array, 'eta':array, ...} (or anything with array valued items) instead of lists of dicts.
+    '''
+    try:
+        return isinstance( collection['phi'], np.ndarray )
+    except (KeyError, TypeError, IndexError, ValueError):
+        return False
+
+def deltaPhi( phi1, phi2, returnAbs = True ):
+    ''' Element-wise (broadcasting) version of helpers.deltaPhi. NaN inputs give NaN.
+    '''
+    dphi = np.asarray( phi2, dtype = 'd' ) - np.asarray( phi1, dtype = 'd' )
+    with np.errstate( invalid = 'ignore' ):
+        dphi = np.where( dphi >   pi, dphi - 2.0*pi, dphi )
+        dphi = np.where( dphi <= -pi, dphi + 2.0*pi, dphi )
+    if returnAbs:
+        return np.abs( dphi )
+    return dphi
+
+def deltaR2Matrix( eta1, phi1, eta2, phi2 ):
+    ''' Matrix of deltaR^2 of all pairs, shape (len(eta1), len(eta2)). Scalars are treated as collections of length one.
+    '''
+    eta1, phi1 = np.atleast_1d( np.asarray( eta1, dtype = 'd' ) ), np.atleast_1d( np.asarray( phi1, dtype = 'd' ) )
+    eta2, phi2 = np.atleast_1d( np.asarray( eta2, dtype = 'd' ) ), np.atleast_1d( np.asarray( phi2, dtype = 'd' ) )
+    return deltaPhi( phi1[:, np.newaxis], phi2[np.newaxis, :] )**2 + ( eta1[:, np.newaxis] - eta2[np.newaxis, :] )**2
+
+def minDeltaR2( eta1, phi1, eta2, phi2 ):
+    ''' For every object of the first collection the smallest deltaR^2 to the second collection and its index there.
+        Returns (matrix, min, argmin). min is inf and argmin is -1 if the second collection is empty.
+    '''
+    dr2 = deltaR2Matrix( eta1, phi1, eta2, phi2 )
+    if dr2.shape[1] == 0:
+        return dr2, np.full( dr2.shape[0], np.inf ), np.full( dr2.shape[0], -1, dtype = 'i' )
+    argmin = np.argmin( dr2, axis = 1 )
+    return dr2, dr2[ np.arange( dr2.shape[0] ), argmin ], argmin
+
+def minDeltaR( eta1, phi1, eta2, phi2, default = -1 ):
+    ''' Smallest deltaR of every object of the first collection to the second collection, default if that one is empty.
+    '''
+    _, dr2min, argmin = minDeltaR2( eta1, phi1, eta2, phi2 )
+    return np.where( argmin >= 0, np.sqrt( dr2min ), default )
+
+def columns( collection, variables ):
+    ''' Arrays (or lists) of the variables of a columnar collection or a list of dicts.
+    '''
+    if isColumnar( collection ):
+        return [ collection[var] for var in variables ]
+    return [ [ obj[var] for obj in collection ] for var in variables ]
+
+def select( collection, mask ):
+    ''' Apply a boolean mask or index array to all arrays of a columnar collection.
+    '''
+    if hasattr( collection, 'select' ):
+        # JaggedCollection.Collection
+        return collection.select( mask )
+    return { key: value[mask] if isinstance( value, np.ndarray ) else value for key, value in collection.items() }
+
+def element( collection, i ):
+    ''' Object i of a columnar collection as dict.
+    '''
+    if not isinstance( collection, dict ):
+        # view of a JaggedCollection.Collection
+        return collection[i]
+    res = { key: value[i] for key, value in collection.items() if isinstance( value, np.ndarray ) }
+    if 'index' not in res: res['index'] = i
+    return res
+
+# Invariant masses of pairs and triplets, computed like TLorentzVector: sum of (px, py, pz, E), M = sign(m2)*sqrt(|m2|).
+# The *Batch functions take the objects of many events as flat arrays and offsets (e.g. of a JaggedCollection), 
+# the events are processed in groups of the same multiplicity. The per event functions call them with a single event.
+
+def fourVectors( pt, eta, phi, mass = 0. ):
+    ''' (px, py, pz, E) as TLorentzVector.SetPtEtaPhiM.
+    '''
+    pt, eta, phi = np.asarray( pt, dtype = 'd' ), np.asarray( eta, dtype = 'd' ), np.asarray( phi, dtype = 'd' )
+    px, py, pz   = pt*np.cos( phi ), pt*np.sin( phi ), pt*np.sinh( eta )
+    return px, py, pz, np.sqrt( px*px + py*py + pz*pz + np.asarray( mass, dtype = 'd' )**2 )
+
+def invariantMass( px, py, pz, E ):
+    m2 = E*E - ( px*px + py*py + pz*pz )
+    return np.sign( m2 )*np.sqrt( np.abs( m2 ) )
+
+def _byMultiplicity( offsets ):
+    ''' Yield ( n, events, index ) for every multiplicity n. index[i_event, i] is the position of object i of the event in the flat arrays.
+    '''
+    offsets = np.asarray( offsets, dtype = 'i8' )
+    counts  = np.diff( offsets )
+    for n in np.unique( counts ):
+        events = np.flatnonzero( counts == n )
+        yield int(n), events, offsets[:-1][events][:, np.newaxis] + np.arange( n )[np.newaxis, :]
+
+def _pairs( index, pt, eta, phi ):
+    ''' Masses of all pairs in combination order (0,1), (0,2), ..., (1,2), ... and the indices of the pairs.
+    '''
+    i1, i2 = np.triu_indices( index.shape[1], 1 )
+    px, py, pz, E = [ v[index] for v in fourVectors( pt, eta, phi ) ]
+    return invariantMass( px[:, i1] + px[:, i2], py[:, i1] + py[:, i2], pz[:, i1] + pz[:, i2], E[:, i1] + E[:, i2] ), i1, i2
+
+def _osSF( index, pdgId, i1, i2 ):
+    pdgId = np.asarray( pdgId )[index]
+    return ( pdgId[:, i1]*pdgId[:, i2] < 0 ) & ( np.abs( pdgId[:, i1] ) == np.abs( pdgId[:, i2] ) )
+
+def sortedZCandidatesBatch( offsets, pt, eta, phi, pdgId, mZ = 91.1876 ):
+    ''' Opposite sign same flavor pairs sorted by |m-mZ|, keeping only pairs without already used objects.
+        Returns a list of [ (m, i1, i2), ... ] per event.
+    '''
+    result = [ [] for i in range( len(offsets) - 1 ) ]
+    for n, events, index in _byMultiplicity( offsets ):
+        if n<2: continue
+        m, i1, i2 = _pairs( index, pt, eta, phi )
+        valid = _osSF( index, pdgId, i1, i2 )
+        order = np.argsort( np.where( valid, np.abs( m - mZ ), np.inf ), axis = 1, kind = 'mergesort' )
+        used  = np.zeros( index.shape, dtype = bool )
+        rows  = np.arange( len(events) )
+        accepted = []
+        for k in range( order.shape[1] ):
+            p = order[:, k]
+            ok = valid[rows, p] & ~used[rows, i1[p]] & ~used[rows, i2[p]]
+            used[rows[ok], i1[p][ok]] = True
+            used[rows[ok], i2[p][ok]] = True
+            accepted.append( ( ok, p ) )
+        for ok, p in accepted:
+            for row in np.flatnonzero( ok ):
+                result[events[row]].append( ( float( m[row, p[row]] ), int( i1[p[row]] ), int( i2[p[row]] ) ) )
+    return result
+
+def closestOSDLMassToMZBatch( offsets, pt, eta, phi, pdgId, mZ = 91.1876 ):
+    ''' Opposite sign same flavor pair with mass closest to mZ. Returns arrays (m, i1, i2), (-999, -1, -1) if there is none.
+    '''
+    nEvents = len(offsets) - 1
+    res_m, res_i1, res_i2 = np.full( nEvents, -999. ), np.full( nEvents, -1, dtype = 'i8' ), np.full( nEvents, -1, dtype = 'i8' )
+    for n, events, index in _byMultiplicity( offsets ):
+        if n<2: continue
+        m, i1, i2 = _pairs( index, pt, eta, phi )
+        key   = np.where( _osSF( index, pdgId, i1, i2 ), np.abs( m - mZ ), np.inf )
+        best  = np.argmin( key, axis = 1 )
+        rows  = np.arange( len(events) )
+        found = np.isfinite( key[rows, best] )
+        res_m [events[found]] = m[rows, best][found]
+        res_i1[events[found]] = i1[best][found]
+        res_i2[events[found]] = i2[best][found]
+    return res_m, res_i1, res_i2
+
+def minDLMassBatch( offsets, pt, eta, phi ):
+    ''' Smallest mass of all pairs. Returns arrays (m, i1, i2), (nan, -1, -1) for less than two objects.
+    '''
+    nEvents = len(offsets) - 1
+    res_m, res_i1, res_i2 = np.full( nEvents, np.nan ), np.full( nEvents, -1, dtype = 'i8' ), np.full( nEvents, -1, dtype = 'i8' )
+    for n, events, index in _byMultiplicity( offsets ):
+        if n<2: continue
+        m, i1, i2 = _pairs( index, pt, eta, phi )
+        best = np.argmin( m, axis = 1 )
+        res_m[events], res_i1[events], res_i2[events] = m[np.arange( len(events) ), best], i1[best], i2[best]
+    return res_m, res_i1, res_i2
+
+def m3Batch( offsets, pt, eta, phi ):
+    ''' Mass of the three objects with the largest summed pT. Returns arrays (m3, i1, i2, i3), (nan, -1, -1, -1) for less than three objects.
+    '''
+    nEvents = len(offsets) - 1
+    res_m   = np.full( nEvents, np.nan )
+    res_i   = np.full( ( nEvents, 3 ), -1, dtype = 'i8' )
+    for n, events, index in _byMultiplicity( offsets ):
+        if n<3: continue
+        t = np.array( list( itertools.combinations( range(n), 3 ) ) )
+        px, py, pz, E = [ v[index] for v in fourVectors( pt, eta, phi ) ]
+        sx, sy, sz, sE = [ ( v[:, t[:,0]] + v[:, t[:,1]] ) + v[:, t[:,2]] for v in ( px, py, pz, E ) ]
+        sumPt = np.sqrt( sx*sx + sy*sy )
+        best  = np.argmax( sumPt, axis = 1 )
+        rows  = np.arange( len(events) )
+        found = sumPt[rows, best] > 0
+        res_m[events[found]] = invariantMass( sx, sy, sz, sE )[rows, best][found]
+        res_i[events[found]] = t[best][found]
+    return res_m, res_i[:, 0], res_i[:, 1], res_i[:, 2]
+
+def _single( n ):
+    return np.array( [ 0, n ] )
+
+def sortedZCandidates( pt, eta, phi, pdgId, mZ = 91.1876 ):
+    return sortedZCandidatesBatch( _single( len(pt) ), pt, eta, phi, pdgId, mZ = mZ )[0]
+
+def closestOSDLMassToMZ( pt, eta, phi, pdgId, mZ = 91.1876 ):
+    m, i1, i2 = closestOSDLMassToMZBatch( _single( len(pt) ), pt, eta, phi, pdgId, mZ = mZ )
+    return float( m[0] ), int( i1[0] ), int( i2[0] )
+
+def pairMasses( pt, eta, phi ):
+    ''' [ (m, i1, i2), ... ] of all pairs in the order of itertools.combinations.
+    '''
+    if len(pt)<2: return []
+    m, i1, i2 = _pairs( np.arange( len(pt) )[np.newaxis, :], pt, eta, phi )
+    return [ ( float( m[0, k] ), int( i1[k] ), int( i2[k] ) ) for k in range( len(i1) ) ]
+
+def m3( pt, eta, phi ):
+    m, i1, i2, i3 = m3Batch( _single( len(pt) ), pt, eta, phi )
+    return float( m[0] ), int( i1[0] ), int( i2[0] ), int( i3[0] )
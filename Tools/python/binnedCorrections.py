@@ -0,0 +1,213 @@
+''' Binned corrections (scale factors, efficiencies, prefiring rates, PU profiles) from the TH1 and TH2 maps in Tools/data.
+
+    Maps are converted once per process to lookup tables (lookupTable.py) that evaluate scalars and arrays, with
+    up/down variations. Tables are cached by file and key.
+
+    Tables are read from a bundle, a single binary file with an index of all tables that is memory-mapped: opening it
+    reads only the index, the arrays of a table are paged in when the table is first used. Build it with
+    Tools/scripts/buildCorrectionBundle.py (it converts all maps in bundleDirectories). The bundle at bundleFile is used
+    if it exists, ANALYSIS_CORRECTION_BUNDLE=<file> selects another one (ANALYSIS_CORRECTION_BUNDLE=0: none). Maps that
+    are not in the bundle, or whose ROOT file changed since the bundle was built, are read from the ROOT file.
+
+    Usage:
+    table = getTable( "$CMSSW_BASE/src/Analysis/Tools/data/photonSFData/g2017_PhotonsMedium.root", "EGamma_SF2D" )
+    sf    = table( eta, pt, sigma = 1 )
+    central, up, down = table.variations( eta, pt ).T
+    idIso = getProduct( [ ( file_ID, key_ID ), ( file_ISO, key_ISO ) ] )
+'''
+
+# Standard imports
+import os
+import json
+import struct
+import numpy as np
+
+from Analysis.Tools.lookupTable import LookupTable2D, fromArrays, fromHisto
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+dataDir = "$CMSSW_BASE/src/Analysis/Tools/data"
+
+bundleFile        = "$CMSSW_BASE/src/Analysis/Tools/data/corrections.bundle"
+bundleDirectories = [ "leptonSFData", "photonSFData", "L1Prefiring", "puReweightingData" ]
+
+# version 2: sources with size and modification time
+_magic = b"ANALYSIS_CORRECTIONS_2\n"
+
+# name -> LookupTable1D or LookupTable2D
+_tables = {}
+_bundle = None
+# the bundle is opened when the first table is needed
+_bundleChecked = False
+
+def tableName( fileName, key ):
+    ''' Name of a map in the cache and in bundles: 'directory/file.root:key', relative to the data directory if it is in it.
+    '''
+    return "%s:%s" % ( _relative( fileName ), key )
+
+def _relative( fileName ):
+    fileName = os.path.normpath( os.path.expandvars( fileName ) )
+    base     = os.path.normpath( os.path.expandvars( dataDir ) )
+    if fileName.startswith( base + os.sep ):
+        fileName = os.path.relpath( fileName, base )
+    return fileName
+
+class Bundle(object):
+    ''' Memory-mapped bundle of tables. Layout: magic line, length of the JSON index (8 bytes), index, padding to 8 bytes,
+        float64 data. The index has per table the source file (relative to dataDir) with its size and modification time and
+        the offset and shape of each array.
+    '''
+    def __init__( self, fileName ):
+        self.fileName = os.path.expandvars( fileName )
+        with open( self.fileName, 'rb' ) as _f:
+            if _f.read( len( _magic ) ) != _magic:
+                raise IOError( "%s is not a correction bundle of this version, rebuild it with buildCorrectionBundle.py." % self.fileName )
+            n = struct.unpack( '<Q', _f.read( 8 ) )[0]
+            index = json.loads( _f.read( n ).decode( 'utf-8' ) )
+        self.sources = index['sources']
+        self.tables  = index['tables']
+        offset       = len( _magic ) + 8 + n
+        offset      += -offset % 8
+        self.data    = np.memmap( self.fileName, dtype = '<f8', mode = 'r', offset = offset ) if index['size'] > 0 else np.zeros( 0 )
+        self._stale  = {}
+
+    def isStale( self, source ):
+        ''' True if the size or modification time of the ROOT file changed since the bundle was built (checked once per file).
+        '''
+        if source not in self._stale:
+            fileName = os.path.join( os.path.expandvars( dataDir ), source ) if not os.path.isabs( source ) else source
+            self._stale[source] = os.path.exists( fileName ) and _signature( fileName ) != self.sources[source]
+            if self._stale[source]:
+                logger.warning( "%s changed since the correction bundle %s was built. Reading it from the ROOT file.", source, self.fileName )
+        return self._stale[source]
+
+    def get( self, name ):
+        entry = self.tables.get( name )
+        if entry is None or self.isStale( entry['source'] ): return None
+        # views of the memory map, read when used
+        return fromArrays( { k:self.data[ offset:offset + int( np.prod( shape ) ) ].reshape( shape ) for k, ( offset, shape ) in entry['arrays'].items() } )
+
+    def __contains__( self, name ):
+        return name in self.tables
+
+    def __len__( self ):
+        return len( self.tables )
+
+def _signature( fileName ):
+    ''' [ size, mtime ] of a source file, as stored in the index.
+    '''
+    s = os.stat( fileName )
+    return [ s.st_size, s.st_mtime ]
+
+def writeBundle( fileName, tables, sources ):
+    ''' Write { name:table } to a bundle. sources: { name:fileName } of the ROOT files the tables come from.
+    '''
+    index  = { 'sources':{}, 'tables':{} }
+    arrays = []
+    offset = 0
+    for name in sorted( tables.keys() ):
+        source = sources[name]
+        index['sources'][_relative( source )] = _signature( os.path.expandvars( source ) )
+        entry = { 'source':_relative( source ), 'arrays':{} }
+        for k, a in sorted( tables[name].arrays().items() ):
+            a = np.ascontiguousarray( a, dtype = '<f8' )
+            entry['arrays'][k] = ( offset, list( a.shape ) )
+            arrays.append( a.ravel() )
+            offset += a.size
+        index['tables'][name] = entry
+    index['size'] = offset
+
+    header = json.dumps( index, sort_keys = True ).encode( 'utf-8' )
+    head   = _magic + struct.pack( '<Q', len( header ) ) + header
+    head  += b'\0'*( -len( head ) % 8 )
+    fileName = os.path.expandvars( fileName )
+    # readers see either the old or the new bundle
+    tmp = fileName + '.tmp%i' % os.getpid()
+    with open( tmp, 'wb' ) as _f:
+        _f.write( head )
+        for a in arrays:
+            _f.write( a.tobytes() )
+    os.rename( tmp, fileName )
+    logger.info( "Wrote %i tables (%i values) to %s", len( tables ), offset, fileName )
+
+def buildBundle( fileName = bundleFile, directories = bundleDirectories ):
+    ''' Convert all TH1 and TH2 in the ROOT files in directories (relative to dataDir) to a bundle.
+    '''
+    import ROOT
+    tables, sources = {}, {}
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk( os.path.join( os.path.expandvars( dataDir ), directory ) ):
+            dirnames.sort()
+            for filename in sorted( filenames ):
+                if not filename.endswith( '.root' ): continue
+                source = os.path.join( dirpath, filename )
+                f = ROOT.TFile.Open( source )
+                if not f or f.IsZombie():
+                    logger.error( "Could not open %s", source )
+                    continue
+                for key in f.GetListOfKeys():
+                    # only the highest cycle
+                    name = tableName( source, key.GetName() )
+                    if name in tables: continue
+                    obj = key.ReadObj()
+                    if not obj.InheritsFrom('TH1') or obj.InheritsFrom('TH3') or obj.InheritsFrom('TProfile') or obj.InheritsFrom('TH2Poly') or obj.InheritsFrom('TProfile2D'):
+                        logger.debug( "Skipping %s of class %s", name, obj.ClassName() )
+                        continue
+                    tables[name]  = fromHisto( obj )
+                    sources[name] = source
+                f.Close()
+    writeBundle( fileName, tables, sources )
+    return len( tables )
+
+def useBundle( fileName ):
+    ''' Read tables from the bundle. Tables that are not in it are read from the ROOT files. None: don't use a bundle.
+    '''
+    global _bundle, _bundleChecked
+    _bundleChecked = True
+    _bundle = Bundle( fileName ) if fileName is not None else None
+    if _bundle is not None:
+        logger.info( "Using correction bundle %s with %i tables", _bundle.fileName, len( _bundle ) )
+
+def _getBundle():
+    global _bundleChecked
+    if not _bundleChecked:
+        _bundleChecked = True
+        fileName = os.environ.get( 'ANALYSIS_CORRECTION_BUNDLE', bundleFile )
+        if fileName not in [ '', '0' ] and os.path.exists( os.path.expandvars( fileName ) ):
+            try:
+                useBundle( fileName )
+            except ( IOError, ValueError ) as e:
+                logger.error( "Could not read correction bundle %s: %r", fileName, e )
+    return _bundle
+
+def getTable( fileName, key ):
+    ''' Lookup table of the TH1 or TH2 key in fileName, from the cache, the bundle or the ROOT file.
+    '''
+    name  = tableName( fileName, key )
+    table = _tables.get( name )
+    if table is not None: return table
+
+    bundle = _getBundle()
+    table  = bundle.get( name ) if bundle is not None else None
+    if table is None:
+        # no ROOT when everything comes from the bundle
+        from Analysis.Tools.helpers import getObjFromFile
+        h = getObjFromFile( os.path.expandvars( fileName ), key )
+        if not h:
+            raise IOError( "Could not load map %s from file %s." % ( key, fileName ) )
+        table = fromHisto( h )
+        logger.debug( "Loaded %s from ROOT file", name )
+    _tables[name] = table
+    return table
+
+def getProduct( maps ):
+    ''' Product (with uncorrelated errors) of the 2D maps [ ( fileName, key ), ... ].
+    '''
+    return LookupTable2D.multiply( [ getTable( fileName, key ) for fileName, key in maps ] )
+
+def clear():
+    ''' Forget the loaded tables.
+    '''
+    _tables.clear()
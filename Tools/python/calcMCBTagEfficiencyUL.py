@@ -4,11 +4,10 @@ import ROOT
 import ROOT.TMath
 import ROOT.Math
 import pickle
-import time
-import hashlib
 
 # Analysis Imports
 from Analysis.Tools.BTagEfficiencyUL import *
+from Analysis.Tools.histoFiller import HistoFiller
 
 def getBTagMCTruthEfficiencies( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[] ):
     print c, cut
@@ -18,49 +17,44 @@ def getBTagMCTruthEfficiencies( c, cut="(1)", overwrite=False, btagVar='Jet_btag
     mceff = {}
     commoncf = cut + "&&"
 
+    flavor_cuts = [
+        ( "b",     "abs(Jet_hadronFlavour)==5" ),
+        ( "c",     "abs(Jet_hadronFlavour)==4" ),
+        ( "other", "(abs(Jet_hadronFlavour) < 4  || abs(Jet_hadronFlavour) > 5)" ),
+        ]
+
+    # all bins in one loop over the chain
+    filler = HistoFiller( c )
+    histos = {}
     for ptBin in ptBins:
-        mceff[ tuple(ptBin) ] = {}
         for etaBin in etaBins:
-            mceff[ tuple(ptBin) ][ tuple(etaBin) ] = {}
             etaCut = "abs(Jet_eta)>" + str(etaBin[0]) + "&&abs(Jet_eta)<" + str(etaBin[1])
             ptCut  = "Jet_pt>" + str(ptBin[0])
 
             if ptBin[1]>0:
                 ptCut += "&&Jet_pt<"+str(ptBin[1])
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hbQuark(100,-1,2)",commoncf+"abs(Jet_hadronFlavour)==5&&                     "+etaCut+"&&"+ptCut)
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hcQuark(100,-1,2)",commoncf+"abs(Jet_hadronFlavour)==4&&                     "+etaCut+"&&"+ptCut)
-            c.Draw(commoncf+"("+btagVar+">"+str(btagWP)+")>>hOther(100,-1,2)" ,commoncf+"(abs(Jet_hadronFlavour) < 4  || abs(Jet_hadronFlavour) > 5)&&  "+etaCut+"&&"+ptCut)
-            hbQuark = ROOT.gDirectory.Get("hbQuark")
-            hcQuark = ROOT.gDirectory.Get("hcQuark")
-            hOther = ROOT.gDirectory.Get("hOther")
-            mceff[tuple(ptBin)][tuple(etaBin)]["b"]     = hbQuark.GetMean()
-            mceff[tuple(ptBin)][tuple(etaBin)]["c"]     = hcQuark.GetMean()
-            mceff[tuple(ptBin)][tuple(etaBin)]["other"] = hOther.GetMean()
+            histos[ ( tuple(ptBin), tuple(etaBin) ) ] = { flavor:filler.book( commoncf+"("+btagVar+">"+str(btagWP)+")", [100,-1,2], selection = commoncf+flavor_cut+"&&"+etaCut+"&&"+ptCut, weight = None ) for flavor, flavor_cut in flavor_cuts }
+    filler.run()
 
-            print "Eta",etaBin,etaCut,"Pt",ptBin,ptCut,"Found b/c/other", mceff[tuple(ptBin)][tuple(etaBin)]["b"], mceff[tuple(ptBin)][tuple(etaBin)]["c"], mceff[tuple(ptBin)][tuple(etaBin)]["other"]
+    for ptBin in ptBins:
+        mceff[ tuple(ptBin) ] = {}
+        for etaBin in etaBins:
+            mceff[ tuple(ptBin) ][ tuple(etaBin) ] = {}
+            for flavor, _ in flavor_cuts:
+                mceff[tuple(ptBin)][tuple(etaBin)][flavor] = histos[ ( tuple(ptBin), tuple(etaBin) ) ][flavor].GetMean()
 
-            del hbQuark, hcQuark, hOther
+            print "Eta",etaBin,"Pt",ptBin,"Found b/c/other", mceff[tuple(ptBin)][tuple(etaBin)]["b"], mceff[tuple(ptBin)][tuple(etaBin)]["c"], mceff[tuple(ptBin)][tuple(etaBin)]["other"]
 
     if overwrite: pickle.dump( mceff, file(bTagEffFile, 'w') )
     return mceff
 
 def getBTagMCTruthEfficiencies2D( c, cut="(1)", overwrite=False, btagVar='Jet_btagCSVV2', btagWP='0.8484', etaBins=[] ):
 
-    from array import array
-
     etaBorders = sorted( list( set( sum( etaBins, [] ) ) ) )
 
     mceff = {}
     c.SetEventList(0)
 
-    if cut and cut.replace(" ","")!= "(1)":
-        print "Setting Event List with cut: %s"%cut
-        eListName = "eList_%s"%hashlib.md5("%s"%time.time()).hexdigest()
-        print eListName
-        print cut
-        c.Draw(">>%s"%eListName,cut)
-        c.SetEventList( getattr(ROOT,eListName))
-
     passed_hists = {}
     total_hists = {}
     ratios = {}
@@ -78,14 +72,14 @@ def getBTagMCTruthEfficiencies2D( c, cut="(1)", overwrite=False, btagVar='Jet_bt
    
     flavors = flavor_cuts.keys()
  
+    # passed and total histograms of all flavors in one loop over the chain
+    filler = HistoFiller( c )
+    for flavor in flavors:
+        passed_hists[flavor] = filler.book( "abs(Jet_eta):Jet_pt", [ptBorders, etaBorders], selection = ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor], '%s>%s'%(btag_var, btag_wp)]), weight = None, binningIsExplicit = True, name = 'passed_%s'%flavor )
+        total_hists[flavor]  = filler.book( "abs(Jet_eta):Jet_pt", [ptBorders, etaBorders], selection = ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor] ]), weight = None, binningIsExplicit = True, name = 'total_%s'%flavor )
+    filler.run()
+
     for flavor in flavors:
-        print "flavor", flavor
-        passed_name = 'passed_%s'%flavor
-        passed_hists[flavor] = ROOT.TH2D( passed_name, passed_name , len(ptBorders)-1, array('d',ptBorders), len(etaBorders)-1, array('d', etaBorders) )
-        total_name = 'total_%s'%flavor
-        total_hists[flavor] = ROOT.TH2D( total_name, total_name , len(ptBorders)-1, array('d',ptBorders), len(etaBorders)-1, array('d', etaBorders) )
-        c.Draw("abs(Jet_eta):Jet_pt>>%s"%passed_name, ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor], '%s>%s'%(btag_var, btag_wp)]))
-        c.Draw("abs(Jet_eta):Jet_pt>>%s"%total_name, ' && '.join("(%s)"%x for x in [cut,jet_quality_cut, flavor_cuts[flavor] ]))
         ratios[flavor] = passed_hists[flavor].Clone("ratio_%s"%flavor)
         ratios[flavor].Divide( total_hists[flavor]) 
 
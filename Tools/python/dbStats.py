@@ -0,0 +1,153 @@
+''' Opt-in instrumentation of DirDB, MergingDirDB, ShardedDirDB, ResultsDB and CachedDB.
+    Counts calls, hits, misses and wall time per class and operation, and bytes read and written per class.
+    Only the outermost instrumented call is counted (e.g. CachedDB.get, not the DirDB.get it makes), bytes where they are read and written.
+
+    Enable with the environment variable ANALYSIS_DB_STATS=1 or by calling enable().
+    A summary is logged at exit. With ANALYSIS_DB_STATS_JSON=<file> (or enable( jsonFile = <file> )) it is also written as JSON;
+    aggregate( files ) sums the JSON files of many batch jobs.
+'''
+
+# Standard imports
+import os
+import sys
+import time
+import json
+import atexit
+import socket
+import threading
+import functools
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+enabled   = False
+json_file = None
+
+# (class, operation) -> { 'calls', 'hits', 'misses', 'seconds', 'max_seconds' }
+operations = {}
+# class -> { 'read', 'written' }
+io_bytes   = {}
+
+_lock       = threading.Lock()
+# instrumented call in progress in this thread
+_local      = threading.local()
+_registered = False
+
+def enable( jsonFile = None ):
+    ''' Start counting. The summary is logged at exit and written to jsonFile, if given.
+    '''
+    global enabled, json_file, _registered
+    enabled = True
+    if jsonFile is not None:
+        json_file = jsonFile
+    if not _registered:
+        atexit.register( summary )
+        _registered = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        operations.clear()
+        io_bytes.clear()
+
+def record( cls, operation, seconds, hits = 0, misses = 0 ):
+    with _lock:
+        s = operations.setdefault( (cls, operation), { 'calls':0, 'hits':0, 'misses':0, 'seconds':0., 'max_seconds':0. } )
+        s['calls']       += 1
+        s['hits']        += hits
+        s['misses']      += misses
+        s['seconds']     += seconds
+        s['max_seconds']  = max( s['max_seconds'], seconds )
+
+def count_bytes( cls, read = 0, written = 0 ):
+    ''' Called by the DB classes where they actually read and write.
+    '''
+    if not enabled: return
+    with _lock:
+        b = io_bytes.setdefault( cls, { 'read':0, 'written':0 } )
+        b['read']    += read
+        b['written'] += written
+
+def _found( result ):
+    # DirDB & MergingDirDB return None, ResultsDB returns False if nothing was found
+    return not ( result is None or result is False )
+
+def instrument( operation, lookup = None ):
+    ''' Decorator for DB methods. lookup = 'one' counts a hit or miss from the result, 'many' one per entry of the returned list.
+    '''
+    def decorator( method ):
+        @functools.wraps( method )
+        def wrapper( self, *args, **kwargs ):
+            if not enabled or getattr( _local, 'active', False ):
+                return method( self, *args, **kwargs )
+            _local.active = True
+            try:
+                start  = time.time()
+                result = method( self, *args, **kwargs )
+            finally:
+                _local.active = False
+            hits, misses = 0, 0
+            if lookup == 'one':
+                # contains of ResultsDB returns the number of entries
+                if ( bool( result ) if operation == 'contains' else _found( result ) ): hits = 1
+                else: misses = 1
+            elif lookup == 'many' and isinstance( result, list ):
+                hits   = sum( 1 for r in result if _found( r ) )
+                misses = len( result ) - hits
+            record( self.__class__.__name__, operation, time.time() - start, hits = hits, misses = misses )
+            return result
+        return wrapper
+    return decorator
+
+def as_dict():
+    with _lock:
+        return {
+            'host':       socket.gethostname(),
+            'pid':        os.getpid(),
+            'argv':       sys.argv,
+            'operations': [ dict( cls = cls, operation = operation, **s ) for ( cls, operation ), s in sorted( operations.items() ) ],
+            'bytes':      [ dict( cls = cls, **b ) for cls, b in sorted( io_bytes.items() ) ],
+            }
+
+def summary():
+    ''' Log the summary and write the JSON file.
+    '''
+    if len(operations)==0 and len(io_bytes)==0: return
+    logger.info( "Cache DB statistics:" )
+    logger.info( "%-14s %-14s %8s %8s %8s %10s %10s", "class", "operation", "calls", "hits", "misses", "total [s]", "max [s]" )
+    for ( cls, operation ), s in sorted( operations.items() ):
+        logger.info( "%-14s %-14s %8i %8i %8i %10.3f %10.3f", cls, operation, s['calls'], s['hits'], s['misses'], s['seconds'], s['max_seconds'] )
+    for cls, b in sorted( io_bytes.items() ):
+        logger.info( "%-14s read %3.1f MB, written %3.1f MB", cls, b['read']/1024.**2, b['written']/1024.**2 )
+    if json_file is not None:
+        try:
+            with open( json_file, 'w' ) as _f:
+                json.dump( as_dict(), _f, indent = 1 )
+            logger.info( "Wrote cache DB statistics to %s", json_file )
+        except IOError as e:
+            logger.error( "Could not write cache DB statistics to %s: %r", json_file, e )
+
+def aggregate( files ):
+    ''' Sum the operations and bytes of JSON files written by many jobs. Returns ( operations, io_bytes ) like in this module.
+    '''
+    _operations, _io_bytes = {}, {}
+    for f in files:
+        with open( f ) as _f:
+            d = json.load( _f )
+        for s in d['operations']:
+            o = _operations.setdefault( (s['cls'], s['operation']), { 'calls':0, 'hits':0, 'misses':0, 'seconds':0., 'max_seconds':0. } )
+            for k in [ 'calls', 'hits', 'misses', 'seconds' ]:
+                o[k] += s[k]
+            o['max_seconds'] = max( o['max_seconds'], s['max_seconds'] )
+        for b in d['bytes']:
+            _b = _io_bytes.setdefault( b['cls'], { 'read':0, 'written':0 } )
+            _b['read']    += b['read']
+            _b['written'] += b['written']
+    return _operations, _io_bytes
+
+if os.environ.get( 'ANALYSIS_DB_STATS', '' ) not in [ '', '0' ] or os.environ.get( 'ANALYSIS_DB_STATS_JSON' ):
+    enable( jsonFile = os.environ.get( 'ANALYSIS_DB_STATS_JSON' ) )
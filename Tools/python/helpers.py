@@ -6,6 +6,12 @@ import ROOT
 import itertools
 from math                             import pi, sqrt, cosh, cos, sin, isnan
 from array                            import array
+import numpy as np
+
+import Analysis.Tools.arrayHelpers as arrayHelpers
+from Analysis.Tools.histoFiller import HistoFiller
+import Analysis.Tools.profiling as profiling
+from Analysis.Tools.ArrayHisto import ArrayHisto
 
 # Logging
 import logging
@@ -37,6 +43,15 @@ def chunk( tot, n_split, index):
 #    return res
 
 def sum_histos( histos ):
+    ''' Clone of the first histogram with the sum of all. TH1 and TH2 are summed as arrays (ArrayHisto), after checking all bin edges.
+    '''
+    try:
+        arrayHistos = [ ArrayHisto.fromTH1( histo ) for histo in histos ]
+    except TypeError:
+        arrayHistos = None
+
+    if arrayHistos is not None:
+        return ArrayHisto.sum( arrayHistos ).toTH1( template = histos[0] )
 
     res = histos[0].Clone()
 
@@ -74,6 +89,10 @@ def natural_sort(list, key=lambda s:s):
 
 def dRCleaning( col1, col2, dR):
     'Clean col1 with col2'
+    if arrayHelpers.isColumnar(col1) and arrayHelpers.isColumnar(col2):
+        # all pairs at once, keep objects of col1 that are farther than dR from all of col2
+        _, dr2min, _ = arrayHelpers.minDeltaR2( col1['eta'], col1['phi'], col2['eta'], col2['phi'] )
+        return arrayHelpers.select( col1, ~(dr2min<dR**2) )
     res = []
     for o1 in col1:
         clean = True
@@ -86,6 +105,14 @@ def dRCleaning( col1, col2, dR):
     return res
     
 def bestDRMatchInCollection(l, coll, deltaR = 0.2, deltaRelPt = 0.5 ):
+    if arrayHelpers.isColumnar(coll):
+        dr2  = arrayHelpers.deltaR2Matrix( l['eta'], l['phi'], coll['eta'], coll['phi'] )[0]
+        good = dr2 < deltaR**2
+        if deltaRelPt >= 0:
+            good &= np.abs( -1 + np.asarray(coll['pt'], dtype='d')/l['pt'] ) < deltaRelPt
+        if not good.any(): return None
+        # first of the closest, as the stable sort of the list below
+        return arrayHelpers.element( coll, np.flatnonzero(good)[np.argmin(dr2[good])] )
     lst = []
     for l2 in coll:
         dr2 = deltaR2(l, l2)
@@ -97,10 +124,11 @@ def bestDRMatchInCollection(l, coll, deltaR = 0.2, deltaRelPt = 0.5 ):
     else:
         return None
 
-def getCollection(c, prefix, variables, counter_variable):
-    return [getObjDict(c, prefix+'_', variables, i) for i in range(int(getVarValue(c, counter_variable)))]
-
-def getFileList(dir, histname='histo', maxN=-1):
+def getFileList(dir, histname='histo', maxN=-1, manifest=None):
+    ''' manifest: sampleManifest.SampleManifest, lists the directory from its cache
+    '''
+    if manifest is not None:
+        return [f for f, entries, good in manifest.files(dir, histname, maxN)]
     import os
     filelist = os.listdir(os.path.expanduser(dir))
     filelist = [dir+'/'+f for f in filelist if histname in f and f.endswith(".root")]
@@ -109,36 +137,38 @@ def getFileList(dir, histname='histo', maxN=-1):
     return filelist
 
 def getSortedZCandidates(leptons):
-    inds = range(len(leptons))
-    vecs = [ ROOT.TLorentzVector() for i in inds ]
-    for i, v in enumerate(vecs):
-        v.SetPtEtaPhiM(leptons[i]['pt'], leptons[i]['eta'], leptons[i]['phi'], 0.)
-    dlMasses = [((vecs[comb[0]] + vecs[comb[1]]).M(), comb[0], comb[1])  for comb in itertools.combinations(inds, 2) if leptons[comb[0]]['pdgId']*leptons[comb[1]]['pdgId'] < 0 and abs(leptons[comb[0]]['pdgId']) == abs(leptons[comb[1]]['pdgId']) ]
-    # sort the candidates, only keep the best ones
-    dlMasses = sorted(dlMasses, key=lambda (m,i1,i2):abs(m-91.1876))
-    usedIndices = []
-    bestCandidates = []
-    for m in dlMasses:
-        if m[1] not in usedIndices and m[2] not in usedIndices:
-            usedIndices += m[1:3]
-            bestCandidates.append(m)
-    return bestCandidates
-
-def getChain(sampleList, histname='', maxN=-1, treeName="Events"):
+    ''' Opposite sign same flavor pairs [(m, i1, i2), ...] sorted by |m-mZ|, without overlaps. Leptons are massless.
+    '''
+    return arrayHelpers.sortedZCandidates(*arrayHelpers.columns(leptons, ['pt', 'eta', 'phi', 'pdgId']))
+
+def getChain(sampleList, histname='', maxN=-1, treeName="Events", nWorkers=None):
+    ''' Files are listed and checked with a sampleManifest, which is cached and rebuilt when the directory changes.
+        Files are added with their number of entries, hence not opened.
+        nWorkers: files are checked in parallel by rootFileChecker, None: in this process if there are only a few to check
+    '''
+    from Analysis.Tools.sampleManifest import SampleManifest
     if not type(sampleList)==type([]):
         sampleList_ = [sampleList]
     else:
         sampleList_= sampleList
     c = ROOT.TChain(treeName)
     i=0
+    manifest = SampleManifest(treeName=treeName, nWorkers=nWorkers)
+    def addFiles( directory ):
+        n = 0
+        for f, entries, good in manifest.files(directory, histname, maxN):
+            if good:
+                n+=1
+                if entries>0:
+                    c.Add(f, entries)
+                else:
+                    c.Add(f)
+            else:
+                print "File %s looks broken."%f
+        return n
     for s in sampleList_:
         if type(s)==type(""):
-            for f in getFileList(s, histname, maxN):
-                if checkRootFile(f, checkForObjects=[treeName]):
-                    i+=1
-                    c.Add(f)
-                else:
-                    print "File %s looks broken."%f
+            i+=addFiles(s)
             print "Added ",i,'files from samples %s' %(", ".join([s['name'] for s in sampleList_]))
         elif type(s)==type({}):
             if s.has_key('file'):
@@ -148,12 +178,7 @@ def getChain(sampleList, histname='', maxN=-1, treeName="Events"):
             if s.has_key('bins'):
                 for b in s['bins']:
                     dir = s['dirname'] if s.has_key('dirname') else s['dir']
-                    for f in getFileList(dir+'/'+b, histname, maxN):
-                        if checkRootFile(f, checkForObjects=[treeName]):
-                            i+=1
-                            c.Add(f)
-                        else:
-                            print "File %s looks broken."%f
+                    i+=addFiles(dir+'/'+b)
 #      print 'Added %i files from %i elements' %(i, len(sampleList))
         else:
 #      print sampleList
@@ -262,10 +287,22 @@ def getObjDict(c, prefix, variables, i):
     res['index']=i
     return res
 
-def getCollection(c, prefix, variables, counter_variable):
+def getCollection(c, prefix, variables, counter_variable, columnar = False):
+    ''' List of dicts, one per object. With columnar = True a JaggedCollection.Collection with one array per variable
+        and views per object that support obj['pt'] as well.
+    '''
+    if columnar:
+        from Analysis.Tools.JaggedCollection import Collection
+        return Collection.fromEvent(c, prefix, variables, counter_variable)
     return [getObjDict(c, prefix+'_', variables, i) for i in range(int(getVarValue(c, counter_variable)))]
 
-def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight", weightFunc = None, returnVar=False):
+def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight", weightFunc = None, returnVar=False, variables = None, chunkSize = 0):
+    ''' Sum of weights (and of squared weights) of the events passing cutString and cutFunc.
+        chunkSize>0: read chunks of arrays, cutFunc( chunk ) and weightFunc( chunk ) are vectorized (see vectorizedSequence.EventChunk)
+        and variables are the RootTools style strings of the branches they need, e.g. ['nJetGood/I', 'JetGood[pt/F]'].
+    '''
+    if chunkSize>0:
+        return _getCutYieldFromChunks(c, cutString = cutString, cutFunc = cutFunc, weight = weight, weightFunc = weightFunc, returnVar = returnVar, variables = variables, chunkSize = chunkSize)
     c.Draw(">>eList", cutString)
     elist = ROOT.gDirectory.Get("eList")
     number_events = elist.GetN()
@@ -287,31 +324,49 @@ def getCutYieldFromChain(c, cutString = "(1)", cutFunc = None, weight = "weight"
         return res, resVar
     return res
 
+def _getCutYieldFromChunks(c, cutString = "(1)", cutFunc = None, weight = "weight", weightFunc = None, returnVar=False, variables = None, chunkSize = 100000):
+    from Analysis.Tools.vectorizedSequence import readChunks
+    read_variables = list( variables ) if variables is not None else []
+    if weight:
+        read_variables.append( weight+"/D" )
+    res = 0.
+    resVar=0.
+    for chunk in readChunks( c, read_variables, chunkSize = chunkSize, selection = cutString ):
+        w = getattr( chunk, weight ) if weight else np.ones( chunk.nEvents )
+        if weightFunc:
+            w = w*weightFunc(chunk)
+        if cutFunc:
+            w = w[ np.asarray( cutFunc(chunk), dtype = bool ) ]
+        res    += w.sum()
+        resVar += (w**2).sum()
+    if returnVar:
+        return res, resVar
+    return res
+
 def getYieldFromChain(c, cutString = "(1)", weight = "weight", returnError=False):
-    h = ROOT.TH1D('h_tmp', 'h_tmp', 1,0,2)
-    h.Sumw2()
-    c.Draw("1>>h_tmp", "("+weight+")*("+cutString+")", 'goff')
+    filler = HistoFiller( c )
+    h = filler.bookYield( selection = cutString, weight = weight, name = 'h_tmp' )
+    filler.run()
     res = h.GetBinContent(1)
     resErr = h.GetBinError(1)
-#  print "1>>h_tmp", weight+"*("+cutString+")",res,resErr
-    del h
     if returnError:
         return res, resErr
     return res
 
+def getYieldsFromChain(c, cutStrings, weight = "weight", returnError=False):
+    ''' getYieldFromChain for many selections in one loop over the chain
+    '''
+    filler = HistoFiller( c )
+    histos = [ filler.bookYield( selection = cutString, weight = weight ) for cutString in cutStrings ]
+    filler.run()
+    if returnError:
+        return [ ( h.GetBinContent(1), h.GetBinError(1) ) for h in histos ]
+    return [ h.GetBinContent(1) for h in histos ]
+
 def getPlotFromChain(c, var, binning, cutString = "(1)", weight = "weight", binningIsExplicit=False, addOverFlowBin=''):
-    if binningIsExplicit:
-        h = ROOT.TH1D('h_tmp', 'h_tmp', len(binning)-1, array('d', binning))
-#    h.SetBins(len(binning), array('d', binning))
-    else:
-        if len(binning)==6:
-            h = ROOT.TH2D('h_tmp', 'h_tmp', *binning)
-        else:
-            h = ROOT.TH1D('h_tmp', 'h_tmp', *binning)
-    c.Draw(var+">>h_tmp", weight+"*("+cutString+")", 'goff')
-    res = h.Clone()
-    h.Delete()
-    del h
+    filler = HistoFiller( c )
+    res = filler.book( var, binning, selection = cutString, weight = weight, binningIsExplicit = binningIsExplicit, name = 'h_tmp' )
+    filler.run()
     if addOverFlowBin.lower() == "upper" or addOverFlowBin.lower() == "both":
         nbins = res.GetNbinsX()
 #    print "Adding", res.GetBinContent(nbins + 1), res.GetBinError(nbins + 1)
@@ -323,10 +378,13 @@ def getPlotFromChain(c, var, binning, cutString = "(1)", weight = "weight", binn
     return res
 
 def timeit(method):
+    ''' Log the duration of every call. With profiling enabled, calls are also aggregated in the section method.__name__.
+    '''
     import time
     def timed(*args, **kw):
         ts = time.time()
-        result = method(*args, **kw)
+        with profiling.section( method.__name__ ):
+            result = method(*args, **kw)
         te = time.time()
         logger.debug("Method %s took %f  seconds", method.__name__, te-ts)
 #        if 'log_time' in kw:
@@ -338,35 +396,8 @@ def timeit(method):
         return result
     return timed
 
-import collections
-import functools
-
-# https://wiki.python.org/moin/PythonDecoratorLibrary#Memoize
-class memoized(object):
-   '''Decorator. Caches a function's return value each time it is called.
-   If called later with the same arguments, the cached value is returned
-   (not reevaluated).
-   '''
-   def __init__(self, func):
-      self.func = func
-      self.cache = {}
-   def __call__(self, *args):
-      if not isinstance(args, collections.Hashable):
-         # uncacheable. a list, for instance.
-         # better to not cache than blow up.
-         return self.func(*args)
-      if args in self.cache:
-         return self.cache[args]
-      else:
-         value = self.func(*args)
-         self.cache[args] = value
-         return value
-   def __repr__(self):
-      '''Return the function's docstring.'''
-      return self.func.__doc__
-   def __get__(self, obj, objtype):
-      '''Support instance methods.'''
-      return functools.partial(self.__call__, obj)
+# bounded LRU cache, see memoization.py
+from Analysis.Tools.memoization import memoized
 
 def cosThetaStar( Z_mass, Z_pt, Z_eta, Z_phi, l_pt, l_eta, l_phi ):
 
@@ -382,6 +413,8 @@ def cosThetaStar( Z_mass, Z_pt, Z_eta, Z_phi, l_pt, l_eta, l_phi ):
     return (-beta + cosTheta) / (1 - beta*cosTheta)
 
 def deltaPhi(phi1, phi2, returnAbs = True):
+    if isinstance(phi1, np.ndarray) or isinstance(phi2, np.ndarray):
+        return arrayHelpers.deltaPhi(phi1, phi2, returnAbs = returnAbs)
     if isnan(phi1) or isnan(phi2): return float('nan')
     dphi = phi2-phi1
     if  dphi > pi:
@@ -394,10 +427,17 @@ def deltaPhi(phi1, phi2, returnAbs = True):
         return dphi
 
 def deltaR2(l1, l2):
+    ''' For collections of arrays l1 = {'eta':array, 'phi':array} the matrix of all pairs, shape (len(l1), len(l2)).
+    '''
+    if isinstance(l1['phi'], np.ndarray) or isinstance(l2['phi'], np.ndarray):
+        return arrayHelpers.deltaR2Matrix(l1['eta'], l1['phi'], l2['eta'], l2['phi'])
     return deltaPhi(l1['phi'], l2['phi'])**2 + (l1['eta'] - l2['eta'])**2
 
 def deltaR(l1, l2):
-    return sqrt(deltaR2(l1,l2))
+    dr2 = deltaR2(l1,l2)
+    if isinstance(dr2, np.ndarray):
+        return np.sqrt(dr2)
+    return sqrt(dr2)
 
 def lp( l_pt, l_phi, met_pt, met_phi ):
     met = ROOT.TVector2( met_pt*cos(met_phi), met_pt*sin(met_phi) )
@@ -407,19 +447,11 @@ def lp( l_pt, l_phi, met_pt, met_phi ):
 
 # Returns (closest mass, index1, index2)
 def closestOSDLMassToMZ(leptons):
-    inds = range(len(leptons))
-    vecs = [ ROOT.TLorentzVector() for i in inds ]
-    for i, v in enumerate(vecs):
-        v.SetPtEtaPhiM(leptons[i]['pt'], leptons[i]['eta'], leptons[i]['phi'], 0.)
-    dlMasses = [((vecs[comb[0]] + vecs[comb[1]]).M(), comb[0], comb[1])  for comb in itertools.combinations(inds, 2) if leptons[comb[0]]['pdgId']*leptons[comb[1]]['pdgId'] < 0 and abs(leptons[comb[0]]['pdgId']) == abs(leptons[comb[1]]['pdgId']) ]
-    return min(dlMasses, key=lambda (m,i1,i2):abs(m-91.1876)) if len(dlMasses)>0 else (-999, -1, -1)
+    m, i1, i2 = arrayHelpers.closestOSDLMassToMZ(*arrayHelpers.columns(leptons, ['pt', 'eta', 'phi', 'pdgId']))
+    return (m, i1, i2) if i1>=0 else (-999, -1, -1)
 
 def getMinDLMass(leptons):
-    inds = range(len(leptons))
-    vecs = [ ROOT.TLorentzVector() for i in inds ]
-    for i, v in enumerate(vecs):
-        v.SetPtEtaPhiM(leptons[i]['pt'], leptons[i]['eta'], leptons[i]['phi'], 0.)
-    dlMasses = [((vecs[comb[0]] + vecs[comb[1]]).M(), comb[0], comb[1])  for comb in itertools.combinations(inds, 2) ]
+    dlMasses = arrayHelpers.pairMasses(*arrayHelpers.columns(leptons, ['pt', 'eta', 'phi']))
     return min(dlMasses), dlMasses
 
 def getGenZ(genparts):
@@ -444,20 +476,10 @@ def getGenB(genparts):
     return None
 
 def m3( jets ):
+    ''' Mass of the three jets with the largest vector summed pT, (m3, i1, i2, i3). Jets are massless.
+    '''
     if not len(jets)>=3: return float('nan'), -1, -1, -1
-    vecs = [(i, ROOT.TLorentzVector()) for i in range(len(jets))]
-    for i, v in enumerate(vecs):
-        v[1].SetPtEtaPhiM(jets[i]['pt'], jets[i]['eta'], jets[i]['phi'], 0.)
-    maxSumPt = 0
-    m3 = float('nan')
-    i1, i2, i3 = -1, -1, -1
-    for j3_comb in itertools.combinations(vecs, 3):
-        vecSum = sum( [v[1] for v in j3_comb], ROOT.TLorentzVector())
-        if vecSum.Pt()>maxSumPt:
-            maxSumPt = vecSum.Pt()
-            m3 = vecSum.M()
-            i1, i2, i3 =  [v[0] for v in j3_comb]
-    return m3, i1, i2, i3
+    return arrayHelpers.m3(*arrayHelpers.columns(jets, ['pt', 'eta', 'phi']))
 
 def mapRootFile( rootFile ):
     """ uses TFile.Map() function to check entries for GAP in basket
@@ -493,43 +515,22 @@ def checkWeight( rootFile ):
 def deepCheckRootFile( rootFile ):
     """ some root files are corrupt but can be opened and have all branches
         the error appears when checking every event after some time as a "basket" error
-        this can be checked using TFile.Map()
-        however python does not catch the error, thus the workaround
+        this can be checked using TFile.Map(), whose output is captured by rootFileChecker
+        however python does not catch the error, thus the check runs in a worker process
+        Many files are checked faster and cached with rootFileChecker.RootFileChecker( checks = ['map'] )
     """
-    import shlex
-    from subprocess import Popen, PIPE
-
-    cmd      = "python -c 'from Analysis.Tools.helpers import mapRootFile; mapRootFile(\"%s\")'"%rootFile
-    proc     = Popen( shlex.split(cmd), stdout=PIPE, stderr=PIPE)
-    out, err = proc.communicate()
-    # Desperate times call for desperate measures ... Somehow it is hard to catch all the errors
-#    corrupt  = "E R R O R" in out or "G A P" in out or "-" in out
-    good  = "KeysList" in out
-    return good 
-
-    # Somehow Map() does not catch all the basket errors, so we now scan over a selection resulting in no events, but this throws an error
-#    cmd      = "python -c 'from Analysis.Tools.helpers import scanRootFile; scanRootFile(\"%s\", var=\"%s\", thresh=%i)'"%(rootFile, var, thresh)
-#    proc     = Popen( shlex.split(cmd), stdout=PIPE, stderr=PIPE)
-#    out, err = proc.communicate()
-#    return not "Error" in err
+    from Analysis.Tools.rootFileChecker import checkFileIsolated
+    good, reason, entries = checkFileIsolated( rootFile, checks = ['map'] )
+    return good
 
 def deepCheckWeight( file ):
     """ some root files only contain the branches kept from the beginning
         but not those from the filler, e.g. the weight branch
         Those files are identified here, as weight==nan and thus the yield is nan
     """
-    from RootTools.core.Sample import Sample
-
-    # convert dpm file pathes
-    sample = Sample.fromFiles(name="sample", treeName="Events", files=file)
-    # check for branch:
-    l = sample.chain.GetListOfBranches()
-    if not 'weight' in [ l.At(i).GetName() for i in range(l.GetSize()) ]:
-        return 0
-    val = sample.getYieldFromDraw(weightString="weight" )['val']
-    del sample
-    #logger.debug("Val in deepCheckWeight: %r", val) 
-    return not isnan(val)
+    from Analysis.Tools.rootFileChecker import checkFile
+    good, reason, entries = checkFile( file, checks = ['weight'], treeName = "Events" )
+    return good
     
 def mTsq( p1, p2 ):
     return 2 * p1["pt"] * p2["pt"] * ( 1 - cos( deltaPhi( p1["phi"], p2["phi"] ) ) )
@@ -0,0 +1,118 @@
+''' Fill many histograms in a single pass over a chain instead of one TTree::Draw per histogram.
+
+    Histograms are booked with an expression, a binning, a selection and a weight and are all filled in one event loop
+    (Tools/scripts/histoFiller.cpp). Expressions and selections have the syntax of TTree::Draw and are filled the same
+    way, also for array expressions ('Jet_pt', 'abs(Jet_eta):Jet_pt').
+
+    Usage:
+    filler = HistoFiller( chain )
+    h_pt   = filler.book( "Jet_pt", [20,0,200], selection = "nJet>0", weight = "weight" )
+    h_yield= filler.bookYield( selection = "nJet>0", weight = "weight" )
+    filler.run()  # fills h_pt and h_yield
+'''
+
+# Standard imports
+import ROOT
+from array import array
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+def _load():
+    if not hasattr( ROOT, "histoFiller" ):
+        ROOT.gROOT.ProcessLine(".L $CMSSW_BASE/src/Analysis/Tools/scripts/histoFiller.cpp+")
+
+def splitExpression( expression ):
+    ''' Split 'y:x' as TTree::Draw does. '::' and ':' within brackets or after '?' don't split.
+    '''
+    parts, depth, ternary, start, i = [], 0, 0, 0, 0
+    while i < len(expression):
+        char = expression[i]
+        if char in "([": depth += 1
+        elif char in ")]": depth -= 1
+        elif char == '?': ternary += 1
+        elif char == ':':
+            if expression[i:i+2] == '::':
+                i += 2
+                continue
+            if depth == 0 and ternary == 0:
+                parts.append( expression[start:i] )
+                start = i+1
+            elif ternary > 0:
+                ternary -= 1
+        i += 1
+    parts.append( expression[start:] )
+    return parts
+
+def makeHisto( name, binning, binningIsExplicit = False, dimension = 1 ):
+    ''' TH1D/TH2D that is not attached to a directory.
+        binning: [nBins, low, high], [nx, xlow, xhigh, ny, ylow, yhigh] or, if binningIsExplicit, the bin edges ( [xEdges, yEdges] in 2D )
+    '''
+    addDirectory = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory( False )
+    try:
+        if binningIsExplicit:
+            if dimension == 2:
+                h = ROOT.TH2D( name, name, len(binning[0])-1, array('d', binning[0]), len(binning[1])-1, array('d', binning[1]) )
+            else:
+                h = ROOT.TH1D( name, name, len(binning)-1, array('d', binning) )
+        elif len(binning)==6:
+            h = ROOT.TH2D( name, name, *binning )
+        else:
+            h = ROOT.TH1D( name, name, *binning )
+    finally:
+        ROOT.TH1.AddDirectory( addDirectory )
+    return h
+
+class HistoFiller:
+    def __init__( self, chain ):
+        self.chain    = chain
+        self.bookings = []
+
+    def book( self, expression, binning, selection = "(1)", weight = "weight", binningIsExplicit = False, name = None ):
+        ''' Book the histogram of expression ('x' or 'y:x'). Returns the (empty) histogram that is filled by run().
+            weight = None uses only the selection.
+        '''
+        variables = splitExpression( expression )
+        if len(variables) > 2:
+            raise ValueError( "Only 1D and 2D histograms are supported, got %s" % expression )
+        if name is None:
+            name = "histoFiller_%i" % len(self.bookings)
+        h = makeHisto( name, binning, binningIsExplicit = binningIsExplicit, dimension = len(variables) )
+        if ( h.GetDimension() == 2 ) != ( len(variables) == 2 ):
+            raise ValueError( "Binning %r does not match the dimension of %s" % ( binning, expression ) )
+
+        # TTree::Draw convention: 'y:x'
+        x, y = ( variables[1], variables[0] ) if len(variables) == 2 else ( variables[0], "" )
+        self.bookings.append( ( h, x, y, "("+selection+")" if weight is None else "("+weight+")*("+selection+")" ) )
+        return h
+
+    def bookYield( self, selection = "(1)", weight = "weight", name = None ):
+        ''' One bin histogram with the weighted yield (and its uncertainty) of the selection in bin 1.
+        '''
+        h = self.book( "1", [1,0,2], selection = selection, weight = weight, name = name )
+        h.Sumw2()
+        return h
+
+    def run( self, firstEntry = 0, nEntries = -1 ):
+        ''' Fill all booked histograms in one loop over the chain. Returns the number of entries processed.
+        '''
+        if len(self.bookings) == 0: return 0
+        _load()
+
+        histos = ROOT.std.vector('TH1*')()
+        x, y, selections = ROOT.std.vector('string')(), ROOT.std.vector('string')(), ROOT.std.vector('string')()
+        for h, x_, y_, selection in self.bookings:
+            histos.push_back( h )
+            x.push_back( x_ )
+            y.push_back( y_ )
+            selections.push_back( selection )
+
+        logger.debug( "Filling %i histograms in one loop over %s", len(self.bookings), self.chain.GetName() )
+        result = ROOT.histoFiller.fill( self.chain, histos, x, y, selections, firstEntry, nEntries )
+        if result < 0:
+            h, x_, y_, selection = self.bookings[-1-result]
+            raise ValueError( "Could not compile booking %s: %s%s with selection %s" % ( h.GetName(), y_+":" if y_ else "", x_, selection ) )
+        self.bookings = []
+        return result
@@ -3,10 +3,17 @@
 # https://github.com/CERN-PH-CMG/cmg-cmssw/blob/0fdfc10e2a2d4732cbb5d540b46543498cb6d006/PhysicsTools/Heppy/python/analyzers/objects/JetAnalyzer.py#L25-L49
 
 from Analysis.Tools.helpers import deltaR2
+import Analysis.Tools.arrayHelpers as arrayHelpers
+import numpy as np
 
-def cleanJetsAndLeptons(jets, leptons, deltaR=0.4, arbitration = (lambda jet, lepton: lepton) ):
+def _defaultArbitration( jet, lepton ):
+    return lepton
+
+def cleanJetsAndLeptons(jets, leptons, deltaR=0.4, arbitration = _defaultArbitration ):
     # threshold
     dr2 = deltaR**2
+    if arrayHelpers.isColumnar(jets) and arrayHelpers.isColumnar(leptons):
+        return _cleanJetsAndLeptonsColumnar(jets, leptons, dr2, arbitration)
     # Assume jets and leptons are all good
     goodjet = [ True for jet in jets ]
     goodlep = [ True for lep in leptons ]
@@ -31,3 +38,30 @@ def cleanJetsAndLeptons(jets, leptons, deltaR=0.4, arbitration = (lambda jet, le
         if i_jet_best != -1: goodjet[i_jet_best] = False
     return ( [ jet for (i_jet, jet) in enumerate(jets)    if goodjet[i_jet] == True ], 
              [ lep for (i_lep, lep) in enumerate(leptons) if goodlep[i_lep] == True ])
+
+def _cleanJetsAndLeptonsColumnar(jets, leptons, dr2, arbitration):
+    ''' Same as above for collections of arrays {'pt':array, 'eta':array, ...}. The deltaR2 of all pairs is computed in one go.
+    '''
+    d2, d2min, i_best = arrayHelpers.minDeltaR2( leptons['eta'], leptons['phi'], jets['eta'], jets['phi'] )
+    goodjet = np.ones( d2.shape[1], dtype = bool )
+    goodlep = np.ones( d2.shape[0], dtype = bool )
+    if arbitration is _defaultArbitration:
+        # leptons always win: every lepton removes its closest jet within deltaR
+        goodjet[ i_best[ d2min < dr2 ] ] = False
+    else:
+        for i_lep in range( d2.shape[0] ):
+            i_jet_best, d2min_ = -1, dr2
+            lep = arrayHelpers.element( leptons, i_lep )
+            for i_jet in np.flatnonzero( d2[i_lep] < dr2 ):
+                jet    = arrayHelpers.element( jets, i_jet )
+                choice = arbitration(jet,lep)
+                if choice == jet:
+                    goodlep[i_lep] = False
+                    break
+                elif choice == (jet,lep) or choice == (lep,jet):
+                    continue
+                if d2[i_lep, i_jet] < d2min_:
+                    i_jet_best, d2min_ = i_jet, d2[i_lep, i_jet]
+            if not goodlep[i_lep]: continue
+            if i_jet_best != -1: goodjet[i_jet_best] = False
+    return arrayHelpers.select( jets, goodjet ), arrayHelpers.select( leptons, goodlep )
@@ -0,0 +1,222 @@
+''' Array based 2D lookup tables replacing TH2::FindBin and GetBinContent / GetBinError per call.
+
+    A LookupTable1D (LookupTable2D) holds the bin edges and the values and errors of all cells, including under- and overflow. Lookups
+    work on scalars and arrays and give the same cell as TH1::FindBin (TH2::FindBin): values below the first edge are in the underflow,
+    values at or above the last edge in the overflow.
+    Products and weighted sums of tables with uncertainty propagation as in u_float are precomputed on the union of the
+    bin edges, so a chain of maps (e.g. ID x ISO) costs a single lookup.
+
+    Usage:
+    table  = LookupTable2D.fromTH2( h )                    # x and y as in the TH2
+    val, err = table.lookup( eta, pt )
+    idIso  = LookupTable2D.multiply( [ table_ID, table_ISO ] )
+    lumiWeighted = LookupTable2D.combine( [ ( 0.55, idIso_BCDEF ), ( 0.45, idIso_GH ) ] )
+    central, up, down = table.variations( eta, pt ).T    # value + sigma*error for sigma = 0, 1, -1
+    sf     = table.at( eta, pt, sigma )                    # single lepton, without the numpy overhead
+'''
+
+# Standard imports
+from bisect import bisect_right
+import numpy as np
+
+from Analysis.Tools.ArrayHisto import ArrayHisto
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+def _variations( value, error, sigmas ):
+    ''' value + sigma*error for all sigmas, the last axis runs over the sigmas.
+    '''
+    sigmas = np.asarray( sigmas, dtype = 'd' )
+    return np.asarray( value )[...,None] + np.asarray( error )[...,None]*sigmas
+
+def fromArrays( arrays ):
+    ''' LookupTable1D or LookupTable2D from the dict of arrays written by arrays().
+    '''
+    if 'edges' in arrays:
+        return LookupTable1D( arrays['edges'], arrays['values'], arrays['errors'] )
+    return LookupTable2D( arrays['xEdges'], arrays['yEdges'], arrays['values'], arrays['errors'] )
+
+def fromHisto( h ):
+    ''' LookupTable1D for a TH1, LookupTable2D for a TH2.
+    '''
+    return LookupTable2D.fromTH2( h ) if h.InheritsFrom('TH2') else LookupTable1D.fromTH1( h )
+
+class LookupTable1D(object):
+    def __init__( self, edges, values, errors = None ):
+        '''
+        values, errors: arrays of length n+2, index 0 is the underflow and n+1 the overflow
+        '''
+        self.edges  = np.asarray( edges, dtype = 'd' )
+        self.values = np.asarray( values, dtype = 'd' )
+        self.errors = np.zeros_like( self.values ) if errors is None else np.asarray( errors, dtype = 'd' )
+        shape = ( len( self.edges ) + 1, )
+        if self.values.shape != shape or self.errors.shape != shape:
+            raise ValueError( "Values and errors need shape %r, got %r and %r." % ( shape, self.values.shape, self.errors.shape ) )
+        # python lists for at()
+        self._lists = None
+
+    @classmethod
+    def fromTH1( cls, h ):
+        ''' Contents and errors (GetBinError) of all bins of a TH1.
+        '''
+        a = ArrayHisto.fromTH1( h )
+        if a.dimension != 1:
+            raise ValueError( "Need a TH1, got %s of class %s." % ( h.GetName(), h.ClassName() ) )
+        return cls( a.edges[0], a.sumw, a.errors )
+
+    def bins( self, x ):
+        ''' Bin indices as TH1::FindBin, for scalars or arrays.
+        '''
+        return np.searchsorted( self.edges, x, side = 'right' )
+
+    def lookup( self, x ):
+        ''' ( value, error ) at x. Scalars or arrays of the shape of x.
+        '''
+        i = self.bins( x )
+        return self.values[i], self.errors[i]
+
+    def cell( self, bin ):
+        ''' ( value, error ) of a bin number, as GetBinContent( bin ), GetBinError( bin ).
+        '''
+        return self.values[bin], self.errors[bin]
+
+    def __call__( self, x, sigma = 0 ):
+        value, error = self.lookup( x )
+        return value + sigma*error
+
+    def at( self, x, sigma = 0 ):
+        ''' value + sigma*error at scalar x as a float, see LookupTable2D.at.
+        '''
+        if self._lists is None:
+            self._lists = ( self.edges.tolist(), self.values.tolist(), self.errors.tolist() )
+        edges, values, errors = self._lists
+        i = bisect_right( edges, x )
+        return values[i] + sigma*errors[i]
+
+    def variations( self, x, sigmas = ( 0, 1, -1 ) ):
+        ''' Array of shape x.shape + ( len(sigmas), ) with value + sigma*error.
+        '''
+        return _variations( *( self.lookup( x ) + ( sigmas, ) ) )
+
+    def arrays( self ):
+        return { 'edges':self.edges, 'values':self.values, 'errors':self.errors }
+
+    def __repr__( self ):
+        return "LookupTable1D(%i bins)" % ( len( self.edges ) - 1 )
+
+class LookupTable2D(object):
+    def __init__( self, xEdges, yEdges, values, errors = None ):
+        '''
+        values, errors: arrays of shape ( nx+2, ny+2 ), index 0 is the underflow and nx+1 the overflow
+        '''
+        self.xEdges = np.asarray( xEdges, dtype = 'd' )
+        self.yEdges = np.asarray( yEdges, dtype = 'd' )
+        self.values = np.asarray( values, dtype = 'd' )
+        self.errors = np.zeros_like( self.values ) if errors is None else np.asarray( errors, dtype = 'd' )
+        shape = ( len( self.xEdges ) + 1, len( self.yEdges ) + 1 )
+        if self.values.shape != shape or self.errors.shape != shape:
+            raise ValueError( "Values and errors need shape %r, got %r and %r." % ( shape, self.values.shape, self.errors.shape ) )
+        # python lists for at()
+        self._lists = None
+
+    @classmethod
+    def fromTH2( cls, h ):
+        ''' Contents and errors (GetBinError) of all cells of a TH2.
+        '''
+        a = ArrayHisto.fromTH1( h )
+        if a.dimension != 2:
+            raise ValueError( "Need a TH2, got %s of class %s." % ( h.GetName(), h.ClassName() ) )
+        xEdges, yEdges = a.edges
+        # ROOT cell order is ( y, x )
+        return cls( xEdges, yEdges, a.sumw.reshape( a.shape ).T, a.errors.reshape( a.shape ).T )
+
+    def bins( self, x, y ):
+        ''' Cell indices as TH2::FindBin, for scalars or arrays.
+        '''
+        return np.searchsorted( self.xEdges, x, side = 'right' ), np.searchsorted( self.yEdges, y, side = 'right' )
+
+    def lookup( self, x, y ):
+        ''' ( value, error ) at x, y. Scalars or arrays of the shape of x and y.
+        '''
+        ix, iy = self.bins( x, y )
+        return self.values[ix, iy], self.errors[ix, iy]
+
+    def cell( self, bin ):
+        ''' ( value, error ) of a global bin number, as GetBinContent( bin ), GetBinError( bin ).
+        '''
+        ix, iy = bin % self.values.shape[0], bin // self.values.shape[0]
+        return self.values[ix, iy], self.errors[ix, iy]
+
+    def __call__( self, x, y, sigma = 0 ):
+        value, error = self.lookup( x, y )
+        return value + sigma*error
+
+    def at( self, x, y, sigma = 0 ):
+        ''' value + sigma*error at scalar x, y as a float. Same cell as lookup, but bisect on lists is much faster than numpy
+            for a single point.
+        '''
+        if self._lists is None:
+            self._lists = ( self.xEdges.tolist(), self.yEdges.tolist(), self.values.tolist(), self.errors.tolist() )
+        xEdges, yEdges, values, errors = self._lists
+        ix, iy = bisect_right( xEdges, x ), bisect_right( yEdges, y )
+        return values[ix][iy] + sigma*errors[ix][iy]
+
+    def variations( self, x, y, sigmas = ( 0, 1, -1 ) ):
+        ''' Array of shape x.shape + ( len(sigmas), ) with value + sigma*error.
+        '''
+        return _variations( *( self.lookup( x, y ) + ( sigmas, ) ) )
+
+    def arrays( self ):
+        return { 'xEdges':self.xEdges, 'yEdges':self.yEdges, 'values':self.values, 'errors':self.errors }
+
+    def transposed( self ):
+        ''' Table with x and y exchanged.
+        '''
+        return LookupTable2D( self.yEdges, self.xEdges, self.values.T, self.errors.T )
+
+    def _onGrid( self, xEdges, yEdges ):
+        ''' values and errors on a finer grid whose edges include those of this table.
+        '''
+        def points( edges ):
+            # one point in every cell: below the first edge, the bin centers, and the last edge (which is in the overflow)
+            return np.concatenate( ( [ edges[0] - 1. ], 0.5*( edges[1:] + edges[:-1] ), [ edges[-1] ] ) )
+        ix = np.searchsorted( self.xEdges, points( xEdges ), side = 'right' )
+        iy = np.searchsorted( self.yEdges, points( yEdges ), side = 'right' )
+        return self.values[np.ix_( ix, iy )], self.errors[np.ix_( ix, iy )]
+
+    @staticmethod
+    def _commonGrid( tables ):
+        xEdges, yEdges = tables[0].xEdges, tables[0].yEdges
+        for t in tables[1:]:
+            xEdges = np.union1d( xEdges, t.xEdges )
+            yEdges = np.union1d( yEdges, t.yEdges )
+        return xEdges, yEdges, [ t._onGrid( xEdges, yEdges ) for t in tables ]
+
+    @staticmethod
+    def multiply( tables ):
+        ''' Product of the tables with uncorrelated errors, in the order of the list (as u_float products).
+        '''
+        if len( tables ) == 1: return tables[0]
+        xEdges, yEdges, grids = LookupTable2D._commonGrid( tables )
+        value, error = grids[0]
+        for v, e in grids[1:]:
+            value, error = value*v, np.sqrt( ( error*v )**2 + ( value*e )**2 )
+        return LookupTable2D( xEdges, yEdges, value, error )
+
+    @staticmethod
+    def combine( weightedTables ):
+        ''' Sum of weight*table for [ ( weight, table ), ... ] with uncorrelated errors (as u_float sums).
+        '''
+        xEdges, yEdges, grids = LookupTable2D._commonGrid( [ t for _, t in weightedTables ] )
+        value, error = None, None
+        for ( weight, _ ), ( v, e ) in zip( weightedTables, grids ):
+            if value is None:
+                value, error = v*weight, e*weight
+            else:
+                value, error = value + v*weight, np.sqrt( error**2 + ( e*weight )**2 )
+        return LookupTable2D( xEdges, yEdges, value, error )
+
+    def __repr__( self ):
+        return "LookupTable2D(%i x %i bins)" % ( len( self.xEdges ) - 1, len( self.yEdges ) - 1 )
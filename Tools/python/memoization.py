@@ -0,0 +1,192 @@
+''' Bounded, thread-safe memoization of function values.
+
+    The cache keeps the maxSize most recently used results. With ttl (seconds) results expire. normalize( *args, **kwargs )
+    maps the arguments to the cache key, e.g. roundArgs( 2 ) or binArgs( ptBins, etaBins ) for scale factors that are
+    constant within bins: the value computed for the first arguments of a key is returned for all arguments with that key.
+    With cacheDir, results of expensive pure functions are also stored in a DirDB and survive the process.
+
+    Usage:
+    @memoized
+    def f( x, y ): ...
+
+    @memoized( maxSize = 10000, normalize = roundArgs( 3 ) )
+    def getSF( pt, eta ): ...
+
+    getSF.stats()   # {'hits':..., 'misses':..., 'evictions':..., ...}
+    getSF.clear()
+'''
+
+# Standard imports
+import time
+import bisect
+import threading
+import functools
+from collections import OrderedDict
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+default_maxSize = 2**16
+
+def _hashable( value ):
+    ''' Hashable version of arguments with lists, dicts and sets. Converted containers are tagged with their type, so
+        that f( [1, 2] ) and f( (1, 2) ), or f( {'a':1} ) and f( [('a', 1)] ), don't share a key.
+    '''
+    if isinstance( value, dict ):
+        return ( 'dict', tuple( sorted( ( k, _hashable( v ) ) for k, v in value.items() ) ) )
+    if isinstance( value, list ):
+        return ( 'list', tuple( _hashable( v ) for v in value ) )
+    if isinstance( value, set ):
+        return ( 'set', frozenset( value ) )
+    if isinstance( value, tuple ):
+        return tuple( _hashable( v ) for v in value )
+    return value
+
+def roundArgs( digits ):
+    ''' Normalization rounding all float arguments to the given number of digits.
+    '''
+    def _round( value ):
+        return round( value, digits ) if isinstance( value, float ) else value
+    def normalize( *args, **kwargs ):
+        return tuple( _round( a ) for a in args ), { k:_round( v ) for k, v in kwargs.items() }
+    return normalize
+
+def binArgs( *edges ):
+    ''' Normalization replacing the positional arguments by the index of their bin in edges ( one list of bin edges
+        per argument, None for arguments that are kept ).
+    '''
+    def normalize( *args, **kwargs ):
+        return tuple( a if e is None else bisect.bisect_right( e, a ) for a, e in zip( args, edges ) ) + args[len(edges):], kwargs
+    return normalize
+
+class MemoizedFunction(object):
+    def __init__( self, func, maxSize = default_maxSize, ttl = None, normalize = None, cacheDir = None ):
+        '''
+        maxSize:   number of results kept, least recently used ones are dropped. None for no limit.
+        ttl:       seconds after which a result is computed again. None for no expiry.
+        normalize: function( *args, **kwargs ) returning ( args, kwargs ) used as cache key
+        cacheDir:  directory of a DirDB storing the results on disk. Only for pure functions of plain arguments!
+        '''
+        self.func      = func
+        self.maxSize   = maxSize
+        self.ttl       = ttl
+        self.normalize = normalize
+        self.name      = "%s.%s" % ( getattr( func, '__module__', None ), getattr( func, '__name__', repr(func) ) )
+        functools.update_wrapper( self, func )
+
+        self._cache    = OrderedDict()
+        self._lock     = threading.RLock()
+        self._stats    = { 'hits':0, 'misses':0, 'evictions':0, 'expired':0, 'uncacheable':0, 'diskHits':0 }
+
+        if cacheDir:
+            from Analysis.Tools.DirDB import DirDB
+            self.disk = DirDB( cacheDir )
+        else:
+            self.disk = None
+
+    def _key( self, args, kwargs ):
+        if self.normalize is not None:
+            args, kwargs = self.normalize( *args, **kwargs )
+        key = ( args, tuple( sorted( kwargs.items() ) ) ) if kwargs else args
+        try:
+            hash( key )
+        except TypeError:
+            # lists, dicts
+            key = _hashable( key )
+            hash( key )
+        return key
+
+    def _diskKey( self, key ):
+        return ( 'memoized', self.name, key )
+
+    def __call__( self, *args, **kwargs ):
+        try:
+            key = self._key( args, kwargs )
+        except TypeError:
+            with self._lock:
+                if self._stats['uncacheable'] == 0:
+                    logger.debug( "Arguments of %s can't be hashed, not caching: %r %r", self.name, args, kwargs )
+                self._stats['uncacheable'] += 1
+            return self.func( *args, **kwargs )
+
+        with self._lock:
+            if key in self._cache:
+                value, timestamp = self._cache.pop( key )
+                if self.ttl is None or time.time() - timestamp < self.ttl:
+                    # most recently used at the end
+                    self._cache[key] = ( value, timestamp )
+                    self._stats['hits'] += 1
+                    return value
+                self._stats['expired'] += 1
+            self._stats['misses'] += 1
+
+        # computed outside of the lock: other threads are not blocked (and may compute the same value)
+        value = self._fromDisk( key )
+        if value is None:
+            value = self.func( *args, **kwargs )
+            self._toDisk( key, value )
+
+        with self._lock:
+            self._cache.pop( key, None )
+            self._cache[key] = ( value, time.time() )
+            while self.maxSize is not None and len( self._cache ) > self.maxSize:
+                self._cache.popitem( last = False )
+                self._stats['evictions'] += 1
+        return value
+
+    def _fromDisk( self, key ):
+        if self.disk is None: return None
+        try:
+            value = self.disk.get( self._diskKey( key ) )
+        except TypeError:
+            # no stable hash of the arguments
+            return None
+        if value is not None:
+            with self._lock:
+                self._stats['diskHits'] += 1
+        return value
+
+    def _toDisk( self, key, value ):
+        if self.disk is None or value is None: return
+        try:
+            self.disk.add( self._diskKey( key ), value, overwrite = True )
+        except TypeError:
+            pass
+
+    def stats( self ):
+        ''' Counts of hits, misses, evictions, expired entries, uncacheable calls and results read from disk, and the size.
+        '''
+        with self._lock:
+            stats = dict( self._stats )
+            stats['size'] = len( self._cache )
+        calls = stats['hits'] + stats['misses']
+        stats['hitRate'] = float( stats['hits'] )/calls if calls>0 else 0.
+        return stats
+
+    def clear( self ):
+        ''' Forget all results in memory (not those on disk) and reset the statistics.
+        '''
+        with self._lock:
+            self._cache.clear()
+            for k in self._stats:
+                self._stats[k] = 0
+
+    def __repr__( self ):
+        '''Return the function's docstring.'''
+        return self.func.__doc__
+
+    def __get__( self, obj, objtype ):
+        '''Support instance methods.'''
+        if obj is None:
+            return self
+        return functools.partial( self.__call__, obj )
+
+def memoized( func = None, maxSize = default_maxSize, ttl = None, normalize = None, cacheDir = None ):
+    ''' Decorator, used as @memoized or @memoized( maxSize = ..., ttl = ..., normalize = ..., cacheDir = ... ).
+    '''
+    if func is not None:
+        return MemoizedFunction( func, maxSize = maxSize, ttl = ttl, normalize = normalize, cacheDir = cacheDir )
+    def decorator( func ):
+        return MemoizedFunction( func, maxSize = maxSize, ttl = ttl, normalize = normalize, cacheDir = cacheDir )
+    return decorator
@@ -0,0 +1,236 @@
+''' Opt-in hierarchical profiling. Counts calls and total, min, max and percentiles of the wall time per named section.
+    Sections opened inside other sections are reported under them ('outer/inner'). When disabled, the decorators and
+    context managers only check a flag.
+
+    Enable with the environment variable ANALYSIS_PROFILE=1 or by calling enable(). A report is logged at exit. With
+    ANALYSIS_PROFILE_JSON=<file> (or enable( jsonFile = <file> )) it is also written as JSON.
+    ANALYSIS_PROFILE_TARGETS=module:function,module:Class.method,... instruments functions and methods without editing
+    the code, e.g. ANALYSIS_PROFILE_TARGETS=Analysis.Tools.LeptonSF_UL:LeptonSF.getSF . The targets are instrumented when the
+    first section is entered (profiling is imported by helpers, which the targets may import themselves), or right away
+    by calling enable( targets = [...] ) from the script.
+
+    Usage:
+    @profiled
+    def f(): ...
+    with section( "loop" ): ...
+    sequence = profileSequence( sequence )   # one section per sequence step
+'''
+
+# Standard imports
+import os
+import sys
+import json
+import random
+import atexit
+import socket
+import importlib
+import threading
+import functools
+from timeit import default_timer as _timer
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+enabled   = False
+json_file = None
+
+# number of durations kept per section for the percentiles (reservoir sample)
+max_samples = 1000
+
+# 'outer/inner' -> { 'calls', 'seconds', 'min_seconds', 'max_seconds', 'samples' }
+sections = {}
+
+_lock       = threading.Lock()
+_local      = threading.local()
+_registered = False
+
+# targets from ANALYSIS_PROFILE_TARGETS, instrumented in the first section
+_pending    = []
+
+def _instrumentPending():
+    targets = list( _pending )
+    del _pending[:]
+    for target in targets:
+        try:
+            instrument( target )
+        except ( ImportError, AttributeError, KeyError, ValueError ) as e:
+            logger.error( "Could not profile %s: %r", target, e )
+
+def enable( jsonFile = None, targets = None, defer = False ):
+    ''' Start profiling. The report is logged at exit and written to jsonFile, if given.
+        targets: list of 'module:function' or 'module:Class.method' to instrument
+        defer:   instrument the targets when the first section is entered instead of now
+    '''
+    global enabled, json_file, _registered
+    enabled = True
+    if jsonFile is not None:
+        json_file = jsonFile
+    _pending.extend( targets or [] )
+    if not defer:
+        _instrumentPending()
+    if not _registered:
+        atexit.register( report )
+        _registered = True
+
+def disable():
+    global enabled
+    enabled = False
+
+def reset():
+    with _lock:
+        sections.clear()
+
+def _stack():
+    stack = getattr( _local, 'stack', None )
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+def record( path, seconds ):
+    with _lock:
+        s = sections.get( path )
+        if s is None:
+            s = sections[path] = { 'calls':0, 'seconds':0., 'min_seconds':seconds, 'max_seconds':seconds, 'samples':[] }
+        s['calls']       += 1
+        s['seconds']     += seconds
+        s['min_seconds']  = min( s['min_seconds'], seconds )
+        s['max_seconds']  = max( s['max_seconds'], seconds )
+        if len( s['samples'] ) < max_samples:
+            s['samples'].append( seconds )
+        else:
+            i = random.randint( 0, s['calls'] - 1 )
+            if i < max_samples:
+                s['samples'][i] = seconds
+
+class section(object):
+    ''' Context manager timing the enclosed block as a section within the currently open ones.
+    '''
+    __slots__ = [ 'name', 'path', 'start' ]
+
+    def __init__( self, name ):
+        self.name = name
+        self.path = None
+
+    def __enter__( self ):
+        if enabled:
+            if _pending: _instrumentPending()
+            stack = _stack()
+            stack.append( self.name )
+            self.path  = '/'.join( stack )
+            self.start = _timer()
+        return self
+
+    def __exit__( self, *exc ):
+        if self.path is not None:
+            seconds = _timer() - self.start
+            _stack().pop()
+            record( self.path, seconds )
+            self.path = None
+        return False
+
+def profiled( func = None, name = None ):
+    ''' Decorator, used as @profiled or @profiled( name = "section name" ). The default name is the function name.
+    '''
+    def decorator( func ):
+        _name = name or getattr( func, '__name__', repr(func) )
+        # e.g. functools.partial has no __name__
+        @functools.wraps( func, assigned = [ a for a in functools.WRAPPER_ASSIGNMENTS if hasattr( func, a ) ], updated = [ a for a in functools.WRAPPER_UPDATES if hasattr( func, a ) ] )
+        def wrapper( *args, **kwargs ):
+            if not enabled:
+                return func( *args, **kwargs )
+            with section( _name ):
+                return func( *args, **kwargs )
+        return wrapper
+    if func is not None:
+        return decorator( func )
+    return decorator
+
+def profileSequence( sequence, prefix = "sequence" ):
+    ''' Sequence with every step in its own section prefix/step. Chunk versions (vectorizedSequence) are profiled as well.
+        Returns the sequence unchanged when profiling is disabled.
+    '''
+    if not enabled: return sequence
+    steps = []
+    for step in sequence:
+        name    = getattr( step, '__name__', None ) or getattr( getattr( step, 'func', None ), '__name__', None ) or repr(step)
+        wrapped = profiled( step, name = "%s:%s" % ( prefix, name ) )
+        if hasattr( step, 'vectorized' ):
+            wrapped.vectorized = profiled( step.vectorized, name = "%s:%s" % ( prefix, getattr( step.vectorized, '__name__', name ) ) )
+        steps.append( wrapped )
+    return steps
+
+def instrument( target ):
+    ''' Replace 'module:function' or 'module:Class.method' by its profiled version. Only code that looks it up after
+        this call is affected (not 'from module import function' done before).
+    '''
+    module_name, _, attribute = target.partition( ':' )
+    obj   = importlib.import_module( module_name )
+    names = attribute.split( '.' )
+    for n in names[:-1]:
+        obj = getattr( obj, n )
+    name = names[-1]
+    raw  = obj.__dict__[name] if isinstance( obj.__dict__.get( name ), ( staticmethod, classmethod ) ) else getattr( obj, name )
+    if isinstance( raw, staticmethod ):
+        setattr( obj, name, staticmethod( profiled( raw.__func__, name = attribute ) ) )
+    elif isinstance( raw, classmethod ):
+        setattr( obj, name, classmethod( profiled( raw.__func__, name = attribute ) ) )
+    else:
+        # unbound methods in python2
+        setattr( obj, name, profiled( getattr( raw, '__func__', raw ), name = attribute ) )
+    logger.debug( "Profiling %s", target )
+
+def _percentile( samples, fraction ):
+    if len( samples ) == 0: return 0.
+    return samples[ min( len(samples) - 1, int( fraction*len(samples) ) ) ]
+
+def as_dict():
+    with _lock:
+        result = []
+        for path, s in sorted( sections.items() ):
+            samples = sorted( s['samples'] )
+            result.append( {
+                'section':     path,
+                'calls':       s['calls'],
+                'seconds':     s['seconds'],
+                'min_seconds': s['min_seconds'],
+                'max_seconds': s['max_seconds'],
+                'p50_seconds': _percentile( samples, 0.5 ),
+                'p90_seconds': _percentile( samples, 0.9 ),
+                'p99_seconds': _percentile( samples, 0.99 ),
+                } )
+    return {
+        'host':     socket.gethostname(),
+        'pid':      os.getpid(),
+        'argv':     sys.argv,
+        'sections': result,
+        }
+
+def report():
+    ''' Log the report and write the JSON file.
+    '''
+    if _pending:
+        logger.warning( "Profiling targets %s were not instrumented, no section was entered.", ", ".join( _pending ) )
+    if len(sections)==0: return
+    d = as_dict()
+    totals = { s['section']:s['seconds'] for s in d['sections'] }
+    logger.info( "Profile:" )
+    logger.info( "%-50s %9s %10s %7s %10s %10s %10s %10s %10s", "section", "calls", "total [s]", "parent", "mean [ms]", "min [ms]", "p50 [ms]", "p99 [ms]", "max [ms]" )
+    for s in d['sections']:
+        depth  = s['section'].count( '/' )
+        parent = totals.get( s['section'].rsplit( '/', 1 )[0] ) if depth>0 else None
+        logger.info( "%-50s %9i %10.3f %7s %10.3f %10.3f %10.3f %10.3f %10.3f",
+            "  "*depth + s['section'].split( '/' )[-1], s['calls'], s['seconds'],
+            "%5.1f%%" % ( 100.*s['seconds']/parent ) if parent else "",
+            1000.*s['seconds']/s['calls'], 1000.*s['min_seconds'], 1000.*s['p50_seconds'], 1000.*s['p99_seconds'], 1000.*s['max_seconds'] )
+    if json_file is not None:
+        try:
+            with open( json_file, 'w' ) as _f:
+                json.dump( d, _f, indent = 1 )
+            logger.info( "Wrote profile to %s", json_file )
+        except IOError as e:
+            logger.error( "Could not write profile to %s: %r", json_file, e )
+
+if os.environ.get( 'ANALYSIS_PROFILE', '' ) not in [ '', '0' ] or os.environ.get( 'ANALYSIS_PROFILE_JSON' ):
+    # imported by helpers: the targets may import helpers themselves
+    enable( jsonFile = os.environ.get( 'ANALYSIS_PROFILE_JSON' ), targets = [ t for t in os.environ.get( 'ANALYSIS_PROFILE_TARGETS', '' ).split(',') if t ], defer = True )
@@ -10,6 +10,7 @@ from RootTools.core.standard import *
 
 # Analysis
 from Analysis.Tools.ResultsDB import ResultsDB
+from Analysis.Tools.CachedDB  import CachedDB
 from Analysis.Tools.user      import cache_directory
 
 loggerChoices = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET']
@@ -41,7 +42,7 @@ class puProfile:
         self.draw_string    = "Pileup_nTrueInt"
 
     def initCache(self, cacheDir):
-        self.cache = ResultsDB( os.path.join( cacheDir, 'puProfiles_v2.sql' ), "puProfile", [ "selection", "weight", "source" ] )
+        self.cache = CachedDB( ResultsDB( os.path.join( cacheDir, 'puProfiles_v2.sql' ), "puProfile", [ "selection", "weight", "source" ] ) )
 
     def uniqueKey( self, *arg ):
         '''No dressing required'''
@@ -10,6 +10,7 @@ from RootTools.core.standard import *
 
 # Analysis
 from Analysis.Tools.DirDB import DirDB
+from Analysis.Tools.CachedDB  import CachedDB
 from Analysis.Tools.user      import cache_directory
 
 loggerChoices = ['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET']
@@ -48,7 +49,7 @@ class puProfile:
         self.draw_string    = "Pileup_nTrueInt"
 
     def initCache(self, cacheDir):
-        self.cache = DirDB( os.path.join( cacheDir, 'puProfilesDirDBCache' ))
+        self.cache = CachedDB( DirDB( os.path.join( cacheDir, 'puProfilesDirDBCache' )) )
 
     def uniqueKey( self, *arg ):
         '''No dressing required'''
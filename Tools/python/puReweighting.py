@@ -2,9 +2,11 @@
 '''
 #Standard imports
 import ROOT, os
+import numpy as np
 
 # helpers
-from Analysis.Tools.helpers import getObjFromFile
+import Analysis.Tools.binnedCorrections as binnedCorrections
+from Analysis.Tools.lookupTable import LookupTable1D
 
 # Logging
 import logging
@@ -24,35 +26,52 @@ def extendHistoTo(h, hc):
         res.SetBinContent( i, h.GetBinContent(i) )
     return res
 
+def extendTableTo(table, reference):
+    ''' extendHistoTo for LookupTable1D
+    '''
+    logger.info( "Extend table to nbins of reference" )
+    nBins, nBinsRef = len(table.edges)-1, len(reference.edges)-1
+    assert  reference.edges[0] == table.edges[0] \
+            and nBinsRef        == reference.edges[-1] - reference.edges[0] \
+            and nBins           == table.edges[-1]     - table.edges[0], \
+            "Error extending histogram! Check axis ranges!"
+    values = np.zeros( nBinsRef+2 )
+    n = min( nBinsRef, nBins )
+    values[:n] = table.values[:n]
+    return LookupTable1D( reference.edges, values )
+
+def normalized(table):
+    ''' Contents scaled by 1/Integral (as TH1::Scale( 1./TH1::Integral() ))
+    '''
+    return table.values*(1./sum( table.values[1:-1].tolist() ))
+
 #Define a functor that returns a reweighting-function according to the era
 def getReweightingFunction( data="PU_2100_XSecCentral", mc="Spring15" ):
 
     # Data
     fileNameData = puDataPath + "%s.root" % data
 
-    histoData = getObjFromFile( fileNameData, 'pileup' )
-    histoData.Scale( 1./histoData.Integral() )
+    tableData = binnedCorrections.getTable( fileNameData, 'pileup' )
     logger.info( "Loaded 'pileup' from data file %s", fileNameData )
 
     if isinstance( mc, basestring ):
         if mc=='Summer16':
-            mcProfile = extendHistoTo( getObjFromFile( os.path.expandvars( puDataPath + "MCProfile_Summer16.root" ), 'pileup' ), histoData )
+            mcProfile = extendTableTo( binnedCorrections.getTable( puDataPath + "MCProfile_Summer16.root", 'pileup' ), tableData )
         elif mc=='Autumn18':
-            mcProfile = extendHistoTo( getObjFromFile( os.path.expandvars( puDataPath + "MCProfile_Autumn18.root" ), 'pileup' ), histoData )
+            mcProfile = extendTableTo( binnedCorrections.getTable( puDataPath + "MCProfile_Autumn18.root", 'pileup' ), tableData )
         else:
             raise ValueError( "Don't know about MC PU profile %s" %mc )
     else:
-        mcProfile = extendHistoTo( mc, histoData )
-
-    mcProfile.Scale( 1./mcProfile.Integral() )
+        mcProfile = extendTableTo( LookupTable1D.fromTH1( mc ), tableData )
 
-    # Create reweighting histo
-    reweightingHisto = histoData.Clone( '_'.join( [ 'reweightingHisto', data ] ) )
-    reweightingHisto.Divide(mcProfile)
+    # Create reweighting table, 0 where the MC profile is empty (as TH1::Divide)
+    dataValues, mcValues = normalized( tableData ), normalized( mcProfile )
+    nonZero     = mcValues != 0
+    reweighting = LookupTable1D( tableData.edges, np.where( nonZero, dataValues/np.where( nonZero, mcValues, 1. ), 0. ) )
 
-    # Define reweightingFunc
+    # Define reweightingFunc, for numbers or arrays
     def reweightingFunc( nvtx ):
-        return reweightingHisto.GetBinContent( reweightingHisto.FindBin(nvtx) )
+        return reweighting( nvtx )
 
     return reweightingFunc
 
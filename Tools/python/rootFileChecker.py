@@ -0,0 +1,243 @@
+''' Validation of many ROOT files in parallel.
+
+    Each worker of the pool imports ROOT once and checks files in sequence. A file whose worker crashes fails right away.
+    Results of local files are stored in a
+    DirDB, keyed by path, size, modification time and the checks, so unchanged files are never checked twice.
+
+    Checks:
+    zombie:    file can be opened and is not a zombie
+    recovered: the keys didn't have to be recovered (file not closed properly)
+    tree:      the tree (treeName) is in the file
+    map:       TFile.Map() lists all keys without basket errors (replaces helpers.deepCheckRootFile)
+    weight:    the sum of the weight branch is not NaN (replaces helpers.deepCheckWeight)
+
+    Usage:
+    checker = RootFileChecker( checks = ['zombie', 'recovered', 'tree'], treeName = 'Events', nWorkers = 8 )
+    good    = checker.check( files )  # { filename:True/False }, reasons in checker.reasons
+    # with the 'tree' check the number of entries of the tree is in checker.entries ( -1 if unknown )
+    good, reason, entries = checkFileIsolated( filename, checks = ['map'] )  # one file, in a worker process
+'''
+
+# Standard imports
+import os
+import time
+import tempfile
+import multiprocessing
+from math import isnan
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+available_checks = [ 'zombie', 'recovered', 'tree', 'map', 'weight' ]
+# same as helpers.checkRootFile( f, checkForObjects = [treeName] )
+default_checks   = [ 'zombie', 'recovered', 'tree' ]
+
+# nWorkers = None: check fewer files than this in this process (starting the pool costs more), otherwise use auto_workers
+parallel_min_files = 20
+auto_workers       = 4
+
+# seconds between the checks whether the worker of a file is still alive
+poll_interval = 1.
+
+def _map( rf ):
+    ''' Output of TFile.Map(). It is printed by ROOT, hence redirected to a file.
+    '''
+    import ROOT
+    fd, tmp = tempfile.mkstemp( prefix = 'map_', suffix = '.txt' )
+    os.close( fd )
+    try:
+        ROOT.gSystem.RedirectOutput( tmp, "w" )
+        try:
+            rf.Map()
+        finally:
+            ROOT.gSystem.RedirectOutput( 0 )
+        with open( tmp ) as _f:
+            return _f.read()
+    finally:
+        os.remove( tmp )
+
+def checkFile( filename, checks = default_checks, treeName = 'Events', weight = 'weight' ):
+    ''' Run the checks on one file in this process. Returns ( good, reason, entries ), entries is -1 without the 'tree' check.
+    '''
+    import ROOT
+    for check in checks:
+        if check not in available_checks:
+            raise ValueError( "Unknown check %s. Use one of %s." % ( check, ", ".join( available_checks ) ) )
+
+    rf = ROOT.TFile.Open( filename )
+    if not rf:
+        return False, "could not open", -1
+    entries = -1
+    try:
+        if 'zombie' in checks and rf.IsZombie():
+            return False, "zombie", entries
+        if 'recovered' in checks and rf.TestBit( ROOT.TFile.kRecovered ):
+            return False, "recovered", entries
+        if 'tree' in checks:
+            if not rf.GetListOfKeys().Contains( treeName ):
+                return False, "no object %s" % treeName, entries
+            tree = rf.Get( treeName )
+            if hasattr( tree, 'GetEntries' ):
+                entries = int( tree.GetEntries() )
+        if 'map' in checks and "KeysList" not in _map( rf ):
+            return False, "basket map", entries
+        if 'weight' in checks:
+            tree = rf.Get( treeName )
+            if not tree or not tree.GetBranch( weight ):
+                return False, "no branch %s" % weight, entries
+            # TTree::Project fills the histogram of that name in gDirectory
+            rf.cd()
+            h = ROOT.TH1D( "h_weight", "", 1, 0, 1 )
+            tree.Project( "h_weight", "0.5", weight )
+            if isnan( h.GetBinContent( 1 ) ):
+                return False, "%s is NaN" % weight, entries
+        return True, "", entries
+    except Exception as e:
+        return False, repr( e ), entries
+    finally:
+        rf.Close()
+
+def _checkFile( args ):
+    # pool worker
+    filename, checks, treeName, weight = args
+    return filename, checkFile( filename, checks = checks, treeName = treeName, weight = weight )
+
+# pool worker: pid of the worker that started the i-th file, in shared memory
+_started = None
+
+def _checkFileInWorker( i, args ):
+    _started[i] = os.getpid()
+    return _checkFile( args )
+
+def _initWorker( started = None ):
+    global _started
+    _started = started
+    # import ROOT once per worker
+    import ROOT
+    ROOT.gROOT.SetBatch( True )
+
+def _alive( pid ):
+    # the pool reaps its exited workers
+    try:
+        os.kill( pid, 0 )
+    except OSError:
+        return False
+    return True
+
+def _stat( filename ):
+    ''' ( size, mtime ) of local files, None for remote ones.
+    '''
+    if '://' in filename: return None
+    try:
+        s = os.stat( filename )
+    except OSError:
+        return None
+    return s.st_size, s.st_mtime
+
+class RootFileChecker:
+    def __init__( self, checks = default_checks, treeName = 'Events', weight = 'weight', nWorkers = 4, cacheDir = None, timeout = 600, isolate = False ):
+        '''
+        checks:   list of checks, see available_checks
+        nWorkers: size of the worker pool, <=1 checks in this process, None: in this process for less than
+                  parallel_min_files files, otherwise auto_workers
+        cacheDir: directory of the result cache, None for <cache_directory>/rootFileChecks, False for no cache
+        timeout:  seconds to wait for a single file. Files of crashed workers fail right away.
+        isolate:  always check in worker processes, also with nWorkers<=1 or a single file. Errors of corrupt files
+                  (e.g. basket errors in TFile.Map()) can't be caught in python and would end this process.
+        '''
+        for check in checks:
+            if check not in available_checks:
+                raise ValueError( "Unknown check %s. Use one of %s." % ( check, ", ".join( available_checks ) ) )
+        self.checks   = list( checks )
+        self.treeName = treeName
+        self.weight   = weight
+        self.nWorkers = nWorkers
+        self.timeout  = timeout
+        self.isolate  = isolate
+        self.reasons  = {}
+        self.entries  = {}
+
+        if cacheDir is None:
+            try:
+                from Analysis.Tools.user import cache_directory
+                cacheDir = os.path.join( cache_directory, 'rootFileChecks' )
+            except (ImportError, KeyError, OSError) as e:
+                logger.warning( "No cache for ROOT file checks: %r", e )
+                cacheDir = False
+        if cacheDir:
+            from Analysis.Tools.DirDB import DirDB
+            self.cache = DirDB( cacheDir )
+        else:
+            self.cache = None
+
+    def _key( self, filename, stat ):
+        return ( os.path.abspath( filename ), stat[0], stat[1], tuple( self.checks ), self.treeName, self.weight if 'weight' in self.checks else None )
+
+    def check( self, files ):
+        ''' Check the files. Returns { filename:True/False }. The reasons of failed files are in self.reasons.
+        '''
+        result = {}
+        todo   = []
+        keys   = {}
+        for filename in files:
+            stat = _stat( filename )
+            if self.cache is not None and stat is not None:
+                keys[filename] = self._key( filename, stat )
+                cached = self.cache.get( keys[filename] )
+                if cached is not None:
+                    result[filename], self.reasons[filename], self.entries[filename] = cached
+                    continue
+            todo.append( filename )
+
+        logger.info( "Checking %i files (%i from cache) with %s.", len(todo), len(files) - len(todo), ", ".join( self.checks ) )
+        for filename, ( good, reason, entries ) in self._run( todo ):
+            result[filename], self.reasons[filename], self.entries[filename] = good, reason, entries
+            if not good:
+                logger.warning( "File %s looks broken: %s", filename, reason )
+            # timeouts may be transient, don't remember them
+            if filename in keys and reason != "timeout":
+                self.cache.add( keys[filename], ( good, reason, entries ), overwrite = True )
+        return result
+
+    def _run( self, files ):
+        args = [ ( f, self.checks, self.treeName, self.weight ) for f in files ]
+        if not files: return
+        nWorkers = self.nWorkers
+        if nWorkers is None:
+            nWorkers = auto_workers if len(files) >= parallel_min_files else 1
+        if not self.isolate and ( nWorkers <= 1 or len(files) <= 1 ):
+            for a in args:
+                yield _checkFile( a )
+            return
+        started = multiprocessing.Array( 'i', len(files), lock = False )
+        pool = multiprocessing.Pool( processes = max( 1, min( nWorkers, len(files) ) ), initializer = _initWorker, initargs = ( started, ) )
+        try:
+            results = [ ( a[0], pool.apply_async( _checkFileInWorker, ( i, a ) ) ) for i, a in enumerate( args ) ]
+            for i, ( filename, r ) in enumerate( results ):
+                # a crashed worker never returns the result: check the worker between short waits
+                deadline = time.time() + self.timeout
+                while not r.ready():
+                    if started[i] and not _alive( started[i] ):
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        break
+                    r.wait( min( poll_interval, remaining ) )
+                if r.ready():
+                    yield r.get()
+                elif time.time() < deadline:
+                    yield filename, ( False, "worker crashed", -1 )
+                else:
+                    yield filename, ( False, "timeout", -1 )
+        finally:
+            pool.terminate()
+            pool.join()
+
+def checkFileIsolated( filename, checks = default_checks, treeName = 'Events', weight = 'weight', timeout = 600 ):
+    ''' checkFile in a worker process (no cache), a crash or timeout of the worker fails the file.
+        Returns ( good, reason, entries ).
+    '''
+    checker = RootFileChecker( checks = checks, treeName = treeName, weight = weight, nWorkers = 1, cacheDir = False, timeout = timeout, isolate = True )
+    good = checker.check( [ filename ] )[filename]
+    return good, checker.reasons[filename], checker.entries[filename]
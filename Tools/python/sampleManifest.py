@@ -0,0 +1,125 @@
+''' Cached listing of the ROOT files of sample directories.
+
+    The manifest of a directory holds its .root files with size, modification time, number of entries and validation status.
+    It is stored in a DirDB. The directory is listed again when its modification time changes (files added, removed or renamed).
+    Files are only checked when they are used: if they are new, or their size or modification time changed (e.g. they were
+    still being copied when they were checked).
+
+    Usage:
+    manifest = SampleManifest( treeName = 'Events' )
+    for filename, entries, good in manifest.files( directory ): ...
+    chain    = manifest.chain( [directory1, directory2] )   # TChain without opening the files
+'''
+
+# Standard imports
+import os
+
+from Analysis.Tools.rootFileChecker import RootFileChecker, default_checks
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+class SampleManifest:
+    def __init__( self, treeName = 'Events', checks = default_checks, nWorkers = None, cacheDir = None ):
+        '''
+        checks:   validation of the files, see rootFileChecker
+        nWorkers: pool size of the RootFileChecker, None: in this process for few files
+        cacheDir: directory of the manifests, None for <cache_directory>/sampleManifests, False for no cache
+        '''
+        self.treeName = treeName
+        self.checks   = list( checks )
+
+        if cacheDir is None:
+            try:
+                from Analysis.Tools.user import cache_directory
+                cacheDir = cache_directory
+            except (ImportError, KeyError, OSError) as e:
+                logger.warning( "No cache for sample manifests: %r", e )
+                cacheDir = False
+        if cacheDir:
+            from Analysis.Tools.DirDB import DirDB
+            self.cache = DirDB( os.path.join( cacheDir, 'sampleManifests' ) )
+        else:
+            self.cache = None
+        self.checker  = RootFileChecker( checks = self.checks, treeName = treeName, nWorkers = nWorkers, cacheDir = os.path.join( cacheDir, 'rootFileChecks' ) if cacheDir else False )
+
+    def _key( self, directory ):
+        return ( 'manifest', os.path.abspath( os.path.expanduser( directory ) ), self.treeName, tuple( self.checks ) )
+
+    def _listing( self, directory ):
+        ''' ( manifest, True ) from the cache if the directory didn't change, otherwise ( new listing, False ). Files that
+            are still there keep their size, mtime and status, new files are not checked yet (status None).
+        '''
+        path  = os.path.expanduser( directory )
+        mtime = os.stat( path ).st_mtime
+        cached = self.cache.get( self._key( directory ) ) if self.cache is not None else None
+        # manifests of earlier versions have no file mtimes
+        if cached is not None and not all( len( r ) == 5 for r in cached['files'] ):
+            cached = None
+        if cached is not None and cached['mtime'] == mtime:
+            return cached, True
+        logger.debug( "Listing %s", directory )
+        previous = { r[0]:r for r in cached['files'] } if cached is not None else {}
+        filenames = [ directory+'/'+f for f in os.listdir( path ) if f.endswith(".root") ]
+        return { 'mtime':mtime, 'files':[ previous.get( f, ( f, None, None, -1, None ) ) for f in filenames ] }, False
+
+    def manifest( self, directory, histname = '', maxN = -1 ):
+        ''' { 'mtime':mtime of the directory, 'files':[ (filename, size, mtime, entries, good), ... ] } in the order of os.listdir.
+            The files containing histname (the first maxN of them) are checked if they are new or their size or
+            modification time changed since they were checked.
+        '''
+        manifest, fromCache = self._listing( directory )
+        selected = [ i for i, r in enumerate( manifest['files'] ) if histname in os.path.basename( r[0] ) ]
+        if maxN>=0:
+            selected = selected[:maxN]
+
+        todo = {}
+        for i in selected:
+            f, size, mtime, entries, good = manifest['files'][i]
+            try:
+                stat = os.stat( os.path.expanduser( f ) )
+            except OSError:
+                stat = None
+            if good is None or stat is None or ( stat.st_size, stat.st_mtime ) != ( size, mtime ):
+                todo[f] = ( i, stat )
+
+        if todo:
+            logger.debug( "Checking %i new or modified files in %s", len( todo ), directory )
+            good = self.checker.check( list( todo.keys() ) )
+            for f, ( i, stat ) in todo.items():
+                manifest['files'][i] = ( f, stat.st_size if stat else None, stat.st_mtime if stat else None, self.checker.entries.get( f, -1 ), good[f] )
+        if ( todo or not fromCache ) and self.cache is not None:
+            self.cache.add( self._key( directory ), manifest, overwrite = True )
+        return manifest
+
+    def files( self, directory, histname = '', maxN = -1, onlyGood = False ):
+        ''' [ (filename, entries, good), ... ] of the files containing histname, like helpers.getFileList.
+            Only the returned files are checked.
+        '''
+        res = [ ( f, entries, good ) for f, size, mtime, entries, good in self.manifest( directory, histname = histname, maxN = maxN )['files'] if histname in os.path.basename( f ) ]
+        if maxN>=0:
+            res = res[:maxN]
+        if onlyGood:
+            res = [ r for r in res if r[2] ]
+        return res
+
+    def chain( self, directories, histname = '', maxN = -1 ):
+        ''' TChain of the good files. Files are added with their number of entries and thus not opened.
+        '''
+        import ROOT
+        c = ROOT.TChain( self.treeName )
+        for directory in ( directories if isinstance( directories, list ) else [ directories ] ):
+            for f, entries, good in self.files( directory, histname = histname, maxN = maxN ):
+                if not good:
+                    logger.warning( "File %s looks broken: %s", f, self.checker.reasons.get( f, "cached" ) )
+                    continue
+                if entries > 0:
+                    c.Add( f, entries )
+                else:
+                    c.Add( f )
+        return c
+
+    def invalidate( self, directory ):
+        if self.cache is not None:
+            self.cache.add( self._key( directory ), None, overwrite = True )
@@ -0,0 +1,207 @@
+''' Serialization of the values stored in DirDB, MergingDirDB, ShardedDirDB and ResultsDB.
+
+    dumps( obj ) pickles with the highest protocol, compresses, and prefixes a header with the codec.
+    loads( blob ) auto-detects the format: blobs without the header are plain (legacy) pickles.
+    Histograms (TH1 and TH2) are stored as arrays of bin edges, contents and squared errors instead of pickled ROOT objects,
+    together with their statistics, axis titles and draw attributes.
+    Available codecs: 'none', 'zlib', and 'lz4' and 'zstd' if the python modules are installed.
+'''
+
+# Standard imports
+import zlib
+import cPickle
+from array import array
+
+try:
+    import lz4.frame as lz4
+except ImportError:
+    lz4 = None
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+magic   = b'ADB'
+version = b'\x01'
+
+default_compression = 'zlib'
+
+_codec_ids = { 'none':b'n', 'zlib':b'z', 'lz4':b'4', 'zstd':b's' }
+_codecs    = { v:k for k, v in _codec_ids.items() }
+
+def _compress( data, compression ):
+    if compression == 'none':
+        return data
+    if compression == 'zlib':
+        return zlib.compress( data, 6 )
+    if compression == 'lz4':
+        if lz4 is None: raise ImportError( "Compression 'lz4' requires the lz4 module." )
+        return lz4.compress( data )
+    if compression == 'zstd':
+        if zstd is None: raise ImportError( "Compression 'zstd' requires the zstandard module." )
+        return zstd.ZstdCompressor().compress( data )
+    raise ValueError( "Unknown compression %r. Use one of %s." % ( compression, ", ".join( _codec_ids.keys() ) ) )
+
+def _decompress( data, compression ):
+    if compression == 'none':
+        return data
+    if compression == 'zlib':
+        return zlib.decompress( data )
+    if compression == 'lz4':
+        if lz4 is None: raise ImportError( "Reading 'lz4' compressed data requires the lz4 module." )
+        return lz4.decompress( data )
+    if compression == 'zstd':
+        if zstd is None: raise ImportError( "Reading 'zstd' compressed data requires the zstandard module." )
+        return zstd.ZstdDecompressor().decompress( data )
+
+# TH1::kNstat
+_nStat = 13
+# draw attributes restored with Set<name>( Get<name>() )
+_styleAttributes = [ 'LineColor', 'LineStyle', 'LineWidth', 'MarkerColor', 'MarkerStyle', 'MarkerSize', 'FillColor', 'FillStyle', 'Option' ]
+
+class EncodedHisto(object):
+    ''' Array representation of a TH1 or TH2. Unpickling it returns the ROOT histogram.
+    '''
+    __slots__ = [ 'cls', 'name', 'title', 'axes', 'contents', 'sumw2', 'entries', 'attributes' ]
+
+    def __init__( self, cls, name, title, axes, contents, sumw2, entries, attributes = None ):
+        self.cls      = cls
+        self.name     = name
+        self.title    = title
+        # per axis either (nbins, min, max) or the array of bin edges
+        self.axes     = axes
+        # all cells, including under- and overflow
+        self.contents = contents
+        self.sumw2    = sumw2
+        self.entries  = entries
+        # statistics (GetStats), axis titles, draw attributes, minimum and maximum
+        self.attributes = attributes
+
+    def __reduce__( self ):
+        return ( to_histo, ( self.cls, self.name, self.title, self.axes, self.contents, self.sumw2, self.entries, self.attributes ) )
+
+def _encode_axis( axis ):
+    if axis.GetXbins().GetSize() > 0:
+        return np.array( [ axis.GetXbins()[i] for i in range( axis.GetXbins().GetSize() ) ], dtype = 'd' )
+    return ( axis.GetNbins(), axis.GetXmin(), axis.GetXmax() )
+
+def from_histo( h ):
+    ''' EncodedHisto of TH1 and TH2, None for everything we can't represent faithfully (TH3, labels, functions).
+    '''
+    if np is None: return None
+    if not h.InheritsFrom('TH1') or h.InheritsFrom('TH3') or h.InheritsFrom('TProfile') or h.InheritsFrom('TH2Poly') or h.InheritsFrom('TProfile2D'):
+        return None
+    if h.GetListOfFunctions().GetSize() > 0: return None
+    axes = [ h.GetXaxis() ] + ( [ h.GetYaxis() ] if h.InheritsFrom('TH2') else [] )
+    if any( axis.GetLabels() for axis in axes ): return None
+
+    n = h.GetNcells()
+    contents = np.array( [ h.GetBinContent(i) for i in range(n) ], dtype = 'd' )
+    sumw2    = np.array( [ h.GetSumw2().At(i) for i in range(n) ], dtype = 'd' ) if h.GetSumw2N() > 0 else None
+
+    import ROOT
+    stats = array( 'd', [0.]*_nStat )
+    h.GetStats( stats )
+    attributes = {
+        'stats':      list( stats ),
+        'axisTitles': [ axis.GetTitle() for axis in axes ],
+        'minimum':    h.GetMinimumStored(),
+        'maximum':    h.GetMaximumStored(),
+        'noStats':    bool( h.TestBit( ROOT.TH1.kNoStats ) ),
+        }
+    for attribute in _styleAttributes:
+        attributes[attribute] = getattr( h, 'Get' + attribute )()
+    return EncodedHisto( h.ClassName(), h.GetName(), h.GetTitle(), [ _encode_axis( axis ) for axis in axes ], contents, sumw2, h.GetEntries(), attributes )
+
+def to_histo( cls, name, title, axes, contents, sumw2, entries, attributes = None ):
+    ''' Build the ROOT histogram from the arrays. Without attributes (data written by earlier versions) the statistics are
+        recomputed from the bin contents.
+    '''
+    import ROOT
+    args = []
+    for axis in axes:
+        if isinstance( axis, tuple ):
+            args.extend( axis )
+        else:
+            args.extend( [ len(axis)-1, axis ] )
+    # don't attach to gDirectory, as unpickled histograms aren't either
+    status = ROOT.TH1.AddDirectoryStatus()
+    ROOT.TH1.AddDirectory( False )
+    try:
+        h = getattr( ROOT, cls )( name, title, *args )
+    finally:
+        ROOT.TH1.AddDirectory( status )
+    h.SetContent( contents )
+    if sumw2 is not None:
+        h.Sumw2()
+        h.GetSumw2().Set( len(sumw2), sumw2 )
+    if attributes is not None:
+        # the exact statistics (e.g. for GetMean, GetRMS), not the ones from the bin centers
+        h.PutStats( array( 'd', attributes['stats'] ) )
+        for axis, axisTitle in zip( [ h.GetXaxis(), h.GetYaxis() ], attributes['axisTitles'] ):
+            axis.SetTitle( axisTitle )
+        if attributes['minimum'] != -1111: h.SetMinimum( attributes['minimum'] )
+        if attributes['maximum'] != -1111: h.SetMaximum( attributes['maximum'] )
+        if attributes['noStats']: h.SetStats( 0 )
+        for attribute in _styleAttributes:
+            getattr( h, 'Set' + attribute )( attributes[attribute] )
+    # last, SetContent changes the number of entries
+    h.SetEntries( entries )
+    return h
+
+def encode( obj ):
+    ''' Replace histograms in (nested) dicts, lists and tuples by their EncodedHisto.
+    '''
+    if type( obj ) == dict:
+        return { k:encode(v) for k, v in obj.items() }
+    if isinstance( obj, list ):
+        return [ encode(v) for v in obj ]
+    if type( obj ) == tuple:
+        return tuple( encode(v) for v in obj )
+    if hasattr( obj, 'InheritsFrom' ):
+        encoded = from_histo( obj )
+        if encoded is not None:
+            return encoded
+    return obj
+
+def dumps( obj, compression = None ):
+    ''' Serialize obj with the header. compression defaults to default_compression.
+    '''
+    if compression is None: compression = default_compression
+    data = _compress( cPickle.dumps( encode( obj ), cPickle.HIGHEST_PROTOCOL ), compression )
+    return magic + version + _codec_ids[compression] + data
+
+def loads( blob ):
+    ''' Deserialize, either with the header or a plain pickle.
+        Truncated data raises ValueError or EOFError like cPickle does.
+    '''
+    if not blob.startswith( magic ):
+        return cPickle.loads( blob )
+    header = len(magic) + len(version)
+    compression = _codecs.get( blob[header:header+1] )
+    if compression is None:
+        raise ValueError( "Unknown codec %r." % blob[header:header+1] )
+    try:
+        data = _decompress( blob[header+1:], compression )
+    except ImportError:
+        raise
+    except Exception as e:
+        # e.g. zlib.error when reading a file that is currently being written
+        raise ValueError( "Could not decompress %s data: %r" % ( compression, e ) )
+    return cPickle.loads( data )
+
+def dump( obj, f, compression = None ):
+    f.write( dumps( obj, compression = compression ) )
+
+def load( f ):
+    return loads( f.read() )
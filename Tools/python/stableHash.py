@@ -0,0 +1,69 @@
+''' Deterministic hashing of cache keys.
+    The builtin hash depends on the interpreter, the platform and (in python3) on the process.
+    stable_hash( key ) is the sha1 digest of a canonical serialization and does not.
+'''
+
+# Standard imports
+import types
+import hashlib
+import numbers
+
+try:
+    _unicode = unicode
+except NameError:
+    _unicode = str
+
+# instances of python2 old-style classes
+_instance = getattr( types, 'InstanceType', () )
+
+def _isNumpyScalar( key ):
+    # without importing numpy
+    return type( key ).__module__ == 'numpy' and hasattr( key, 'item' ) and getattr( key, 'shape', None ) == ()
+
+def _hasDefaultRepr( key ):
+    ''' True if the repr is object.__repr__, which contains the address and differs between processes.
+    '''
+    if isinstance( key, _instance ):
+        return not hasattr( key.__class__, '__repr__' )
+    return type( key ).__repr__ is object.__repr__
+
+def canonical( key ):
+    ''' Canonical serialization of a key made of None, bools, numbers, strings, tuples, lists, dicts and sets.
+        Keys that compare equal (True == 1 == 1.0, 'a' == u'a', {..} in any order) give the same result.
+        numpy scalars are serialized as the python number they hold (np.bool_(True) as True, np.float32(1) as 1).
+        Other hashable objects (which the builtin hash accepted) are serialized by their repr, unless it is the default one.
+    '''
+    if key is None:
+        return b'N'
+    if _isNumpyScalar( key ):
+        key = key.item()
+    if isinstance( key, numbers.Real ) and not isinstance( key, numbers.Integral ) and float( key ).is_integer():
+        key = int( key )
+    if isinstance( key, numbers.Integral ):
+        return b'i' + str( int( key ) ).encode('ascii') + b';'
+    if isinstance( key, numbers.Real ):
+        return b'f' + repr( float( key ) ).encode('ascii') + b';'
+    if isinstance( key, (bytes, _unicode) ):
+        if isinstance( key, _unicode ):
+            key = key.encode('utf-8')
+        return b's' + str( len(key) ).encode('ascii') + b':' + key
+    if isinstance( key, tuple ):
+        return b't(' + b''.join( canonical(k) for k in key ) + b')'
+    if isinstance( key, list ):
+        return b'l(' + b''.join( canonical(k) for k in key ) + b')'
+    if isinstance( key, dict ):
+        return b'd(' + b''.join( sorted( canonical(k) + canonical(v) for k, v in key.items() ) ) + b')'
+    if isinstance( key, (set, frozenset) ):
+        return b'S(' + b''.join( sorted( canonical(k) for k in key ) ) + b')'
+    if getattr( type( key ), '__hash__', None ) is not None and not _hasDefaultRepr( key ):
+        # only as stable as the repr
+        r = repr( key )
+        if isinstance( r, _unicode ):
+            r = r.encode('utf-8')
+        return b'r' + str( len(r) ).encode('ascii') + b':' + r
+    raise TypeError( "Can't make a stable hash of %r of type %s." % ( key, type(key) ) )
+
+def stable_hash( key ):
+    ''' Hex digest of the key that is the same in every process.
+    '''
+    return hashlib.sha1( canonical( key ) ).hexdigest()
@@ -0,0 +1,180 @@
+''' Run sequences on chunks of events instead of event by event.
+
+    An EventChunk holds N consecutive selected events: scalar branches are arrays of length N (chunk.met_pt),
+    vector branches are JaggedCollections (chunk.JetGood, with the counter chunk.nJetGood).
+    A sequence step can provide a chunk version that computes arrays, registered with the vectorized decorator:
+
+    def get_mll( event, sample ):
+        event.mll = sqrt( ... )
+    @vectorized( get_mll )
+    def get_mll_chunk( chunk, sample ):
+        chunk.mll = np.sqrt( ... )
+
+    The per event function is unchanged and still used by the RootTools readers. Steps without a chunk version are
+    called for every event of the chunk with a view that looks like the event (event.JetGood_pt, event.nJetGood, ...)
+    and what they store in the event is collected into arrays of the chunk.
+'''
+
+# Standard imports
+import numbers
+import numpy as np
+
+from Analysis.Tools.JaggedCollection import JaggedCollection, drawArrays
+
+# Logger
+import logging
+logger = logging.getLogger(__name__)
+
+# RootTools type codes. Draw returns doubles, they are converted back.
+_dtypes = { 'F':'f4', 'D':'f8', 'I':'i4', 'i':'u4', 'L':'i8', 'l':'u8', 'O':'?', 'S':'i2', 's':'u2', 'B':'i1', 'b':'u1' }
+
+def vectorized( per_event ):
+    ''' Decorator registering the chunk version of the sequence step per_event.
+    '''
+    def decorator( func ):
+        per_event.vectorized = func
+        return func
+    return decorator
+
+def _scalar( string ):
+    name, _, typ = string.partition('/')
+    return name, _dtypes.get( typ, 'f8' )
+
+def parseVariables( read_variables ):
+    ''' Split RootTools style variable strings into scalars [(name, dtype)] and vectors [(name, [(var, dtype)])].
+        'JetGood[pt/F,eta/F]' is a vector with counter nJetGood.
+    '''
+    scalars, vectors = [], []
+    for var in read_variables:
+        if not isinstance( var, str ):
+            # RootTools TreeVariable
+            if hasattr( var, 'components' ):
+                vectors.append( ( var.name, [ ( c.name, _dtypes.get( getattr( c, 'type', 'F' ), 'f8' ) ) for c in var.components ] ) )
+            else:
+                scalars.append( ( var.name, _dtypes.get( getattr( var, 'type', 'F' ), 'f8' ) ) )
+        elif '[' in var:
+            name, components = var.rstrip(']').split('[', 1)
+            vectors.append( ( name, [ _scalar( c ) for c in components.split(',') ] ) )
+        else:
+            scalars.append( _scalar( var ) )
+    return scalars, vectors
+
+class EventView(object):
+    ''' Event i of a chunk for per event sequence steps. Attributes set on it are kept in self.__dict__ .
+    '''
+    def __init__( self, chunk, i ):
+        self.__dict__['_chunk'] = chunk
+        self.__dict__['_i']     = i
+
+    def __getattr__( self, name ):
+        chunk, i = self.__dict__['_chunk'], self.__dict__['_i']
+        for prefix, collection in chunk.collections.items():
+            if name.startswith( prefix+'_' ):
+                var = name[len(prefix)+1:]
+                if var in collection.arrays:
+                    return collection.arrays[var][collection.offsets[i]:collection.offsets[i+1]]
+        try:
+            value = getattr( chunk, name )
+        except AttributeError:
+            raise AttributeError( "Event has no attribute %s" % name )
+        if isinstance( value, JaggedCollection ):
+            return value[i]
+        if isinstance( value, np.ndarray ) and value.ndim>0 and len(value) == chunk.nEvents:
+            return value[i]
+        return value
+
+def _stack( values ):
+    ''' Numerical array if all values are numbers, otherwise an array of objects.
+    '''
+    if all( isinstance( v, ( numbers.Number, np.number, np.bool_ ) ) for v in values ):
+        return np.array( values )
+    res = np.empty( len(values), dtype = object )
+    for i, v in enumerate( values ):
+        res[i] = v
+    return res
+
+class EventChunk(object):
+    ''' nEvents consecutive selected events. entries are the tree entries.
+    '''
+    def __init__( self, nEvents, entries = None ):
+        self.nEvents     = nEvents
+        self.entries     = entries
+        self.collections = {}
+
+    def addCollection( self, name, collection ):
+        self.collections[name] = collection
+        setattr( self, name, collection )
+        setattr( self, 'n'+name, collection.counts )
+
+    def event( self, i ):
+        return EventView( self, i )
+
+    def __len__( self ):
+        return self.nEvents
+
+def runPerEvent( func, chunk, *args ):
+    ''' Fallback for steps without chunk version: call func for every event and collect what it stored into arrays.
+    '''
+    views = [ chunk.event( i ) for i in range( chunk.nEvents ) ]
+    for view in views:
+        func( view, *args )
+    names = set()
+    for view in views:
+        names.update( k for k in view.__dict__ if not k.startswith('_') )
+    for name in names:
+        setattr( chunk, name, _stack( [ view.__dict__.get( name ) for view in views ] ) )
+
+def evaluate( func, chunk, *args ):
+    ''' Array of func( event, *args ) for all events, or of its chunk version.
+    '''
+    if hasattr( func, 'vectorized' ):
+        return func.vectorized( chunk, *args )
+    return _stack( [ func( chunk.event( i ), *args ) for i in range( chunk.nEvents ) ] )
+
+class VectorizedSequence(object):
+    ''' Run the steps of a sequence on chunks. Steps are called with ( chunk, *args ).
+    '''
+    def __init__( self, sequence ):
+        self.sequence = sequence
+        fallback = [ getattr( step, '__name__', repr(step) ) for step in sequence if not hasattr( step, 'vectorized' ) ]
+        if len(fallback)>0:
+            logger.debug( "Sequence steps without chunk version, running them per event: %s", ", ".join( fallback ) )
+
+    def __call__( self, chunk, *args ):
+        for step in self.sequence:
+            if hasattr( step, 'vectorized' ):
+                step.vectorized( chunk, *args )
+            else:
+                runPerEvent( step, chunk, *args )
+        return chunk
+
+def readChunks( tree, read_variables, chunkSize = 100000, selection = "(1)" ):
+    ''' Yield EventChunks of the selected events in chunks of chunkSize tree entries.
+    '''
+    scalars, vectors = parseVariables( read_variables )
+    nEntries = tree.GetEntries()
+    for firstEntry in range( 0, nEntries, chunkSize ):
+        n = min( chunkSize, nEntries - firstEntry )
+        columns = drawArrays( tree, [ "Entry$" ] + [ name for name, _ in scalars ] + [ "n"+name for name, _ in vectors ], selection, n, firstEntry, n )
+        nSelected = len( columns[0] )
+        if nSelected == 0: continue
+
+        chunk = EventChunk( nSelected, entries = columns[0].astype( 'i8' ) )
+        for ( name, dtype ), column in zip( scalars, columns[1:] ):
+            setattr( chunk, name, column.astype( dtype ) )
+        for ( name, components ), counts in zip( vectors, columns[1+len(scalars):] ):
+            counts   = counts.astype( 'i8' )
+            contents = drawArrays( tree, [ name+'_'+var for var, _ in components ], selection, int( counts.sum() ), firstEntry, n )
+            chunk.addCollection( name, JaggedCollection.fromCounts( counts, { var:content.astype( dtype ) for ( var, dtype ), content in zip( components, contents ) } ) )
+        logger.debug( "Read %i events from entries %i to %i.", nSelected, firstEntry, firstEntry + n )
+        yield chunk
+
+def iterateValues( tree, read_variables, sequence, functions, chunkSize = 100000, selection = "(1)", sequenceArgs = (), functionArgs = () ):
+    ''' Run the sequence and evaluate functions = { name:func } chunk by chunk. Yields { name:value } for every selected event.
+    '''
+    vectorizedSequence = VectorizedSequence( sequence )
+    for chunk in readChunks( tree, read_variables, chunkSize = chunkSize, selection = selection ):
+        vectorizedSequence( chunk, *sequenceArgs )
+        values = { name:evaluate( func, chunk, *functionArgs ) for name, func in functions.items() }
+        for i in range( chunk.nEvents ):
+            yield { name:value[i] for name, value in values.items() }
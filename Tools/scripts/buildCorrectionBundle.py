@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+"""
+Convert the scale factor, prefiring and PU maps in Tools/data to the memory-mapped correction bundle that is read by
+Analysis.Tools.binnedCorrections instead of the ROOT files. Run again after changing the maps.
+
+Usage:
+buildCorrectionBundle.py [--output FILE] [--directories leptonSFData,photonSFData,...]
+"""
+
+# Standard imports
+import Analysis.Tools.binnedCorrections as binnedCorrections
+
+# Parser
+from optparse import OptionParser
+parser = OptionParser()
+parser.add_option('--logLevel',  choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET'], default='INFO', help="Log level for logging" )
+parser.add_option('--output', dest="output", default=binnedCorrections.bundleFile, help="Bundle file to write.")
+parser.add_option('--directories', dest="directories", default=",".join(binnedCorrections.bundleDirectories), help="Comma separated directories in Tools/data to convert.")
+
+(options,args) = parser.parse_args()
+
+# Logging
+import Analysis.Tools.logger as logger
+logger  = logger.get_logger(options.logLevel, logFile = None)
+
+nTables = binnedCorrections.buildBundle( options.output, [ d for d in options.directories.split(',') if d ] )
+logger.info( "Done. %i tables in %s", nTables, options.output )
@@ -8,8 +8,8 @@ hostname    = os.getenv("HOSTNAME")
 
 def checkRootFile( file ):
     logger.info("Checking root file: %s"%file)
-    from Analysis.Tools.helpers import checkRootFile, deepCheckRootFile, deepCheckWeight
-    valid = checkRootFile( file, checkForObjects=["Events"] ) and deepCheckRootFile( file ) and deepCheckWeight( file )
+    from Analysis.Tools.rootFileChecker import checkFileIsolated
+    valid, reason, entries = checkFileIsolated( file, checks = ['zombie', 'recovered', 'tree', 'map', 'weight'], treeName = "Events" )
     if valid:
         logger.info("Check done!")
     else:
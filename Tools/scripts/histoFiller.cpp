@@ -0,0 +1,117 @@
+/*
+   Fill many histograms in one loop over a tree. Used by Analysis/Tools/python/histoFiller.py
+
+   Every booking i has the expressions x[i] (and y[i] for TH2) and the selection sel[i], which includes the weight.
+   Expressions are TTreeFormulas, hence have the syntax of TTree::Draw (Sum$, Alt$, arrays, ...). Array expressions
+   are filled once per instance as in TSelectorDraw.
+
+   Returns the number of entries processed, or -1-i if the formulas of booking i could not be compiled.
+*/
+
+#include "TTree.h"
+#include "TEntryList.h"
+#include "TH1.h"
+#include "TH2.h"
+#include "TTreeFormula.h"
+#include "TTreeFormulaManager.h"
+
+#include <vector>
+#include <string>
+
+class histoFiller {
+
+  public:
+
+    static Long64_t fill( TTree* tree, const std::vector<TH1*>& histos, const std::vector<std::string>& x, const std::vector<std::string>& y, const std::vector<std::string>& sel, Long64_t firstEntry, Long64_t nEntries ) {
+
+      size_t nBookings = histos.size();
+      Long64_t lastEntry = tree->GetEntryList() ? tree->GetEntryList()->GetN() : tree->GetEntries();
+      if ( nEntries >= 0 && firstEntry + nEntries < lastEntry ) lastEntry = firstEntry + nEntries;
+      if ( firstEntry >= lastEntry || tree->LoadTree( tree->GetEntryNumber( firstEntry ) ) < 0 ) return 0;
+
+      std::vector<TTreeFormula*> fx( nBookings, 0 ), fy( nBookings, 0 ), fs( nBookings, 0 );
+      std::vector<TTreeFormulaManager*> managers( nBookings, 0 );
+      Long64_t result = 0;
+
+      for ( size_t i = 0; i < nBookings; i++ ) {
+        fx[i] = new TTreeFormula( "histoFiller_x", x[i].c_str(), tree );
+        if ( y[i].size() > 0 ) fy[i] = new TTreeFormula( "histoFiller_y", y[i].c_str(), tree );
+        fs[i] = new TTreeFormula( "histoFiller_sel", sel[i].c_str(), tree );
+        if ( fx[i]->GetNdim() == 0 || ( fy[i] && fy[i]->GetNdim() == 0 ) || fs[i]->GetNdim() == 0 ) {
+          result = -1 - (Long64_t) i;
+          break;
+        }
+        // same instances for all formulas of a booking
+        managers[i] = new TTreeFormulaManager();
+        managers[i]->Add( fx[i] );
+        if ( fy[i] ) managers[i]->Add( fy[i] );
+        managers[i]->Add( fs[i] );
+        managers[i]->Sync();
+      }
+
+      if ( result == 0 ) {
+        Int_t treeNumber = -1;
+        Double_t treeWeight = 1.;
+        for ( Long64_t i_entry = firstEntry; i_entry < lastEntry; i_entry++ ) {
+          Long64_t entry = tree->GetEntryNumber( i_entry );
+          if ( entry < 0 || tree->LoadTree( entry ) < 0 ) break;
+          if ( tree->GetTreeNumber() != treeNumber ) {
+            // next file of a chain
+            treeNumber = tree->GetTreeNumber();
+            treeWeight = tree->GetWeight();
+            for ( size_t i = 0; i < nBookings; i++ ) {
+              fx[i]->UpdateFormulaLeaves();
+              if ( fy[i] ) fy[i]->UpdateFormulaLeaves();
+              fs[i]->UpdateFormulaLeaves();
+            }
+          }
+          for ( size_t i = 0; i < nBookings; i++ ) fillEntry( histos[i], fx[i], fy[i], fs[i], managers[i], treeWeight );
+          result++;
+        }
+      }
+
+      for ( size_t i = 0; i < nBookings; i++ ) {
+        delete fx[i];
+        delete fy[i];
+        delete fs[i];
+      }
+      return result;
+    }
+
+  private:
+
+    static void fillHisto( TH1* h, TTreeFormula* fy, Double_t x, Double_t y, Double_t w ) {
+      if ( fy ) ( (TH2*) h )->Fill( x, y, w );
+      else h->Fill( x, w );
+    }
+
+    // as TSelectorDraw::ProcessFill and ProcessFillMultiple
+    static void fillEntry( TH1* h, TTreeFormula* fx, TTreeFormula* fy, TTreeFormula* fs, TTreeFormulaManager* manager, Double_t treeWeight ) {
+      if ( manager->GetMultiplicity() == 0 ) {
+        Double_t w = treeWeight * fs->EvalInstance( 0 );
+        if ( w == 0 ) return;
+        fillHisto( h, fy, fx->EvalInstance( 0 ), fy ? fy->EvalInstance( 0 ) : 0., w );
+        return;
+      }
+
+      Int_t nData = manager->GetNdata();
+      if ( nData <= 0 ) return;
+      bool selMultiple = fs->GetMultiplicity() != 0;
+      Double_t w = treeWeight * fs->EvalInstance( 0 );
+      if ( w == 0 && !selMultiple ) return;
+      // always evaluate instance 0 to load the branches
+      Double_t x0 = fx->EvalInstance( 0 );
+      Double_t y0 = fy ? fy->EvalInstance( 0 ) : 0.;
+      if ( w != 0 ) fillHisto( h, fy, x0, y0, w );
+
+      bool xMultiple = fx->GetMultiplicity() != 0;
+      bool yMultiple = fy && fy->GetMultiplicity() != 0;
+      for ( Int_t i = 1; i < nData; i++ ) {
+        if ( selMultiple ) {
+          w = treeWeight * fs->EvalInstance( i );
+          if ( w == 0 ) continue;
+        }
+        fillHisto( h, fy, xMultiple ? fx->EvalInstance( i ) : x0, yMultiple ? fy->EvalInstance( i ) : y0, w );
+      }
+    }
+};
@@ -1,18 +1,25 @@
 #!/usr/bin/env python
 """
 Usage:
-mergeCache.py <directory> 
+mergeCache.py <directory> [--nWorkers N] [--maxMemoryGB M]
 """
 
 # Standard imports
 import os
+import sys
+import time
+import traceback
 from Analysis.Tools.MergingDirDB import MergingDirDB
+from Analysis.Tools.ShardedDirDB import ShardedDirDB
 
 # Parser
 from optparse import OptionParser
 parser = OptionParser()
 parser.add_option('--logLevel',  choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET'], default='INFO', help="Log level for logging" )
 parser.add_option('--noDelete', dest="noDelete", default=False, action='store_true', help="Delete tmp files?")
+parser.add_option('--incremental', dest="incremental", default=False, action='store_true', help="Stream only new tmp files into the compacted segments instead of rewriting the merged file?")
+parser.add_option('--nWorkers', dest="nWorkers", default=1, type="int", help="Number of processes merging cache directories in parallel.")
+parser.add_option('--maxMemoryGB', dest="maxMemoryGB", default=None, type="float", help="Cap on the total virtual address space (RLIMIT_AS, not the resident memory) of all workers, split evenly. ROOT and numpy reserve much more address space than they use, so leave headroom. Directories that don't fit are reported and skipped.")
 
 (options,args) = parser.parse_args()
 
@@ -20,28 +27,92 @@ parser.add_option('--noDelete', dest="noDelete", default=False, action='store_tr
 import Analysis.Tools.logger as logger
 logger  = logger.get_logger(options.logLevel, logFile = None)
 
-def test_if_cache( directory ):
-    if os.path.isdir( directory ):
-        if 'merged' in os.listdir( directory ):
-            return True
-        if any([ x.startswith('tmp_') for x in os.listdir( directory ) ]):
-            return True
+def test_if_cache( filenames ):
+    ''' Decide from the file names (as given by os.walk) whether a directory is a cache.
+    '''
+    if 'merged' in filenames or 'compacted' in filenames or ShardedDirDB.marker in filenames:
+        return True
+    if any([ x.startswith('tmp_') for x in filenames ]):
+        return True
     return False
 
+def is_shard( dirname ):
+    return len( dirname ) == 2 and all( c in '0123456789abcdef' for c in dirname )
+
+def find_caches( directory ):
+    ''' Single walk over the tree. Does not descend into the internal directories of caches (segments and shards),
+        but into all others, which can hold more caches.
+    '''
+    dirs = []
+    for (dirpath, dirnames, filenames) in os.walk( directory ):
+        logger.debug( "Looking at %s", dirpath )
+        if test_if_cache( filenames ):
+            dirs.append( dirpath )
+            if ShardedDirDB.marker in filenames:
+                dirnames[:] = [ d for d in dirnames if not is_shard( d ) ]
+            else:
+                dirnames[:] = [ d for d in dirnames if d != 'segments' ]
+    return dirs
+
+def limit_memory( maxMemoryGB ):
+    ''' Limit the (virtual) address space of the current process.
+    '''
+    if maxMemoryGB is None: return
+    import resource
+    limit = int( maxMemoryGB*1024**3 )
+    resource.setrlimit( resource.RLIMIT_AS, ( limit, limit ) )
+
+def merge( dir ):
+    ''' Merge one cache directory. Returns (directory, success, seconds).
+    '''
+    start = time.time()
+    try:
+        if os.path.exists( os.path.join( dir, ShardedDirDB.marker ) ):
+            db = ShardedDirDB( dir )
+            db.merge( clear = not options.noDelete )
+        else:
+            db = MergingDirDB( dir, init_on_start = False )
+            db.merge( clear = not options.noDelete, incremental = options.incremental )
+    except MemoryError:
+        logger.error( "Out of memory when merging %s. Try --incremental or fewer workers.\n%s", dir, traceback.format_exc() )
+        return dir, False, time.time() - start
+    except Exception:
+        logger.error( "Error when merging %s:\n%s", dir, traceback.format_exc() )
+        return dir, False, time.time() - start
+    return dir, True, time.time() - start
+
 if __name__ == '__main__':
     if not len(args) == 1:
         raise Exception("Only one argument accepted! Instead this was given: %s"%args)
 
-    dirs = []
-    if test_if_cache( args[0] ):
-        dirs.append( args[0] )
-    for (dirpath, dirnames, filenames) in os.walk(args[0]):
-        for dirname in dirnames:
-            print os.path.join( args[0], dirpath, dirname )
-            if test_if_cache( os.path.join( args[0], dirpath, dirname ) ):
-                dirs.append( os.path.join( args[0], dirpath, dirname ) )
-    
-    for dir in dirs:
-        logger.info( "Now merging %s", dir )
-        db = MergingDirDB( dir )
-        db.merge( clear = not options.noDelete )
+    dirs = find_caches( args[0] )
+    logger.info( "Found %i cache directories in %s", len(dirs), args[0] )
+
+    # share the memory cap among the workers
+    maxMemoryGB = options.maxMemoryGB/options.nWorkers if options.maxMemoryGB is not None else None
+
+    start = time.time()
+    if options.nWorkers>1:
+        from multiprocessing import Pool
+        pool    = Pool( processes = options.nWorkers, initializer = limit_memory, initargs = ( maxMemoryGB, ) )
+        results = pool.imap_unordered( merge, dirs )
+    else:
+        limit_memory( maxMemoryGB )
+        results = ( merge( dir ) for dir in dirs )
+
+    failed = []
+    for i_dir, ( dir, success, seconds ) in enumerate( results ):
+        if success:
+            logger.info( "[%i/%i] Merged %s in %3.1fs", i_dir+1, len(dirs), dir, seconds )
+        else:
+            logger.warning( "[%i/%i] Failed to merge %s after %3.1fs", i_dir+1, len(dirs), dir, seconds )
+            failed.append( dir )
+
+    if options.nWorkers>1:
+        pool.close()
+        pool.join()
+
+    logger.info( "Merged %i cache directories in %3.1fs.", len(dirs)-len(failed), time.time()-start )
+    if len(failed)>0:
+        logger.error( "Failed: %s", ", ".join( failed ) )
+        sys.exit(1)
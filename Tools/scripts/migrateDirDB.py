@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+Move the entries of a DirDB from the builtin hash of the key to its stable hash.
+The files don't contain the keys, hence they have to be provided as a pickled list.
+Run this with the same python (CMSSW release) that wrote the cache, because the builtin hash is not portable.
+
+Usage:
+migrateDirDB.py <directory> --keys keys.pkl [--dryRun]
+"""
+
+# Standard imports
+import os
+import pickle
+from Analysis.Tools.DirDB import DirDB
+
+# Parser
+from optparse import OptionParser
+parser = OptionParser()
+parser.add_option('--logLevel',  choices=['CRITICAL', 'ERROR', 'WARNING', 'INFO', 'DEBUG', 'TRACE', 'NOTSET'], default='INFO', help="Log level for logging" )
+parser.add_option('--keys', dest="keys", default=None, help="Pickle file with the list of keys to migrate.")
+parser.add_option('--dryRun', dest="dryRun", default=False, action='store_true', help="Only count the legacy entries?")
+
+(options,args) = parser.parse_args()
+
+# Logging
+import Analysis.Tools.logger as logger
+logger  = logger.get_logger(options.logLevel, logFile = None)
+
+def legacy_files( directory ):
+    ''' All files in the legacy layout <first 4 characters of hash>/<rest>.
+    '''
+    result = set()
+    for subdir in os.listdir( directory ):
+        if len(subdir)!=4 or not os.path.isdir( os.path.join( directory, subdir ) ): continue
+        for f in os.listdir( os.path.join( directory, subdir ) ):
+            result.add( os.path.join( subdir, f ) )
+    # short hashes are not in a sub directory
+    for f in os.listdir( directory ):
+        if os.path.isfile( os.path.join( directory, f ) ) and f.lstrip('-').isdigit():
+            result.add( f )
+    return result
+
+if __name__ == '__main__':
+    if not len(args) == 1:
+        raise Exception("Only one argument accepted! Instead this was given: %s"%args)
+
+    db = DirDB( args[0], legacy = True )
+    legacy = legacy_files( args[0] )
+    logger.info( "Found %i legacy entries in %s", len(legacy), args[0] )
+
+    if options.keys is None:
+        logger.info( "No keys provided (--keys). Nothing to do." )
+        exit(0)
+
+    with open( options.keys ) as _f:
+        keys = pickle.load( _f )
+    logger.info( "Loaded %i keys from %s", len(keys), options.keys )
+
+    n_migrated = 0
+    for key in keys:
+        legacy_filename = db.legacy_filename( key )
+        if legacy_filename not in legacy: continue
+        if options.dryRun:
+            logger.debug( "Would migrate key %r", key )
+        elif not db.migrate_key( key ):
+            logger.warning( "Could not migrate key %r: Found an entry under the stable hash.", key )
+            continue
+        legacy.remove( legacy_filename )
+        n_migrated += 1
+
+    logger.info( "%s %i entries. %i legacy entries are left for which no key was provided.", "Would migrate" if options.dryRun else "Migrated", n_migrated, len(legacy) )
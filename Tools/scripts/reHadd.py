@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 import os
 from Analysis.Tools.helpers import  checkRootFile
+from Analysis.Tools.rootFileChecker import RootFileChecker
 from subprocess import call
 
 def get_parser():
@@ -61,6 +62,13 @@ def get_parser():
         action='store_true',
         help="Delete originals?")
 
+    argParser.add_argument('--nWorkers',
+        action='store',
+        type=int,
+        default=8,
+        help="Number of parallel workers for checking the input files."
+        )
+
     argParser.add_argument('--logLevel', 
         action='store',
         nargs='?',
@@ -81,7 +89,7 @@ import Analysis.Tools.logger as logger
 logger = logger.get_logger(options.logLevel, logFile = None )
 
 # Walk the directory structure and group files in 'jobs' of [f1_0.root, f1_1.root, ...]  tootalling to approx. sizeGB
-jobs = []
+candidates = []
 for dirName, subdirList, fileList in os.walk(options.dir):
     rootFiles = []
     for f in fileList:
@@ -95,14 +103,21 @@ for dirName, subdirList, fileList in os.walk(options.dir):
                         to_skip = True
                         break
                 if to_skip: continue
-                isOK =  checkRootFile( full_filename, checkForObjects = [options.treeName]) \
-                        if options.treeName is not None else checkRootFile( full_filename )
-                if isOK:
-                    rootFiles.append( f )
-                else:
-                    logger.warning( "File %s does not look OK. Checked for tree: %r", full_filename, options.treeName )
+                rootFiles.append( f )
             else:
                 logger.info( "Found '_reHadd_' in file %s in %s. Skipping.", full_filename, dirName )
+    candidates.append( (dirName, rootFiles) )
+
+# check all files in parallel
+checker = RootFileChecker( checks = ['zombie', 'recovered'] + ( ['tree'] if options.treeName is not None else [] ), treeName = options.treeName, nWorkers = options.nWorkers )
+isGood  = checker.check( [ os.path.join(dirName, f) for dirName, rootFiles in candidates for f in rootFiles ] )
+
+jobs = []
+for dirName, rootFiles in candidates:
+    for f in rootFiles:
+        if not isGood[os.path.join(dirName, f)]:
+            logger.warning( "File %s does not look OK. Checked for tree: %r", os.path.join(dirName, f), options.treeName )
+    rootFiles = [ f for f in rootFiles if isGood[os.path.join(dirName, f)] ]
     job = []
     jobsize = 0
     for fname in rootFiles: